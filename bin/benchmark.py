@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable=C0103,C0111
+
+"""
+
+Benchmark the staplestatter scoring hot paths on synthetic designs of controlled size.
+
+The designs are generated with staplestatter.synthetic and loaded with cadnanojson, so
+neither cadnano nor Qt is needed. For each design size, the following are timed:
+    hyb_pattern.length/seq/TM   cadnanoreader.get_oligo_hyb_pattern (Tm cache cleared before each run)
+    score.<scoremethod>         every statutils scoremethod, one oligo at a time, on the TM patterns
+    batch.<scoremethod>         the vectorized statutils.batch_* version, if available
+    frequencies                 statutils.frequencies on valleyscore and maxlength scores
+    process_statspecs           staplestatter.process_statspecs with the Agg backend (needs matplotlib)
+    rotation.init/scan          rotation.RotationScorer setup and scan of --rotation-offsets offsets
+    savestats/loadstats.yaml    staplestatter.savestats/loadstats with two statspecs' scores, as yaml
+    savestats/loadstats.npz     the same as a scorestore.ScoreTable, including the TM hyb patterns
+Before that, startup times are measured (design "startup"), each in a fresh python process:
+    import.python               python interpreter startup, for reference
+    import.<module>             python -c "import staplestatter.<module>"
+    cli.<script>                python bin/<script>.py --help
+
+Results are written as json. If a baseline json file (from a previous run) is given, each timing
+is compared with the baseline and timings more than --tolerance slower are reported as regressions.
+
+Example usage:
+    $> python bin/benchmark.py --output before.json
+    $> python bin/benchmark.py --sizes 10x100 100x2000 --baseline before.json --output after.json
+    $> python bin/benchmark.py --only "hyb_pattern|rotation" --repeat 5
+    $> python bin/benchmark.py --only "import|cli" --repeat 10
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import shutil
+import atexit
+
+BINDIR = os.path.dirname(os.path.realpath(__file__))
+ROOTDIR = os.path.dirname(BINDIR)
+sys.path.insert(0, ROOTDIR)  # Add Staplestatter project root to the PATH.
+
+from staplestatter import cadnanoreader
+from staplestatter import statutils
+from staplestatter import synthetic
+from staplestatter import batchutils
+from staplestatter import oligo_utils
+from staplestatter.meltingtemp import get_tm_engine
+
+DEFAULT_SIZES = ["10x100", "100x2000", "1000x20000"]
+SCOREMETHODS = ('leftrightmaxdiff', 'valleyfinder', 'valleysize', 'valleydepth', 'valleyscore',
+                'isglobalmax', 'globalmaxcount', 'maxlength')
+HYB_KWARGS = {'Mg': 10}
+IMPORT_MODULES = ('staplestatter', 'cadnanoreader', 'oligo_utils', 'sequtils', 'fileutils', 'rotation', 'plotutils')
+CLI_SCRIPTS = ('scaffold_rotation', 'draw_strand_TM')
+
+
+class Skip(Exception):
+    """ Raised by a benchmark setup if the benchmark cannot be run, e.g. due to missing libraries. """
+    pass
+
+
+class quiet_stdout(object):
+    """ Context manager discarding everything printed to stdout (the scoring functions are chatty). """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._stdout = None
+        self._devnull = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._stdout, self._devnull = sys.stdout, open(os.devnull, 'w')
+            sys.stdout = self._devnull
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            sys.stdout = self._stdout
+            self._devnull.close()
+
+
+def parse_size(size):
+    """ Parse size string "<helices>x<staples>", e.g. "100x2000". """
+    try:
+        n_helices, n_staples = (int(val) for val in size.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Size must be given as <helices>x<staples>, e.g. 100x2000, not %r" % size)
+    return n_helices, n_staples
+
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Staplestatter benchmarks on synthetic designs.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[parse_size(s) for s in DEFAULT_SIZES],
+                        help="Design sizes to benchmark, as <helices>x<staples>. Default: %s." % " ".join(DEFAULT_SIZES))
+    parser.add_argument("--repeat", "-r", type=int, default=3,
+                        help="Run each benchmark this many times; the best and median times are reported.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic designs and sequences.")
+    parser.add_argument("--only", help="Only run benchmarks whose name matches this regular expression.")
+    parser.add_argument("--rotation-offsets", type=int, default=100,
+                        help="Number of offsets to score in the rotation scan benchmark.")
+    parser.add_argument("--output", "-o", default="benchmark.json", help="Write results to this json file.")
+    parser.add_argument("--baseline", "-b", help="Compare results with this json file from a previous run.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Report a regression if a benchmark is more than this fraction slower than baseline.")
+    parser.add_argument("--min-time", type=float, default=0.001,
+                        help="Ignore differences for benchmarks faster than this (seconds) in both runs.")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 if any regressions are found.")
+    parser.add_argument("--show-output", action="store_true",
+                        help="Do not suppress output printed by the benchmarked functions.")
+    return parser.parse_args(argv)
+
+
+def get_benchmarks(part, args):
+    """
+    Return list of (name, setup, fun) benchmarks for part.
+    setup() is called (untimed) before each run of fun(); it may raise Skip.
+    """
+    tm_engine = get_tm_engine(**HYB_KWARGS)
+    patterns = {}
+
+    def tm_patterns():
+        if 'TM' not in patterns:
+            patterns['TM'] = {key: pattern for key, pattern in
+                              cadnanoreader.get_oligo_hyb_pattern(part, method="TM", **HYB_KWARGS).items() if pattern}
+        return patterns['TM']
+
+    def require_numpy():
+        if statutils.np is None:
+            raise Skip("numpy not available")
+
+    benchmarks = []
+    for method, hyb_kwargs in (("length", {}), ("seq", {}), ("TM", HYB_KWARGS)):
+        benchmarks.append(("hyb_pattern." + method, tm_engine.clear_cache,
+                           lambda method=method, hyb_kwargs=hyb_kwargs:
+                           cadnanoreader.get_oligo_hyb_pattern(part, method=method, **hyb_kwargs)))
+    for name in SCOREMETHODS:
+        scoremethod = getattr(statutils, name)
+        benchmarks.append(("score." + name, tm_patterns,
+                           lambda scoremethod=scoremethod: {key: scoremethod(pattern)
+                                                            for key, pattern in tm_patterns().items()}))
+        if name in statutils.BATCH_SCOREMETHODS:
+            benchmarks.append(("batch." + name, lambda: require_numpy() or tm_patterns(),
+                               lambda name=name: statutils.batch_score_hyb_patterns(tm_patterns(), name)))
+
+    def scores(name):
+        if 'scores.' + name not in patterns:
+            scoremethod = getattr(statutils, name)
+            patterns['scores.' + name] = {key: scoremethod(pattern) for key, pattern in tm_patterns().items()}
+        return patterns['scores.' + name]
+
+    benchmarks.append(("frequencies.valleyscore", lambda: scores('valleyscore'),
+                       lambda: statutils.frequencies(scores('valleyscore'))))
+    benchmarks.append(("frequencies.maxlength", lambda: scores('maxlength'),
+                       lambda: statutils.frequencies(scores('maxlength'), binning=int)))
+
+    # process_statspecs, headless:
+    directive = {'figure': {'newfigure': True}, 'plot_mode': 'headless',
+                 'statspecs': [{'scoremethod': 'maxlength', 'hyb_method': 'length'},
+                               {'scoremethod': 'valleyscore', 'hyb_method': 'TM', 'hyb_kwargs': HYB_KWARGS},
+                               {'scoremethod': 'globalmaxcount', 'hyb_method': 'TM', 'hyb_kwargs': HYB_KWARGS}]}
+
+    def statspecs_setup():
+        from staplestatter import plotutils
+        pyplot = plotutils.get_pyplot('headless')
+        if pyplot is None:
+            raise Skip("matplotlib not available")
+        pyplot.close('all')
+        cadnanoreader.get_hyb_pattern_index(part).invalidate()
+        tm_engine.clear_cache()
+
+    def statspecs_run():
+        from staplestatter import staplestatter
+        return staplestatter.process_statspecs(directive, part=part, designname=part.name)
+
+    benchmarks.append(("process_statspecs", statspecs_setup, statspecs_run))
+
+    # Rotation scan:
+    rotation_state = {}
+
+    def rotation_setup():
+        require_numpy()
+        from staplestatter import rotation
+        scaffold = next(oligo for oligo in part.oligos() if not oligo.isStaple())
+        rotation_state['seq'] = synthetic.random_sequence(scaffold.length(), seed=args.seed)
+        rotation_state['module'] = rotation
+
+    def rotation_init():
+        rotation_state['scorer'] = rotation_state['module'].RotationScorer(part, rotation_state['seq'])
+
+    def rotation_scan_setup():
+        rotation_setup()
+        tm_engine.clear_cache()
+        if 'scorer' not in rotation_state:
+            rotation_init()
+
+    benchmarks.append(("rotation.init", rotation_setup, rotation_init))
+    benchmarks.append(("rotation.scan", rotation_scan_setup,
+                       lambda: rotation_state['scorer'].scores(range(args.rotation_offsets))))
+
+    # Saving and loading scores:
+    stats_dir = tempfile.mkdtemp(prefix="staplestatter-benchmark-")
+    atexit.register(shutil.rmtree, stats_dir, True)
+
+    def stats():
+        return [scores('valleyscore'), scores('maxlength')]
+
+    for ext in ("yaml", "npz"):
+        filepath = os.path.join(stats_dir, "%s.%s" % (part.name, ext))
+
+        def save_stats(filepath=filepath):
+            from staplestatter import staplestatter
+            staplestatter.savestats(stats(), filepath, statspecs=directive['statspecs'][1:],
+                                    hyb_patterns=[tm_patterns(), tm_patterns()])
+
+        def load_stats(filepath=filepath):
+            from staplestatter import staplestatter
+            return staplestatter.loadstats(filepath)
+
+        setup = (lambda: stats()) if ext == "yaml" else (lambda: require_numpy() or stats())
+        benchmarks.append(("savestats." + ext, setup, save_stats))
+        benchmarks.append(("loadstats." + ext, lambda setup=setup, save_stats=save_stats: setup() or save_stats(),
+                           load_stats))
+
+    # Applying sequences, one oligo at a time and in one pass (the design's own sequences, so it is unchanged):
+    assignments = []
+
+    def assignments_setup():
+        if not assignments:
+            assignments.extend((oligo, oligo.sequence()) for oligo in part.oligos() if not oligo.isStaple())
+
+    def apply_per_oligo():
+        for oligo, seq in assignments:
+            oligo.applySequence(seq, use_undostack=False)
+
+    benchmarks.append(("apply_sequences.per_oligo", assignments_setup, apply_per_oligo))
+    benchmarks.append(("apply_sequences.bulk", assignments_setup,
+                       lambda: oligo_utils.apply_oligo_sequences(part, assignments)))
+    if args.only:
+        benchmarks = [benchmark for benchmark in benchmarks if re.search(args.only, benchmark[0])]
+    return benchmarks
+
+
+def get_startup_benchmarks(args):
+    """
+    Return list of (name, setup, fun) benchmarks timing module imports and command line startup.
+    Each run is a new python process, so the times include interpreter startup (see import.python).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOTDIR] + [os.environ.get('PYTHONPATH', '')]))
+
+    def run_python(*python_args):
+        def fun():
+            proc = subprocess.Popen([sys.executable] + list(python_args), cwd=ROOTDIR, env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _, err = proc.communicate()
+            if proc.returncode != 0:
+                raise Skip("exit code %s: %s" % (proc.returncode, (err.decode().strip().splitlines() or [''])[-1]))
+        return fun
+
+    def no_setup():
+        pass
+
+    benchmarks = [("import.python", no_setup, run_python("-c", "pass"))]
+    benchmarks += [("import.%s" % module, no_setup, run_python("-c", "import staplestatter.%s" % module))
+                   for module in IMPORT_MODULES]
+    benchmarks += [("cli.%s" % script, no_setup, run_python(os.path.join(BINDIR, script + ".py"), "--help"))
+                   for script in CLI_SCRIPTS]
+    if args.only:
+        benchmarks = [benchmark for benchmark in benchmarks if re.search(args.only, benchmark[0])]
+    return benchmarks
+
+
+def run_benchmark(setup, fun, repeat, quiet=True):
+    """ Run fun() repeat times, calling setup() before each run. Returns dict with timings. """
+    walls, cpus = [], []
+    for _ in range(repeat):
+        with quiet_stdout(quiet):
+            setup()
+            wall, cpu = time.perf_counter(), time.process_time()
+            fun()
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+    walls.sort()
+    return dict(best=walls[0], median=walls[len(walls)//2], cpu=min(cpus), repeat=repeat)
+
+
+def run_benchmarks(args):
+    """ Run all benchmarks for all design sizes, returning list of result dicts. """
+    results = []
+    startup_benchmarks = get_startup_benchmarks(args)
+    if startup_benchmarks:
+        print("\nStartup (new python process per run):")
+    for name, setup, fun in startup_benchmarks:
+        result = dict(design="startup", name=name, n_helices=0, n_staples=0)
+        try:
+            result.update(run_benchmark(setup, fun, args.repeat, quiet=not args.show_output), status='ok')
+            print("  %-28s %9.4f s (median %.4f s)" % (name, result['best'], result['median']))
+        except Skip as e:
+            result.update(status="skipped: %s" % e)
+            print("  %-28s skipped (%s)" % (name, e))
+        results.append(result)
+    for n_helices, n_staples in args.sizes:
+        start = time.time()
+        with quiet_stdout(not args.show_output):
+            part = synthetic.make_synthetic_part(n_helices, n_staples, seed=args.seed)
+        n_oligos = sum(1 for oligo in part.oligos() if oligo.isStaple())
+        print("\nDesign %s: %s helices, %s staples (generated in %.2f s)"
+              % (part.name, n_helices, n_oligos, time.time() - start))
+        for name, setup, fun in get_benchmarks(part, args):
+            result = dict(design=part.name, name=name, n_helices=n_helices, n_staples=n_oligos)
+            try:
+                result.update(run_benchmark(setup, fun, args.repeat, quiet=not args.show_output), status='ok')
+                print("  %-28s %9.4f s (median %.4f s)" % (name, result['best'], result['median']))
+            except Skip as e:
+                result.update(status="skipped: %s" % e)
+                print("  %-28s skipped (%s)" % (name, e))
+            results.append(result)
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.25, min_time=0.001):
+    """
+    Compare results with baseline results (both lists of result dicts).
+    Returns list of comparison dicts, with ratio = best / baseline best.
+    """
+    baseline_best = {(res['design'], res['name']): res['best'] for res in baseline if res.get('status') == 'ok'}
+    comparisons = []
+    for res in results:
+        key = (res['design'], res['name'])
+        if res.get('status') != 'ok' or key not in baseline_best:
+            continue
+        base = baseline_best[key]
+        ratio = res['best'] / base if base > 0 else float('inf')
+        regression = ratio > 1 + tolerance and max(res['best'], base) > min_time
+        comparisons.append(dict(design=res['design'], name=res['name'], baseline=base, best=res['best'],
+                                ratio=ratio, regression=regression))
+    return comparisons
+
+
+def get_meta(args):
+    """ Return dict with information about the benchmark run. """
+    meta = dict(date=time.strftime("%Y-%m-%d %H:%M:%S"), python=platform.python_version(),
+                platform=platform.platform(), repeat=args.repeat, seed=args.seed,
+                rotation_offsets=args.rotation_offsets)
+    if statutils.np is not None:
+        meta['numpy'] = statutils.np.__version__
+    return meta
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    output = dict(meta=get_meta(args), results=results)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        comparisons = compare_results(results, baseline['results'], args.tolerance, args.min_time)
+        output.update(baseline=args.baseline, comparison=comparisons)
+        print("\nComparison with baseline %s:" % args.baseline)
+        print(batchutils.format_summary_table(
+            [dict(comp, baseline="%.4f" % comp['baseline'], best="%.4f" % comp['best'],
+                  regression="REGRESSION" if comp['regression'] else "") for comp in comparisons],
+            columns=['design', 'name', 'baseline', 'best', 'ratio', 'regression']))
+        regressions = [comp for comp in comparisons if comp['regression']]
+        print("\n%s regressions (more than %.0f%% slower)." % (len(regressions), args.tolerance*100))
+    with open(args.output, 'w') as fp:
+        json.dump(output, fp, indent=2)
+    print("\nResults saved to file:", args.output)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -41,20 +41,10 @@ import argparse
 import webbrowser
 #import json
 #import time
-import yaml
 import base64
 from six import string_types  # To support both python2 and python3.
 #from operator import itemgetter
-try:
-    import svgwrite     # pylint: disable=F0401
-except ImportError:
-    sys.path.append(os.path.normpath(r"C:\Users\scholer\Dev\src-repos\my-forked-repos\svgwrite"))
-    import svgwrite     # pylint: disable=F0401
-try:
-    from PIL import Image
-except ImportError:
-    print("PIL (Python Image Library) or Pillow not available -- will use alternative function to get image size.")
-from Bio.SeqUtils.MeltingTemp import Tm_NN
+# yaml, svgwrite and PIL are imported by the functions that need them, to keep startup (e.g. --help) fast.
 import logging
 logger = logging.getLogger(__name__)
 #import math
@@ -78,10 +68,7 @@ sys.path.insert(0, os.path.dirname(BINDIR))  # Add Staplestatter root dir to the
 
 
 
-# Cadnano library imports
-from cadnano.document import Document
-from cadnano.fileio.nnodecode import decode #, decodeFile
-from cadnano.part.part import Part
+# Cadnano is imported by fileutils.load_doc_from_file when loading a design.
 
 # Staplestatter imports
 from staplestatter.cadnanoreader import get_part, getstrandhybridizationregions
@@ -90,6 +77,8 @@ from staplestatter import statutils
 from staplestatter.fileutils import load_doc_from_file, load_json_or_yaml, ok_to_write_to_file
 from staplestatter.oligo_utils import apply_sequences, get_oligo_criteria_list, get_matching_oligos
 from staplestatter.sequtils import load_seq
+from staplestatter.meltingtemp import get_tm_engine
+from staplestatter import batchutils
 #from staplestatter import plotutils
 
 # Constants:
@@ -98,7 +87,6 @@ VERBOSE = 0
 
 
 import struct
-import imghdr
 
 def get_image_size(fname):
     '''
@@ -107,6 +95,7 @@ def get_image_size(fname):
     http://stackoverflow.com/questions/8032642/how-to-obtain-image-size-using-standard-python-class-without-using-external-lib
     http://stackoverflow.com/questions/15800704/python-get-image-size-without-loading-image-into-memory
     '''
+    import imghdr
     fhandle = open(fname, 'rb')
     head = fhandle.read(24)
     if len(head) != 24:
@@ -156,7 +145,8 @@ def parse_args(argv=None):
     #parser.add_argument("--seqfile", "-s", nargs=1, required=True, help="File containing the sequences")
     parser.add_argument("seqfile", help="File containing the sequences")
 
-    parser.add_argument("--seqfileformat", help="File format for the sequence file.")
+    parser.add_argument("--seqfileformat", help="File format for the sequence file: txt, fasta, genbank, yaml or json "
+                        "(default: determined from the file extension).")
 
     parser.add_argument("--offset",
                         help="Offset the sequence by this number of bases (positive or negative). "\
@@ -205,7 +195,7 @@ def parse_args(argv=None):
     parser.add_argument('--no-embed', dest='embed', action='store_false',
                         help="Do not embed image data in svg file, link to the file instead. (default is to embed)")
     parser.add_argument('--png-scale', help="Scale the png background by this amount. "
-                        "Can be given as float (0.1, 2.5) or percentage (10%, 250%).")
+                        "Can be given as float (0.1, 2.5) or percentage (10%%, 250%%).")
 
     parser.add_argument('--openwebbrowser', action='store_true', default=None,
                         help="Open annotated svg file in default webbrowser. (Default is not to.)")
@@ -217,6 +207,12 @@ def parse_args(argv=None):
 
 
     # NOTE: Windows does not support wildcard expansion in the default command line prompt!
+    parser.add_argument("--batch-jobs", type=int,
+                        help="Process the cadnano files in parallel using this many worker processes "
+                        "(0 = one per CPU) and print a summary table at the end.")
+    parser.add_argument("--summary-file",
+                        help="Save the batch summary table to this file (.csv or .tsv).")
+
     parser.add_argument("cadnano_files", nargs="+", metavar="cadnano_file",
                         help="One or more cadnano design files (.json) to apply sequence(s) to.")
 
@@ -244,8 +240,9 @@ def process_args(argns=None, argv=None):
         _, argns = parse_args(argv)
     args = argns.__dict__.copy()
     if args.get("config"):
+        import yaml
         with open(args["config"]) as fp:
-            cfg = yaml.load(fp)
+            cfg = yaml.safe_load(fp)
         args.update(cfg)
     # On windows, we have to expand *.json manually:
     file_pattern_matches = [(pattern, glob.glob(pattern)) for pattern in args['cadnano_files']]
@@ -288,7 +285,7 @@ def ensure_numeric(inval, scalefactor=None, sf_lim=None, converter=None):
         >>> ensure_numeric("0.146, 0.16, 177.8%", [100, 200, 300.0]) # scalefactor as a sequence
         [15, 32, 533.4]   # mixed types
     """
-    print("ensure_numeric(%s, scalefactor=%s, sf_lim=%s, converter=%s)" % (inval, scalefactor, sf_lim, converter))
+    logger.debug("ensure_numeric(%s, scalefactor=%s, sf_lim=%s, converter=%s)", inval, scalefactor, sf_lim, converter)
     if isinstance(scalefactor, string_types):
         scalefactor = ensure_numeric(scalefactor)
     if converter is None:
@@ -296,9 +293,8 @@ def ensure_numeric(inval, scalefactor=None, sf_lim=None, converter=None):
             # Do not infer converter if scalefactor is a sequence:
             converter = (lambda x: int(round(x))) if isinstance(scalefactor, int) else float
     if isinstance(inval, (float, int)):
-        print("Inval is numeric:", inval)
         outval = scalefactor*inval if (scalefactor is not None and (inval is not None or inval < sf_lim)) else inval
-        print("Outval is:", outval)
+        logger.debug("Inval %s is numeric, outval is: %s", inval, outval)
         return converter(outval) if converter else outval
     if isinstance(inval, string_types):
         if ', ' in inval:
@@ -307,9 +303,8 @@ def ensure_numeric(inval, scalefactor=None, sf_lim=None, converter=None):
             return ensure_numeric(inval, scalefactor, sf_lim, converter)
         outval = float(inval.strip('%'))/100 if '%' in inval else float(inval)
         # Apply scalefactor:
-        print("Here")
         if scalefactor is not None and (sf_lim is None or (outval < sf_lim or '%' in inval)):
-            print("Applying scalefactor to outval: %s*%s" % (scalefactor, outval))
+            logger.debug("Applying scalefactor to outval: %s*%s", scalefactor, outval)
             outval = scalefactor*outval
         return converter(outval) if converter else outval
     else:
@@ -375,6 +370,11 @@ def draw_strand_TMs(part, svgfilename, params, **kwargs):
     # svgargs.update({k: v for k, v in kwargs.items() if v is not None})
 
     # Create svg document:
+    try:
+        import svgwrite     # pylint: disable=F0401
+    except ImportError:
+        sys.path.append(os.path.normpath(r"C:\Users\scholer\Dev\src-repos\my-forked-repos\svgwrite"))
+        import svgwrite     # pylint: disable=F0401
     dwg = svgwrite.Drawing(svgfilename, profile='tiny') #, **size)      # size can apparently not be specified here
     # set cadnano canvas size:
     canvas_size = {k: v*ln #unit(v)
@@ -403,12 +403,15 @@ def draw_strand_TMs(part, svgfilename, params, **kwargs):
             imghref = os.path.relpath(pngfile, start=os.path.dirname(svgfilename))
             logger.debug("Linking to png file %s in svg file:", imghref)
         try:
+            from PIL import Image
+        except ImportError:
+            print("PIL (Python Image Library) or Pillow not available -- will use alternative function to get image size.")
+            imgwidth, imgheight = get_image_size(pngfile)
+        else:
             pngimage = Image.open(pngfile)
             # image size, c.f. http://stackoverflow.com/questions/15800704/python-get-image-size-without-loading-image-into-memory
             imgwidth, imgheight = pngimage.size
             pngimage.fp.close()
-        except NameError:
-            imgwidth, imgheight = get_image_size(pngfile)
         # Using size in percentage doesn't work...
         # If excluded they default to 0, and if either is 0 then image is not rendered.
         # However, maybe you should use SVG CSS instead? That might also be better to apply document-wide stuf
@@ -443,13 +446,14 @@ def draw_strand_TMs(part, svgfilename, params, **kwargs):
         leftmargin = svgargs["margins"][0]
 
     # Add TMs:
+    tm_engine = get_tm_engine(**kwargs)
     for oligo in oligos:
         for strand in oligo.strand5p().generator3pStrand():
             # seq = strand.sequence() # primitive way, assuming full complementarity:
             hyb_regions = getstrandhybridizationregions(strand)
             startIdx = strand.idxs()[0]   # strand._base_idx_low
             hyb_seqs = (strand.sequence()[lowIdx-startIdx:highIdx-startIdx+1] for lowIdx, highIdx in hyb_regions)
-            hyb_TMs = [Tm_NN(seq, **kwargs) for seq in hyb_seqs]
+            hyb_TMs = [tm_engine.tm(seq) for seq in hyb_seqs]
             for hyb_idxs, TM in zip(hyb_regions, hyb_TMs):
                 text = tmgroup.add(dwg.text(svgargs['tmfmt'].format(TM=TM)))
                 # Position:  (x-axis is left-to-right, y-axis is up-to-down.)
@@ -483,6 +487,31 @@ def draw_strand_TMs(part, svgfilename, params, **kwargs):
 
 
 
+def process_cadnano_file(cadnano_file, args, seqs):
+    """
+    Load cadnano_file, apply sequences and draw the strand melting temperatures to svg file.
+    Returns a dict with summary values for the design.
+    """
+    print("\nDrawing strand melting temperatures for cadnano file", cadnano_file)
+    design = os.path.splitext(os.path.basename(cadnano_file))[0]
+    svg_outputfn = args["svg_filename"].format(design=design,
+                                               cadnano_file=cadnano_file,
+                                               seqfile=args["seqfile"])
+    # 1. Load design and apply sequence:
+    print(" - Loading design:", design)
+    doc = load_doc_from_file(cadnano_file)
+    print(cadnano_file, "loaded!")
+    part = get_part(doc)
+    apply_sequences(part, seqs, offset=args.get("offset")) # global offset
+    dwg = draw_strand_TMs(part, svg_outputfn, args)
+    dwg.save()
+    logger.info("Annotated gel saved to file: %s", dwg.filename)
+    if args["openwebbrowser"]:
+        webbrowser.open(dwg.filename)
+    annotations = next(elem for elem in dwg.elements if elem.attribs.get('id') == 'Annotations')
+    return {'design': design, 'svg_file': dwg.filename, 'TM_annotations': len(annotations.elements)}
+
+
 def main(argv=None):
     logging.basicConfig(level=10)
     args = process_args(None, argv)
@@ -502,25 +531,19 @@ def main(argv=None):
 
     seqs = load_seq(args)
 
-    #
-    for cadnano_file in args["cadnano_files"]:
-        print("\nDrawing strand melting temperatures for cadnano file", cadnano_file)
-        design = os.path.splitext(os.path.basename(cadnano_file))[0]
-        svg_outputfn = args["svg_filename"].format(design=design,
-                                                   cadnano_file=cadnano_file,
-                                                   seqfile=args["seqfile"])
-        # 1. Load design and apply sequence:
-        print(" - Loading design:", design)
-        doc = load_doc_from_file(cadnano_file)
-        print(cadnano_file, "loaded!")
-        part = get_part(doc)
-        apply_sequences(part, seqs, offset=args.get("offset")) # global offset
-        dwg = draw_strand_TMs(part, svg_outputfn, args)
-        dwg.save()
-        logger.info("Annotated gel saved to file: %s", dwg.filename)
-        if args["openwebbrowser"]:
-            webbrowser.open(dwg.filename)
+    if args.get('batch_jobs') is not None:
+        # Process the files in parallel, one file per worker process:
+        results = batchutils.run_batch(process_cadnano_file, args["cadnano_files"],
+                                       (dict(args, openwebbrowser=False), seqs), jobs=args['batch_jobs'])
+        print("\nSummary:")
+        print(batchutils.format_summary_table(results))
+        if args.get('summary_file'):
+            batchutils.save_summary(results, args['summary_file'])
+            print("\nSummary saved to file:", args['summary_file'])
+        return
 
+    for cadnano_file in args["cadnano_files"]:
+        process_cadnano_file(cadnano_file, args, seqs)
 
 
 
@@ -41,14 +41,12 @@ import glob
 import argparse
 import json
 import time
-import yaml
 from operator import itemgetter
 #import math
 #from importlib import reload
 #import PyQt5
-import matplotlib
-matplotlib.use("Qt5Agg")
-from matplotlib import pyplot #, gridspec
+# matplotlib is imported by plotutils.get_pyplot() when plotting; with --show-plot a Qt backend is used,
+# otherwise the headless Agg backend (unless STAPLESTATTER_PLOT_MODE is set).
 
 # Note regarding ImportError when using Anaconda environtments:
 # For some reason, simply using the python.exe in the /envs/pyqt5/ directory is not sufficient, and I will get a
@@ -77,15 +75,22 @@ sys.path.insert(0, os.path.dirname(BINDIR))  # Add Staplestatter project root to
 # sys.path.insert(0, os.path.normpath(r"C:\Users\scholer\Dev\cadnano2.5"))
 
 
-# Cadnano library imports (cadnano2.5)
-from cadnano.document import Document
-from cadnano.fileio.nnodecode import decode #, decodeFile
-from cadnano.part.part import Part
+# Cadnano (cadnano2.5) and yaml are imported by the functions that need them, to keep startup (e.g. --help) fast.
 
 # Staplestatter imports
 from staplestatter import cadnanoreader
 from staplestatter import staplestatter
 from staplestatter import statutils
+from staplestatter import rotation
+from staplestatter import batchutils
+from staplestatter import plotutils
+from staplestatter import timing
+# Oligo selection criteria are matched with oligo_utils (see the oligo_utils docstring):
+from staplestatter import oligo_utils
+from staplestatter import sequtils
+from staplestatter import fileutils
+from staplestatter.oligo_utils import OligoAttributeTable
+from staplestatter.compactpart import CompactPart
 #from staplestatter import plotutils
 
 # Constants:
@@ -94,13 +99,12 @@ VERBOSE = 0
 
 
 def load_cadnano_file(filename, doc=None):
-    """ Loads a cadnano file into a cadnano document which is returned. """
-    if doc is None:
-        doc = Document()
-    with open(filename) as fp:
-        nno_dict = json.load(fp)
-    decode(doc, nno_dict)
-    return doc
+    """
+    Loads a cadnano file into a cadnano document which is returned.
+    If cadnano cannot be imported, the design is read with cadnanojson and the JsonPart is returned,
+    see fileutils.load_doc_from_file.
+    """
+    return fileutils.load_doc_from_file(filename, doc)
 
 
 
@@ -113,13 +117,17 @@ def parse_args(argv=None):
     parser.add_argument("--verbose", "-v", action="count", help="Increase verbosity.")
     parser.add_argument("--profile", "-p", action="store_true", help="Profile app execution.")
     parser.add_argument("--print-profile", "-P", action="store_true", help="Print profiling statistics.")
+    parser.add_argument("--trace-file",
+                        help="Print the time spent in each stage (load, scoring, plotting, saving, etc) "
+                             "and save the timings to this file (json).")
     parser.add_argument("--profile-outputfn", default="scaffold_rotation.profile",
                         help="Save profiling statistics to this file.")
 
     #parser.add_argument("--seqfile", "-s", nargs=1, required=True, help="File containing the sequences")
     parser.add_argument("seqfile", help="File containing the sequences")
 
-    parser.add_argument("--seqfileformat", help="File format for the sequence file.")
+    parser.add_argument("--seqfileformat", help="File format for the sequence file: txt, fasta, genbank, yaml or json "
+                        "(default: determined from the file extension).")
 
     parser.add_argument("--offset",
                         help="Offset the sequence by this number of bases (positive or negative). "\
@@ -132,6 +140,23 @@ def parse_args(argv=None):
                         help="Calculate scores for this offset range (min, max). ")
 
 
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Split the offset range into chunks and score them using this many processes. "
+                        "Use 0 to use one process per CPU. (Default: 1, i.e. no worker processes.)")
+
+    parser.add_argument("--batch-jobs", type=int,
+                        help="Process the cadnano files in parallel using this many worker processes "
+                        "(0 = one per CPU), with headless plotting, and print a summary table at the end. "
+                        "Existing files are not overwritten unless --overwrite is given.")
+
+    parser.add_argument("--summary-file",
+                        help="Save the batch summary table to this file (.csv or .tsv).")
+
+    parser.add_argument("--apply-per-offset", action="store_true",
+                        help="Apply the rotated sequence to the cadnano design for every offset and score the "
+                        "design, instead of using the (much faster) sliding-window scorer. "
+                        "Mostly useful for validation.")
+
     parser.add_argument("--overwrite", "-y", action="store_true",
                         help="Overwrite existing staple files if they already exists. "
                         "(Default: Ask before overwriting)")
@@ -170,7 +195,9 @@ def parse_args(argv=None):
                         #default="{design}.scaffold-rotation.yaml",
                         default="{design}.scaffold-rotation.csv",
                         help="Save stats to this file. Can use the same named format parameters as --plot-filename. "
-                        "The save format will depend on file extension, e.g. .yaml, .json, .tsv or .csv")
+                        "The save format will depend on file extension, e.g. .yaml, .json, .tsv, .csv, "
+                        ".ndjson (one {offset, score} json object per line) "
+                        "or .npz (numpy arrays 'offset' and 'score', fast to load with numpy.load).")
 
     parser.add_argument("--no-save-rotation-scores", dest="save_rotation_scores",
                         help="Do not save rotation scores to file.")
@@ -198,8 +225,9 @@ def process_args(argns=None, argv=None):
         _, argns = parse_args(argv)
     args = argns.__dict__.copy()
     if args.get("config"):
+        import yaml
         with open(args["config"]) as fp:
-            cfg = yaml.load(fp)
+            cfg = yaml.safe_load(fp)
         args.update(cfg)
     # On windows, we have to expand *.json manually:
     file_pattern_matches = [(pattern, glob.glob(pattern)) for pattern in args['cadnano_files']]
@@ -214,84 +242,46 @@ def load_criteria_list(filepath):
     except IndexError:
         ext = "yaml"
     with open(filepath) as fd:
-        criteria_list = json.load(fd) if "json" in ext else yaml.load(fd)
+        if "json" in ext:
+            criteria_list = json.load(fd)
+        else:
+            import yaml
+            criteria_list = yaml.safe_load(fd)
     return criteria_list
 
 
 def load_seq(args):
     """
-    I figure there are a couple of ways I'd want to specify the sequences, from low to high complexity:
-    1) Just one fucking sequence.
-    2) One sequence, but with an offset
-    3) Several sequences.
-
-    In the case of several sequences, I would need some way to determine which sequence to apply to which oligo.
-    That could be any of:
-    * Length
-    * Scaffold or staple strand(set)
-    * Start (5p) position vhelix[baseidx] --
-    * End (3p) position vhelix[baseidx] --
-    I don't think it would be too hard to make a general filtering function that could take any or all
-    of these discriminators into consideration.
-
-    This will always return a list of dicts: (The only guaranteed key is 'seq').
-        [{
-            seq: <sequence>,
-            name: <descriptive name for sequence, mostly for the user.>
-            bp: <expected length of the sequence (again, mostly for the user)>
-            criteria: {
-                st_type: <"scaf" or "stap">,
-                length: <length>,
-                5pvhnum: <vhelix number>,
-                5pvhcoord: (vhcoord tuple),
-                5pbaseidx: <base index>,
-                (same for 3p),
-                }
-            offset: <integer, positive or negative>,
-         }, (...) ]
+    Load the sequence (or list of seq_specs) from args["seqfile"], which can be a plain text, fasta, genbank,
+    yaml or json file, see sequtils.load_seq.
     """
-    seqfile = args["seqfile"]
-    try:
-        ext = os.path.splitext(seqfile)[1]
-    except IndexError:
-        ext = "txt"
-    if VERBOSE > 1:
-        print("seqfile:", seqfile, "- ext:", ext)
-    with open(seqfile) as fd:
-        if "txt" in ext:
-            if args["simple_seq"]:
-                print("Returning simple sequence rather than seq_spec.")
-                return fd.read().strip()
-            # Treat the file as a simple txt file
-            seq = next(line for line in (l.strip() for l in fd) if line and line[0] != "#")
-            seq = "".join(b for b in seq.upper() if b in "ATGCU")
-            seqs = [{"seq": seq,
-                     "criteria": {"st_type": "scaf"}
-                    }]
-        elif "fasta" in ext:
-            # File is fasta format
-            raise NotImplementedError("Fasta files are not yet implemented. (But that is easy to do when needed.)")
-        elif "yaml" in ext:
-            seqs = yaml.load(fd)
-        elif "json" in ext:
-            seqs = json.load(fd)
-        else:
-            raise ValueError("seqfile extension %s not recognized format." % ext)
-    return seqs
+    return sequtils.load_seq(args)
 
 
 def save_stats(stats, filename):
     """
     Save stats to filename. Save format will depend on filename extension,
-    e.g. .yaml, .json, .tsv or .csv. Default is csv format (sep=",").
+    e.g. .yaml, .json, .ndjson, .tsv, .csv or .npz. Default is csv format (sep=",").
+    stats is a list of (offset, score) tuples; .npz files have an 'offset' and a 'score' array.
+    For csv, tsv and ndjson, the stats are written row by row, so stats can be a generator.
     """
     try:
         fnext = os.path.splitext(filename)[1].lower()
     except IndexError:
         fnext = ".csv"
+    if fnext == ".npz":
+        import numpy as np
+        offsets, scores = zip(*stats) if stats else ((), ())
+        with open(filename, 'wb') as fp:
+            np.savez(fp, offset=np.array(offsets, dtype=np.int64), score=np.array(scores, dtype=np.float64))
+        return
     with open(filename, 'w') as fp:
         if "yaml" in fnext:
+            import yaml
             yaml.dump(stats, fp)
+        elif fnext in (".ndjson", ".jsonl"):
+            for offset, score in stats:
+                fp.write(json.dumps({"offset": offset, "score": score}) + "\n")
         elif "json" in fnext:
             json.dump(stats, fp)
         else:
@@ -299,11 +289,15 @@ def save_stats(stats, filename):
                 sep = "\t"
             else:
                 sep = ","
-            fp.write("\n".join(sep.join(map(str, row)) for row in stats))
+            for row in stats:
+                fp.write(sep.join(map(str, row)) + "\n")
 
 
 def get_part(doc):
     """ Cadnano is currently a little flaky regarding how to get the part. This tries to mitigate that. """
+    if isinstance(doc, CompactPart):
+        # Design loaded without cadnano, see load_cadnano_file:
+        return doc
     try:
         # New-style cadnano:
         part = doc.selectedInstance()
@@ -312,7 +306,8 @@ def get_part(doc):
         part = doc.selectedPart()
     if VERBOSE > 1:
         print("Part:", part)
-    if not isinstance(part, Part):
+    Part = cadnanoreader.get_part_class()
+    if Part is not None and not isinstance(part, Part):
         if hasattr(part, "parent"):
             # part is actually just a cadnano.objectinstance.ObjectInstance
             # we need the cadnano.part.squarepart.SquarePart which is ObjectInstance.parent
@@ -327,169 +322,31 @@ def get_part(doc):
     return part
 
 
-def crit_match(oligo, key, value):
-    """ Match an oligo against a single criteria (key, value) """
-    org_key = key
-    if key == "st_type":
-        # logical XOR: equivalent to
-        # (oligo.isStaple() and value == "stap") or (not oligo.isStaple() and value == "scaf")
-        return oligo.isStaple() == (value == "stap")
-    # This seems efficient. Do try it for all keys:
-    if key in ("length", "color", "idx5Prime", "vhnumber") or True:
-        if key in ("idx5Prime", ):
-            crit_obj = oligo.strand5p()
-        elif key in ("vhnumber", ):
-            crit_obj = oligo.strand5p().virtualHelix()
-            key = key[2:]
-        else:
-            crit_obj = oligo
-            # Allow flexible specification:
-            # Specify as "5pidx5Prime" or "5pvhnumber" or "5pvhcoord"
-            if key[:2] == "5p":
-                crit_obj = crit_obj.strand5p()
-                key = key[2:]
-            if key[:2] == "vh":
-                crit_obj = crit_obj.virtualHelix()
-                key = key[2:]
-        try:
-            oval = getattr(crit_obj, key)()
-        except AttributeError as e:
-            print("\nERROR:", e)
-        else:
-            # What if length is a tuple specifying a range, e.g. (100, 150)
-            # to apply to all oligos within a certain range?
-            if isinstance(value, (list, tuple)):
-                if len(value) == 2:
-                    return value[0] <= oval <= value[1]
-                # We have a set of acceptable values:
-                return oval in value
-            return oval == value
-    # Future criterium: sequence, ...?
-    #st = oligo.strand5p()
-    #if key.lower() == "5pbaseidx":
-    #    return st.idx5Prime() == value
-    #vh = st.virtualHelix()
-    #if key.lower() == "5pvhnum":
-    #    return vh.number() == value
-    #if key.lower() == "5pvhcoord":
-    #    # value can be either (5, 2) or it can be (5, None).
-    #    # If a coordinate is None, it should match all, i.e. we are doing row/col matching only.
-    #    # So e.g. we'd zip value = (5, None) with vh.coord() = (5, 2) to produce [(5, 5), (None, 2)]
-    #    # and compare the equality of these or if v is None:
-    #    return all(v == a or v is None for v, a in zip(value, vh.coord()))
-    raise KeyError('Criteria key "%s" not recognized.' % org_key)
-
-
-def match_oligo(oligo, criteria):
-    """
-    Returns True if oligo matches all criterium in the given set of criteria.
-
-    See if oligo matches the given criteria.
-    Criteria is a dict with any of these keys: (case insensitive)
-        st_type: <"scaf" or "stap">,
-        length: <length>,
-        color: <hex color code>
-        5pvhnum: <vhelix number>,
-        5pvhcoord: (vhcoord tuple),
-        5pbaseidx: <base index>,
-        (same for 3p),
-
-    Key methods for Oligo:
-        applyColor(), color(), setColor()
-        applySequence()
-        isStaple()
-        length(), setLength()
-        locString()
-        sequence(), sequenceExport()
-        strand5p()
-    Key methods for Strand:
-        highIdx(), lowIdx(), idx3Prime(), idx5Prime(), idxs(),
-        connection3p(), connection5p(), connectionHigh(), connectionLow(),
-        generator3p(), generator5p(),
-        getComplementStrands(),
-        sequence(), getSequenceList(),
-        strandType(), isScaffold(), isStaple,
-        length(), totalLength(),
-        strandSet(), oligo(), virtualHelix(), part()
-        plus: insertion methods, and a lot of setters.
-    """
-    return all(crit_match(oligo, key, value) for key, value in criteria.items())
-
-
-def get_matching_oligos(part, criteria):
-    """
-    Get all oligos on part matching the given set of criteria.
-    Criteria is usually a set of criteria (a dict, actually) of
-        criterium-key: criterium-value(s) or range, e.g.
-        length: 128
-    In this case, return a list of all oligos matching all criteria in the dict.
-    However, criteria can also be a list of criteria dicts,
-    in which case return the union (set) of all oligos fully matching
-    any of the criterium dicts in the list.
-    """
-    # We'd usually expect only one oligo to match the set of criteria,
-    # and we'd probably want to verify that exactly one oligo is matching,
-    # so generate a list, not a generator.
-    if isinstance(criteria, list):
-        # if we have a criteria_list, return the union of oligos matching any criteria (dict) in the list:
-        return {oligo for crit_dict in criteria for oligo in get_matching_oligos(part, crit_dict)}
-    return [oligo for oligo in part.oligos() if match_oligo(oligo, criteria)]
-
-
 def print_oligo_criteria_match_report(oligos, criteria, desc=None):
     """ Print standard criteria match report. """
     print("\n{} oligos matching criteria set {}:".format(len(oligos), desc))
     #print("Oligos matching criteria set:", desc)
     if VERBOSE > 1:
+        import yaml
         print(yaml.dump({"criteria": [criteria]}, default_flow_style=False).strip("\n"))
         print("The matching oligos are:")
         print("\n".join(" - {}".format(oligo) for oligo in oligos))
 
 
-def apply_sequences(part, seqs, offset=None, verbose=0):
+def apply_sequences(part, seqs, offset=None, verbose=0, table=None):
     """
-    Apply sequences in seqs to oligos in part.
+    Apply sequences in seqs to oligos in part, see oligo_utils.apply_sequences.
     If seqs is just a str, it is assumed to be a single sequence to be applied
     to the first and only scaffold oligo in the design.
     Otherwise, seqs must be a list of seq_spec, each specifying a sequence and a set
     of criteria matching only those oligos to which the sequence should be applied.
+    Sequences are rotated by offset without copying them (sequtils.CircularSequence).
+    table is an optional oligo_utils.OligoAttributeTable for part, which is re-used for all seq_specs
+    (and can be re-used for all offsets, since applying sequences does not change the matched attributes).
     """
-    # Apply sequence:
-    #with open(os.path.join(folder, sequence_file)) as fd:
-    #    scaf_sequence = fd.read()
-    #scaf_oligo = next(oligo for oligo in part.oligos() if not oligo.isStaple())
-    if isinstance(seqs, str):
-        # Perform simple sequence application using just a single sequence with no selection criteria.
-        # Can be used if the design has one and only one scaffold.
-        seq = seqs
-        L = len(seq)
-        if offset:
-            seq_offset = offset
-            seq = (seq*3)[L+seq_offset:L*2+seq_offset]
-        oligos = part.oligos()
-        # Get the first scaffold oligo:
-        scaf_oligo = next(oligo for oligo in oligos if not oligo.isStaple() if oligo.length() > L/2)
-        if verbose:
-            print(" - Applying {} nt sequence to oligo of length {}"
-                  .format(L, scaf_oligo.length()))
-        scaf_oligo.applySequence(seq, use_undostack=False)
-    else:
-        # Apply sequences based on seq_spec criteria:
-        for seq_i, seq_spec in enumerate(seqs):
-            # seq_spec has key "seq" and optional keys "criteria", and "offset".
-            # If seq_spec has an offset specified, this is always used.
-            # Specifying offset=0 can be used to fix mini-scafs so they are not rotated with the main scaffold.
-            seq = seq_spec["seq"]
-            L = len(seq)
-            seq_offset = seq_spec.get("offset", offset)
-            if seq_offset:
-                seq = (seq*3)[L+seq_offset:L*2+seq_offset]
-            oligos = get_matching_oligos(part, seq_spec["criteria"])
-            if VERBOSE > 3:
-                print_oligo_criteria_match_report(oligos, seq_spec["criteria"],
-                                                  desc="for application of sequence #{}".format(seq_i))
-            for oligo in oligos:
-                oligo.applySequence(seq, use_undostack=False)
+    if VERBOSE > 3:
+        verbose = max(verbose, 2)  # Print criteria match reports.
+    oligo_utils.apply_sequences(part, seqs, offset=offset, verbose=verbose, table=table)
 
 
 def score_part(part, method="TM", **method_kwargs):
@@ -514,12 +371,11 @@ def score_part(part, method="TM", **method_kwargs):
     return valleyscore
 
 
-def get_offset_rotation_scores(part, seqs, offsetrange=None):
+def get_offsetrange(seqs, offsetrange=None):
     """
-    Optimizations...
-    - It takes about or less than 0.1 s to calculate a complete part.
-    - For TM based scoring, the TM calculations are about 3 times as expensive as cadnano apply seq.
-    - If using length instead of TM, the scoring takes about half the time as cadnano apply seq.
+    Return offsetrange as a range object.
+    offsetrange can be None or "complete" (all offsets of the (first) sequence), a (min, max) tuple,
+    or a range.
     """
     if offsetrange is None:
         offsetrange = "complete"
@@ -533,27 +389,102 @@ def get_offset_rotation_scores(part, seqs, offsetrange=None):
                 raise ValueError("offsetrange must be a specified range for complex sequence specs")
     elif isinstance(offsetrange, (list, tuple)):
         offsetrange = range(offsetrange[0], offsetrange[1])
+    return offsetrange
+
+
+def get_offset_rotation_scores(part, seqs, offsetrange=None, apply_per_offset=False):
+    """
+    Returns list of (offset, score) tuples for all offsets in offsetrange.
+    By default, the scores are calculated with rotation.RotationScorer, which reads the staple
+    geometry from the design once and then scores each offset without applying any sequences.
+    If apply_per_offset is True (or RotationScorer cannot be used for the design/sequences),
+    the rotated sequence is applied to the design and the design is scored for every offset.
+
+    Optimizations (apply_per_offset)...
+    - It takes about or less than 0.1 s to calculate a complete part.
+    - For TM based scoring, the TM calculations are about 3 times as expensive as cadnano apply seq.
+    - If using length instead of TM, the scoring takes about half the time as cadnano apply seq.
+    """
+    offsetrange = get_offsetrange(seqs, offsetrange)
+    if not apply_per_offset:
+        start = timer()
+        try:
+            with timing.span("rotation_scorer"):
+                scorer = rotation.RotationScorer(part, seqs)
+        except (ImportError, ValueError) as e:
+            print(" - Cannot use sliding-window rotation scorer (%s); applying sequence for every offset." % e)
+        else:
+            with timing.span("rotation_scores"):
+                scores = scorer.scores(offsetrange)
+            if VERBOSE:
+                print("get_offset_rotation_scores: {} offsets scored in {:.03f} s"
+                      .format(len(scores), timer() - start))
+            return scores
     scores = []
-    timings = [0.0, 0.0]
+    # Report timings if verbose (unless the caller is already tracing):
+    tracer = timing.Tracer("get_offset_rotation_scores").start() if VERBOSE and timing.get_tracer() is None else None
+    table = OligoAttributeTable(part)   # The oligo index is made once, not for every offset.
     for offset in offsetrange:
         if VERBOSE and (offset % 100) == 0:
             print("Applying sequence for offset {}".format(offset))
-        start = timer()
-        apply_sequences(part, seqs, offset, verbose=int(offset % 100 == 0))
-        timings[0] += timer() - start
+        with timing.span("apply_sequences"):
+            apply_sequences(part, seqs, offset, verbose=int(offset % 100 == 0), table=table)
         if VERBOSE and offset % 100 == 0:
             print("Calculating score for offset {}".format(offset))
-        #scores.append((offset, staplestatter.score_part_v1(part, hyb_method="TM")))
-        start = timer()
-        scores.append((offset, staplestatter.score_part_v1(part, hyb_method="TM")))
+        with timing.span("score_part_v1"):
+            scores.append((offset, staplestatter.score_part_v1(part, hyb_method="TM")))
         #scores.append((offset, staplestatter.score_part_v1(part, hyb_method="length")))
-        timings[1] += timer() - start
         if VERBOSE and offset % 100 == 0:
             print("Calculation  done for offset {}".format(offset))
-    if VERBOSE:
+    if tracer is not None:
+        tracer.stop()
         print("get_offset_rotation_scores timings:")
-        print("- apply_sequences: {:.03f} s".format(timings[0]))
-        print("- score_part_v1  : {:.03f} s".format(timings[1]))
+        print(tracer.format_summary())
+    return scores
+
+
+# Per-process state for worker processes, set by _init_rotation_worker:
+_worker_state = {}
+
+
+def _init_rotation_worker(cadnano_file, seqs, apply_per_offset, verbose):
+    """ Process pool initializer: Load the design once per worker process. """
+    global VERBOSE
+    VERBOSE = verbose
+    doc = load_cadnano_file(cadnano_file)
+    _worker_state.update(doc=doc, part=get_part(doc), seqs=seqs, apply_per_offset=apply_per_offset)
+
+
+def _rotation_worker_scores(offsetrange):
+    """ Calculate rotation scores for a chunk of offsets in a worker process. """
+    return get_offset_rotation_scores(_worker_state['part'], _worker_state['seqs'], offsetrange,
+                                      apply_per_offset=_worker_state['apply_per_offset'])
+
+
+def get_offset_rotation_scores_parallel(cadnano_file, seqs, offsetrange=None, jobs=None,
+                                        apply_per_offset=False, chunks_per_job=4):
+    """
+    Like get_offset_rotation_scores, but splits offsetrange into chunks which are scored
+    by a pool of <jobs> worker processes (default: one per CPU).
+    Each worker loads cadnano_file once. Returns the ordered list of (offset, score) tuples.
+    """
+    from multiprocessing import Pool, cpu_count
+    offsetrange = get_offsetrange(seqs, offsetrange)
+    if not jobs:
+        jobs = cpu_count()
+    n_chunks = min(len(offsetrange), jobs*chunks_per_job) or 1
+    bounds = [len(offsetrange)*i//n_chunks for i in range(n_chunks+1)]
+    chunks = [offsetrange[low:high] for low, high in zip(bounds, bounds[1:])]
+    if VERBOSE:
+        print(" - Scoring {} offsets in {} chunks using {} processes...".format(len(offsetrange), n_chunks, jobs))
+    pool = Pool(jobs, initializer=_init_rotation_worker,
+                initargs=(cadnano_file, seqs, apply_per_offset, VERBOSE))
+    try:
+        # imap returns the results in the same order as chunks:
+        scores = [offset_score for chunk_scores in pool.imap(_rotation_worker_scores, chunks)
+                  for offset_score in chunk_scores]
+    finally:
+        pool.terminate()
     return scores
 
 
@@ -564,6 +495,7 @@ def print_top_scores(scores, top=10):
 
 
 def plot_rotationscores(scores, savetofile=None):
+    pyplot = plotutils.get_pyplot()
     fig = pyplot.figure(figsize=(20, 10))
     #pyplot.plot(*reversed(list(zip(*scores))))
     offset, scorevals = zip(*scores)
@@ -610,6 +542,9 @@ def ok_to_write_to_file(staples_outputfn, args):
     """ Assert whether it is OK to write to staples_outputfn """
     if args["overwrite"] or not os.path.exists(staples_outputfn):
         return True
+    if not args.get("interactive", True):
+        # Cannot ask, e.g. in batch worker processes:
+        return False
     # os.path.exists(staples_outputfn) is True
     overwrite = input(staples_outputfn + " already exists. Overwrite? [Y/n]")
     if overwrite and overwrite.lower()[0] == "n":
@@ -664,6 +599,68 @@ def get_score_criteria_list(args):
 
 
 
+def process_cadnano_file(cadnano_file, args, seqs):
+    """
+    Calculate, save and plot rotation scores for a single cadnano file.
+    Returns a dict with summary values for the design.
+    """
+    global VERBOSE
+    VERBOSE = args['verbose'] or 0
+    print("\nCalculating rotation score for cadnano file", cadnano_file)
+    # folder = os.path.realpath(os.path.dirname(cadnano_file))
+    # "141105_longer_catenane_BsoBI-frag_offset6nt.json"
+    design = os.path.splitext(os.path.basename(cadnano_file))[0]
+    plot_outputfn = args["plot_filename"]
+    if plot_outputfn:
+        plot_outputfn = plot_outputfn.format(design=design, cadnano_file=cadnano_file, seqfile=args["seqfile"])
+    stats_outputfn = args["save_rotation_scores"]
+    if stats_outputfn:
+        stats_outputfn = stats_outputfn.format(design=design, cadnano_file=cadnano_file,
+                                               seqfile=args["seqfile"])
+    if args.get('jobs', 1) != 1:
+        # Workers load the design themselves:
+        print(" - Calculating rotation scores using multiple processes...")
+        rotationscores = get_offset_rotation_scores_parallel(
+            cadnano_file, seqs, args['offsetrange'], jobs=args['jobs'],
+            apply_per_offset=args.get('apply_per_offset'))
+    else:
+        print(" - Loading design:", design)
+        doc = load_cadnano_file(cadnano_file)
+        print(cadnano_file, "loaded!")
+        part = get_part(doc)
+        #apply_sequences(part, seqs, offset=args.get("offset")) # global offset
+        #score_oligos(part, plot_filepath=plot_outputfn, criteria_list=score_criteria_list)
+        print(" - Calculating rotation scores...")
+        rotationscores = get_offset_rotation_scores(part, seqs, args['offsetrange'],
+                                                    apply_per_offset=args.get('apply_per_offset'))
+    _, y = zip(*rotationscores)
+    print(" - Rotation scores: N={}, first={}, min={}, max={}"
+          .format(len(y), rotationscores[0], min(y), max(y)))
+    if stats_outputfn:
+        if not ok_to_write_to_file(stats_outputfn, args):
+            print(" - NOT overwriting existing file", stats_outputfn)
+        else:
+            print(" - Saving rotation scores...")
+            with timing.span("save"):
+                save_stats(rotationscores, stats_outputfn)
+    if plot_outputfn:
+        if not ok_to_write_to_file(plot_outputfn, args):
+            print(" - Aborting staple file write for file", plot_outputfn)
+        else:
+            print(" - Plotting rotation scores...")
+            with timing.span("plot"):
+                fig = plot_rotationscores(rotationscores, plot_outputfn)
+            if not args['show_plot']:
+                plotutils.get_pyplot().close(fig)
+    if args['show_plot']:
+        print(" - Showing plot...")
+        plotutils.get_pyplot().show()
+    print(" - Done!")
+    best_offset, best_score = max(rotationscores, key=itemgetter(1))
+    return {'design': design, 'offsets': len(y), 'best_offset': best_offset, 'best_score': best_score,
+            'min_score': min(y), 'first_offset_score': rotationscores[0][1]}
+
+
 def calculate_rotation_scores(args):
     global VERBOSE
     VERBOSE = args['verbose'] or 0
@@ -674,54 +671,32 @@ def calculate_rotation_scores(args):
     score_criteria_list = get_score_criteria_list(args)
     if VERBOSE > 1:
         print("score criteria list:")
+        import yaml
         print(yaml.dump(score_criteria_list))
 
     if VERBOSE > 2:
         print("Command line args:", args)
 
+    if args.get('batch_jobs') is not None:
+        # Process the files in parallel, one file per worker process:
+        results = batchutils.run_batch(process_cadnano_file, args["cadnano_files"],
+                                       (dict(args, jobs=1, show_plot=False, interactive=False), seqs),
+                                       jobs=args['batch_jobs'])
+        print("\nSummary:")
+        print(batchutils.format_summary_table(results))
+        if args.get('summary_file'):
+            batchutils.save_summary(results, args['summary_file'])
+            print("\nSummary saved to file:", args['summary_file'])
+        return results
+
     for cadnano_file in args["cadnano_files"]:
-        print("\nCalculating rotation score for cadnano file", cadnano_file)
-        # folder = os.path.realpath(os.path.dirname(cadnano_file))
-        # "141105_longer_catenane_BsoBI-frag_offset6nt.json"
-        design = os.path.splitext(os.path.basename(cadnano_file))[0]
-        plot_outputfn = args["plot_filename"]
-        if plot_outputfn:
-            plot_outputfn = plot_outputfn.format(design=design, cadnano_file=cadnano_file, seqfile=args["seqfile"])
-        stats_outputfn = args["save_rotation_scores"]
-        if stats_outputfn:
-            stats_outputfn = stats_outputfn.format(design=design, cadnano_file=cadnano_file,
-                                                   seqfile=args["seqfile"])
-        print(" - Loading design:", design)
-        doc = load_cadnano_file(cadnano_file)
-        print(cadnano_file, "loaded!")
-        part = get_part(doc)
-        #apply_sequences(part, seqs, offset=args.get("offset")) # global offset
-        #score_oligos(part, plot_filepath=plot_outputfn, criteria_list=score_criteria_list)
-        print(" - Calculating rotation scores...")
-        rotationscores = get_offset_rotation_scores(part, seqs, args['offsetrange'])
-        _, y = zip(*rotationscores)
-        print(" - Rotation scores: N={}, first={}, min={}, max={}"
-              .format(len(y), rotationscores[0], min(y), max(y)))
-        if stats_outputfn:
-            if not ok_to_write_to_file(plot_outputfn, args):
-                print(" - NOT overwriting existing file", stats_outputfn)
-            else:
-                print(" - Saving rotation scores...")
-                save_stats(rotationscores, stats_outputfn)
-        if plot_outputfn:
-            if not ok_to_write_to_file(plot_outputfn, args):
-                print(" - Aborting staple file write for file", plot_outputfn)
-            else:
-                print(" - Plotting rotation scores...")
-                plot_rotationscores(rotationscores, plot_outputfn)
-        if args['show_plot']:
-            print(" - Showing plot...")
-            pyplot.show()
-        print(" - Done!")
+        process_cadnano_file(cadnano_file, args, seqs)
 
 
 def main(argv=None):
     args = process_args(None, argv)     # argns, argv
+    if not args['show_plot']:
+        plotutils.set_plot_mode('headless')
     if args['profile']:
         import cProfile
         cProfile.runctx('calculate_rotation_scores(args)', globals(), locals(), filename=args['profile_outputfn'])
@@ -735,6 +710,15 @@ def main(argv=None):
         s.sort_stats('time').print_stats(40)
         return
 
+    if args.get('trace_file'):
+        with timing.Tracer("scaffold_rotation") as tracer:
+            calculate_rotation_scores(args)
+        print("\nTimings:")
+        print(tracer.format_summary())
+        tracer.save(args['trace_file'])
+        print("Timings saved to file:", args['trace_file'])
+        return
+
     calculate_rotation_scores(args)
 
 
@@ -31,11 +31,25 @@ with the cadnano data extraction logic in cadnanoreader.py
 Updating the mainwindow's statusbar:
     self.win.statusBar().showMessage(statusString)
 
+Directives are processed in the background, so cadnano stays responsive while scoring large designs:
+1) On the GUI thread, the part's strands, connections and sequences are copied to a compactpart.CompactPart snapshot.
+2) A DirectiveWorker scores the snapshot in a worker thread (staplestatter.compute_statspecs),
+   reporting progress to the dialog via Qt signals. The process buttons work as cancel buttons meanwhile.
+3) When done, the scores are plotted on the GUI thread (staplestatter.plot_statspecs).
+Since the worker only touches the snapshot, the design can be edited while it is being scored.
+Use "background: false" in the directive to process it synchronously on the GUI thread instead.
+
+With "live: true" in the directive, a LiveUpdater keeps the plots up to date while the design is edited:
+Changes are debounced, only the affected oligos are re-scored (staplestatter.IncrementalScorer),
+and the existing vlines are updated in place (plotutils.update_frequencies).
+
 
 """
 
 from __future__ import absolute_import, print_function
 import os
+import threading
+import traceback
 
 # Cadnano imports:
 import cadnano
@@ -45,14 +59,16 @@ try:
     # Cadnano2-pyqt5 and Cadnano2.5-legacy:
     from cadnano import util
     from PyQt5.QtGui import QIcon, QPixmap
-    from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QFileDialog, QAction
-    from PyQt5.QtCore import Qt, QSettings, QDir, QUrl
+    from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QFileDialog, QAction, QPlainTextEdit, QProgressBar
+    from PyQt5.QtCore import Qt, QSettings, QDir, QUrl, QObject, QTimer, pyqtSignal
 except ImportError:
     # Cadnano2:
     import util
     util.qtWrapImport('QtGui', globals(), ['QIcon', 'QPixmap', 'QAction'])
-    util.qtWrapImport('QtGui', globals(), ['QDialog', 'QDialogButtonBox', 'QFileDialog'])
-    util.qtWrapImport('QtCore', globals(), ['Qt', 'QString', 'QSettings', 'QDir', 'QUrl'])
+    util.qtWrapImport('QtGui', globals(), ['QDialog', 'QDialogButtonBox', 'QFileDialog', 'QPlainTextEdit',
+                                           'QProgressBar'])
+    util.qtWrapImport('QtCore', globals(), ['Qt', 'QString', 'QSettings', 'QDir', 'QUrl', 'QObject', 'QTimer',
+                                            'pyqtSignal'])
 
 
 # Staplestatter imports:
@@ -60,6 +76,147 @@ from .ui import StaplestatterUiDialog   # logic is handled by ui/__init__.py
 from .staplestatter import staplestatter
 from .staplestatter.staplestatter import process_statspecs_string, savestats
 from .staplestatter.cadnanoreader import get_part_alt, get_part
+from .staplestatter import timing
+from .staplestatter import plotutils
+from .staplestatter.compactpart import CompactPart
+from .staplestatter.cadnanoreader import HybPatternIndex, get_hyb_pattern_index
+
+
+class DirectiveWorker(QObject):
+    """
+    Scores a snapshot of the part for all statspecs in a directive, in a background thread.
+    The signals are emitted from the worker thread, and are queued by Qt to the connected slots,
+    which thus run in the GUI thread.
+    """
+    progressSignal = pyqtSignal(float, object)      # fraction done, message
+    finishedSignal = pyqtSignal(object, object)     # worker, list of (scores, scorefreqs) from compute_statspecs
+    failedSignal = pyqtSignal(object, object)       # worker, error message
+
+    def __init__(self, directive, snapshot, designname):
+        QObject.__init__(self)
+        self.directive, self.snapshot, self.designname = directive, snapshot, designname
+        self.hyb_patterns = None
+        self.tracer = timing.Tracer("scoring (worker thread)")
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="staplestatter-worker")
+        self._thread.daemon = True   # Do not keep cadnano from exiting.
+
+    def start(self):
+        """ Start processing the directive in a new thread. """
+        self._thread.start()
+
+    def cancel(self):
+        """ Request cancellation; the worker stops before the next statspec and does not emit finishedSignal. """
+        self._cancelled.set()
+
+    def isCancelled(self):
+        """ Returns True if cancel() has been called. """
+        return self._cancelled.is_set()
+
+    def run(self):
+        """ Score the snapshot; invoked in the worker thread. """
+        try:
+            with self.tracer:
+                scored = staplestatter.compute_statspecs(self.directive, self.snapshot, progress=self.progress,
+                                                         designname=self.designname)
+                # Already calculated by compute_statspecs, kept for saving with the scores:
+                self.hyb_patterns = staplestatter.get_statspecs_hyb_patterns(self.directive, self.snapshot)
+        except staplestatter.Cancelled:
+            print("Staplestatter: Directive processing cancelled.")
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self.failedSignal.emit(self, "%s: %s" % (type(e).__name__, e))
+            return
+        if not self.isCancelled():
+            self.finishedSignal.emit(self, scored)
+
+    def progress(self, fraction, message):
+        """ Progress callback for compute_statspecs; raises staplestatter.Cancelled if cancel() has been called. """
+        if self.isCancelled():
+            raise staplestatter.Cancelled()
+        self.progressSignal.emit(fraction, message)
+
+
+class LiveUpdater(QObject):
+    """
+    Live mode: Re-scores the part and updates the plotted lines in place whenever the design is edited.
+    Listens to the same cadnano signals as cadnanoreader.HybPatternIndex. The signals are debounced with
+    a single-shot timer, so a burst of edits (e.g. dragging a strand end) gives a single update.
+    Updates run in the GUI thread, but only oligos whose hybridization pattern has changed are re-scored.
+    The first update scores all oligos.
+    """
+    debounce_ms = 300
+    # Part signals emitted when an oligo is created (in addition to HybPatternIndex's part signals):
+    part_oligo_signal_names = ('partOligoAddedSignal', )
+
+    def __init__(self, directive, part, lines, debounce_ms=None):
+        QObject.__init__(self)
+        self.directive, self.part, self.lines = directive, part, lines
+        self.scorer = staplestatter.IncrementalScorer(directive, part)
+        self.lastTrace = None
+        self._signals = {}      # part or oligo -> list of signals connected to designChangedSlot
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.debounce_ms if debounce_ms is None else debounce_ms)
+        self._timer.timeout.connect(self.update)
+        # Make sure the part's index is listening (and invalidating) before we are:
+        get_hyb_pattern_index(part)
+        self._connect(part, HybPatternIndex.part_strand_signal_names + HybPatternIndex.part_reset_signal_names
+                      + self.part_oligo_signal_names)
+        self._connectOligos()
+
+    def _connect(self, obj, signal_names):
+        """ Connect designChangedSlot to obj's signals in signal_names (signals not available are ignored). """
+        signals = self._signals.setdefault(obj, [])
+        for name in signal_names:
+            signal = getattr(obj, name, None)
+            if signal is not None:
+                signal.connect(self.designChangedSlot)
+                signals.append(signal)
+
+    def _connectOligos(self):
+        """ Connect to new oligos' signals, and forget oligos that are no longer in the part. """
+        oligos = set(self.part.oligos())
+        for obj in [obj for obj in self._signals if obj is not self.part and obj not in oligos]:
+            del self._signals[obj]
+        for oligo in oligos:
+            if oligo not in self._signals:
+                self._connect(oligo, HybPatternIndex.oligo_signal_names)
+
+    def designChangedSlot(self, *args):
+        """ Qt slot for cadnano's part and oligo signals; (re-)starts the debounce timer. """
+        self._timer.start()
+
+    def update(self):
+        """ Re-score changed oligos and update the plotted lines. """
+        with timing.Tracer("live update") as tracer:
+            self._connectOligos()
+            scored = self.scorer.update()
+            figures = set()
+            with timing.span("plot"):
+                for statspec, lines, statspec_scored in zip(self.directive['statspecs'], self.lines, scored):
+                    if lines is None or statspec_scored is None or statspec_scored[1] is None:
+                        continue
+                    plotspec = statspec.get('plotspec', dict())
+                    plotutils.update_frequencies(lines, statspec_scored[1], autoscale_x=not plotspec.get('xlim'),
+                                                 autoscale_y=not plotspec.get('ylim'), draw=False)
+                    figures.add(lines.figure)
+                for figure in figures:
+                    figure.canvas.draw_idle()
+        self.lastTrace = tracer
+        print("Staplestatter live update: re-scored %s oligos in %.3f s." % (self.scorer.rescored, tracer.wall))
+
+    def stop(self):
+        """ Stop live updates and disconnect from all signals. """
+        self._timer.stop()
+        for signals in self._signals.values():
+            for signal in signals:
+                try:
+                    signal.disconnect(self.designChangedSlot)
+                except (TypeError, RuntimeError):
+                    pass    # Not connected, or the cadnano object has been deleted.
+        self._signals.clear()
 
 
 class StaplestatterHandler(object):
@@ -97,7 +254,12 @@ class StaplestatterHandler(object):
         self.settings = QSettings()
         self._fileOpenPath = None
         self._readSettings()
-        self._lastResult = None  # dict(figure=fig, scores=allscores)
+        self._lastResult = None  # dict(figure=fig, scores=allscores, hyb_patterns=..)
+        self._lastDirective = None  # The directive that produced _lastResult
+        self._lastTrace = None   # timing.Tracer for the last processed directive
+        self._worker = None      # DirectiveWorker for the directive currently being processed
+        self._snapshotTrace = None
+        self._liveUpdater = None # LiveUpdater, if the last directive had "live: true"
 
     def _readSettings(self):
         """ Reads settings.
@@ -238,8 +400,98 @@ class StaplestatterHandler(object):
         when it is pressed.
         """
         print("processDirectiveSlot() invoked by pressing processButton.")
-        directive = self.getDirectiveStr()
-        self._lastResult = staplestatter.process_statspecs_string(directive)
+        if self._worker is not None:
+            # While a directive is being processed, the process buttons work as cancel buttons:
+            self.cancelDirective()
+            return
+        import yaml
+        try:
+            directive = staplestatter.load_directive(self.getDirectiveStr())
+        except yaml.YAMLError as e:
+            print("Could not parse staplestatter directive:", e)
+            return
+        if not directive or 'statspecs' not in directive:
+            print("Staplestatter directive does not have any statspecs.")
+            return
+        self.stopLiveMode()
+        if not directive.get('background', True):
+            with timing.Tracer("staplestatter directive") as tracer:
+                self._lastResult = staplestatter.process_statspecs(directive)
+            self._lastDirective = directive
+            self._lastTrace = tracer
+            self._showTraces(directive, [tracer])
+            self._startLiveMode(directive)
+            return
+        part = get_part(self.doc)
+        # The cadnano part must only be accessed in the GUI thread, so the worker scores a snapshot:
+        with timing.Tracer("snapshot (GUI thread)") as tracer:
+            with timing.span("snapshot"):
+                snapshot = CompactPart.from_cadnano_part(part)
+        self._snapshotTrace = tracer
+        worker = self._worker = DirectiveWorker(directive, snapshot, staplestatter.get_designname(part))
+        worker.progressSignal.connect(self.directiveProgressSlot)
+        worker.finishedSignal.connect(self.directiveFinishedSlot)
+        worker.failedSignal.connect(self.directiveFailedSlot)
+        self.staplestatterDialog.setBusy(True)
+        worker.start()
+
+    def cancelDirective(self):
+        """ Cancel processing of the current directive, if any. """
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        self._worker = None
+        self.staplestatterDialog.setBusy(False, "Cancelled")
+
+    def directiveProgressSlot(self, fraction, message):
+        """ Qt slot, shows progress reported by the DirectiveWorker. """
+        if self._worker is not None:
+            self.staplestatterDialog.showProgress(fraction, message)
+
+    def directiveFinishedSlot(self, worker, scored):
+        """ Qt slot, plots the scores from the DirectiveWorker (in the GUI thread). """
+        if worker is not self._worker:
+            return  # The directive was cancelled.
+        self._worker = None
+        with timing.Tracer("plotting (GUI thread)") as tracer:
+            self._lastResult = staplestatter.plot_statspecs(worker.directive, scored, worker.designname)
+        self._lastResult['hyb_patterns'] = worker.hyb_patterns
+        self._lastDirective = worker.directive
+        self._lastTrace = worker.tracer
+        self.staplestatterDialog.setBusy(False, "Done")
+        self._showTraces(worker.directive, [self._snapshotTrace, worker.tracer, tracer])
+        self._startLiveMode(worker.directive)
+
+    def directiveFailedSlot(self, worker, message):
+        """ Qt slot, invoked if the DirectiveWorker raised an exception. """
+        if worker is not self._worker:
+            return
+        self._worker = None
+        print("Error while processing staplestatter directive:", message)
+        self.staplestatterDialog.setBusy(False, "Error: %s" % message)
+
+    def _startLiveMode(self, directive):
+        """ Start live updates of the last result's plots, if the directive has "live: true". """
+        if not directive.get('live') or not self._lastResult or not self._lastResult['lines']:
+            return
+        self._liveUpdater = LiveUpdater(directive, get_part(self.doc), self._lastResult['lines'],
+                                        debounce_ms=directive.get('live_delay'))
+        print("Staplestatter live mode: plots are updated when the design is edited.")
+
+    def stopLiveMode(self):
+        """ Stop live updates, if active. """
+        if self._liveUpdater is not None:
+            self._liveUpdater.stop()
+            self._liveUpdater = None
+
+    def _showTraces(self, directive, tracers):
+        """ Log and show the timings recorded by tracers, and save the scoring trace to trace_file. """
+        for tracer in tracers:
+            tracer.log_summary()
+        if directive.get('trace_file'):
+            self._lastTrace.save(directive['trace_file'])
+        self.staplestatterDialog.showTimings("\n\n".join(
+            "%s:\n%s" % (tracer.name, tracer.format_summary()) for tracer in tracers))
 
     def savePlotToFileSlot(self):
         """
@@ -255,8 +507,11 @@ class StaplestatterHandler(object):
             print("Filepath is: '%s' - not saving..." % (filepath, ))
             return
         self.staplestatterDialog.plotsfileLineEdit.setText(filepath)
-        if self._lastResult:
-            self._lastResult['figure'].savefig(filepath)
+        if self._lastResult and self._lastResult['figure'] is not None:
+            with timing.Tracer("save plot") as tracer:
+                with timing.span("save"):
+                    self._lastResult['figure'].savefig(filepath)
+            self.staplestatterDialog.showTimings(tracer.format_summary(), append=True)
         else:
             print("No stats yet: self._lastResult: ", self._lastResult)
 
@@ -265,13 +520,16 @@ class StaplestatterHandler(object):
         print("saveStatsToFileSlot() invoked by pressing browseStatsfileButton.")
         cur = str(self.staplestatterDialog.statsfileLineEdit.text())
         directory = os.path.dirname(cur) if cur else self._fileOpenPath
-        filepath = self.browseForNewOrExistingFile(dialog_title="Save stats as file...", directory=directory)
+        filepath = self.browseForNewOrExistingFile(
+            dialog_title="Save stats as file...", directory=directory,
+            filefilter="YAML data structure (*.yml *.yaml);;Score table (*.npz)")
         if not filepath:
             print("Filepath is: '%s' - not saving..." % (filepath, ))
             return
         self.staplestatterDialog.statsfileLineEdit.setText(filepath)
         if self._lastResult:
-            staplestatter.savestats(self._lastResult['scores'], filepath)
+            staplestatter.savestats(self._lastResult['scores'], filepath, statspecs=self._lastDirective['statspecs'],
+                                    hyb_patterns=self._lastResult.get('hyb_patterns'))
         else:
             print("No stats yet. Run process and plot once first. self._lastResult: ", self._lastResult)
 
@@ -372,10 +630,56 @@ class StaplestatterDialog(QDialog, StaplestatterUiDialog):
         QDialog.__init__(self, parent, Qt.Sheet)
         self.setupUi(self)
         self.handler = handler
+        self.timingsTextEdit = None     # Created by showTimings()
+        self.progressBar = None         # Created by showProgress()
+        self._processButtonText = self.processButton.text()
         # Setting keyboard shortcuts:
         #fb = self.buttonBox.button(QDialogButtonBox.Cancel)
         #fb.setShortcut(QKeySequence(Qt.CTRL | Qt.Key_R ))
 
+    def showTimings(self, text, append=False):
+        """ Show timings text in the "Timings" tab, which is created the first time it is needed. """
+        if self.timingsTextEdit is None:
+            self.timingsTextEdit = QPlainTextEdit(self.tabWidget)
+            self.timingsTextEdit.setReadOnly(True)
+            self.timingsTextEdit.setObjectName("timingsTextEdit")
+            # A monospace font keeps the table columns aligned:
+            font = self.timingsTextEdit.font()
+            font.setFamily("Courier")
+            self.timingsTextEdit.setFont(font)
+            self.tabWidget.addTab(self.timingsTextEdit, "Timings")
+        if append:
+            self.timingsTextEdit.appendPlainText(text)
+        else:
+            self.timingsTextEdit.setPlainText(text)
+
+    def showProgress(self, fraction, message):
+        """ Show progress bar below the tabs, which is created the first time it is needed. """
+        if self.progressBar is None:
+            self.progressBar = QProgressBar(self)
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setObjectName("progressBar")
+            self.verticalLayout_2.addWidget(self.progressBar)
+        self.progressBar.setValue(int(round(fraction*100)))
+        self.progressBar.setFormat(message + " (%p%)")
+        self.progressBar.show()
+
+    def setBusy(self, busy, message=None):
+        """
+        Show whether a directive is being processed in the background.
+        While busy, the process buttons are cancel buttons.
+        """
+        text = "Cancel" if busy else self._processButtonText
+        self.processButton.setText(text)
+        self.processButton2.setText(text)
+        if busy:
+            self.showProgress(0, message or "Scoring...")
+        elif self.progressBar is not None:
+            if message:
+                self.progressBar.setFormat(message)
+            else:
+                self.progressBar.hide()
+
     def keyPressEvent(self, e):
         """ Use QDialog parent class to deal with key presses. """
         return QDialog.keyPressEvent(self, e)
@@ -21,6 +21,7 @@ setup(
         'six',
         'biopython',
         'matplotlib',
+        'numpy',
         'svgwrite',
     ],
     classifiers=[
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for processing many cadnano files in parallel, e.g. from the CLI scripts in bin/.
+
+Usage:
+    results = run_batch(process_cadnano_file, cadnano_files, args, jobs=8)
+    print(format_summary_table(results))
+
+process_cadnano_file(cadnano_file, *fun_args) is called in a worker process for each file, and
+should return a dict with summary values for the file (or None). The worker processes use the
+headless Agg matplotlib backend, so plots can be saved to file without a display.
+
+Each result is a dict with the summary values returned by the function, plus:
+    file, status ("ok" or "error"), error, wall (seconds), cpu (seconds).
+
+"""
+
+from __future__ import absolute_import, print_function
+import os
+import traceback
+import logging
+logger = logging.getLogger(__name__)
+
+from . import plotutils
+from . import timing
+
+
+def init_headless_worker():
+    """
+    Process pool initializer: Use the non-interactive Agg backend for matplotlib in this process.
+    """
+    os.environ['MPLBACKEND'] = 'Agg'
+    if plotutils.get_plot_mode() != 'none':
+        os.environ[plotutils.PLOT_MODE_ENVVAR] = 'headless'
+    try:
+        import matplotlib
+    except ImportError:
+        return
+    try:
+        matplotlib.use("Agg", force=True)
+    except TypeError:
+        # Older matplotlib without the force argument:
+        matplotlib.use("Agg")
+    try:
+        from matplotlib import pyplot
+        pyplot.switch_backend("Agg")
+    except ImportError:
+        pass
+
+
+def _run_task(task):
+    """ Run a single batch task, returning a result dict with timings and status. """
+    fun, filename, fun_args = task
+    wall, cpu = timing.wall_timer(), timing.cpu_timer()
+    result = {'file': filename, 'status': 'ok', 'error': ''}
+    try:
+        result.update(fun(filename, *fun_args) or {})
+    except Exception as e:  # pylint: disable=W0703
+        result.update(status='error', error="%s: %s" % (type(e).__name__, e))
+        logger.debug("Error processing %s:\n%s", filename, traceback.format_exc())
+    result.update(wall=timing.wall_timer() - wall, cpu=timing.cpu_timer() - cpu)
+    return result
+
+
+def run_batch(fun, filenames, fun_args=(), jobs=None, progress=print):
+    """
+    Call fun(filename, *fun_args) for every file in filenames, using <jobs> worker processes
+    (default: one per CPU; jobs=1 processes the files in the current process).
+    progress is called with a progress message for every file as it completes (use None for no messages).
+    Returns list of result dicts, in the same order as filenames.
+    """
+    from multiprocessing import Pool, cpu_count
+    if not jobs:
+        jobs = cpu_count()
+    jobs = min(jobs, len(filenames)) or 1
+    tasks = [(fun, filename, tuple(fun_args)) for filename in filenames]
+    start = timing.wall_timer()
+    results = {}
+    if jobs == 1:
+        init_headless_worker()
+        results_iter = (_run_task(task) for task in tasks)
+        pool = None
+    else:
+        pool = Pool(jobs, initializer=init_headless_worker)
+        results_iter = pool.imap_unordered(_run_task, tasks)
+    try:
+        for n, result in enumerate(results_iter, 1):
+            results[result['file']] = result
+            if progress:
+                progress("[{}/{}] {} {} ({:.2f} s, {:.1f} s elapsed){}".format(
+                    n, len(tasks), result['status'], result['file'], result['wall'], timing.wall_timer() - start,
+                    " - " + result['error'] if result['error'] else ""))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return [results[filename] for filename in filenames]
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return "{:.2f}".format(value)
+    return str(value)
+
+
+def get_summary_columns(results, columns=None):
+    """ Return list of columns, starting with "file", followed by summary values in order of appearance. """
+    if columns is not None:
+        return columns
+    columns = ['file']
+    for result in results:
+        columns.extend(key for key in result if key not in columns and key not in ('wall', 'cpu', 'error'))
+    return columns + ['wall', 'cpu', 'error']
+
+
+def format_summary_table(results, columns=None):
+    """
+    Return a plain-text table with one line per result.
+        >>> print(format_summary_table([{'file': 'a.json', 'best': 1.5, 'wall': 2.0, 'cpu': 1.0, 'error': ''}]))
+        file    best  wall  cpu   error
+        a.json  1.50  2.00  1.00
+    """
+    columns = get_summary_columns(results, columns)
+    rows = [columns] + [[_format_value(result.get(col, "")) for col in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(val.ljust(width) for val, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def save_summary(results, filename, columns=None):
+    """ Save results as csv (or tsv, if filename ends with .tsv). """
+    import csv
+    columns = get_summary_columns(results, columns)
+    delimiter = "\t" if filename.lower().endswith(".tsv") else ","
+    with open(filename, 'w') as fp:
+        writer = csv.DictWriter(fp, columns, delimiter=delimiter, extrasaction='ignore', lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(results)
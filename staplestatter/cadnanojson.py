@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for reading cadnano v2 json files directly, without cadnano or Qt.
+
+Loading a design with cadnano (fileutils.load_doc_from_file) builds a full cadnano Document with
+QObject-based virtual helices, strandsets, strands and oligos. For scoring, we only need the strand
+ranges and connections, which are all in the json "vstrands" list:
+    vstrands: [{num: <vhelix number>, row: <row>, col: <col>,
+                scaf: [[5p vh, 5p idx, 3p vh, 3p idx], ...],   # one entry per base index
+                stap: [[5p vh, 5p idx, 3p vh, 3p idx], ...],
+                loop: [<insertion length at idx>, ...],
+                skip: [<-1 if idx is skipped, else 0>, ...],
+                stap_colors: [[<5p idx>, <color int>], ...],
+                }, ...]
+
+JsonPart reads this into a compactpart.CompactPart, i.e. strand, oligo and complement tables,
+with strand and oligo objects providing the subset of the cadnano API used by cadnanoreader,
+oligo_utils and rotation. The existing scoring functions can thus be used directly:
+    part = load_cadnano_json("design.json")
+    apply_sequences(part, seq)
+    hyb_pattern = cadnanoreader.get_oligo_hyb_pattern(part, method="TM", Mg=10)
+
+The json file does not include sequences; apply sequences with oligo.applySequence(seq), same as in cadnano.
+
+"""
+
+from __future__ import absolute_import, print_function
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from .compactpart import CompactPart
+from . import timing
+
+
+@timing.traced("load")
+def load_cadnano_json(filename):
+    """ Load cadnano v2 json file and return a JsonPart. """
+    with open(filename) as fp:
+        nno_dict = json.load(fp)
+    return JsonPart(nno_dict)
+
+
+class JsonPart(CompactPart):
+    """
+    CompactPart read directly from cadnano v2 json data (dict), see module docstring.
+    """
+
+    def __init__(self, nno_dict):
+        try:
+            vstrands = nno_dict["vstrands"]
+        except KeyError:
+            raise ValueError("Not a cadnano v2 json design: No 'vstrands' entry.")
+        super(JsonPart, self).__init__(name=nno_dict.get("name"))
+        self._read_vstrands(vstrands)
+
+    def _read_vstrands(self, vstrands):
+        """ Add strands from the json vstrands list, link them and finalize the part. """
+        strand_by_5p = {}   # (is_scaf, vh, idx5p) -> sid
+        links_3p = []       # (sid, is_scaf, 3p vh, 3p idx)
+        colors = {}         # (vh, idx5p) -> color
+        for vstrand in vstrands:
+            num = vstrand["num"]
+            insertions = {idx: length for idx, length in enumerate(vstrand.get("loop") or []) if length}
+            for idx, skip in enumerate(vstrand.get("skip") or []):
+                if skip:
+                    insertions[idx] = insertions.get(idx, 0) + skip
+            vh = self.add_virtual_helix(num, (vstrand.get("row"), vstrand.get("col")), insertions)
+            for idx, color in vstrand.get("stap_colors", []):
+                colors[(num, idx)] = "#%06x" % color
+            for is_scaf, bases in ((True, vstrand["scaf"]), (False, vstrand["stap"])):
+                drawn5to3 = vh.isEvenParity() == is_scaf
+                step = 1 if drawn5to3 else -1
+                idxs = range(len(bases)) if drawn5to3 else range(len(bases)-1, -1, -1)
+                idx5p = None
+                for idx in idxs:  # 5p to 3p
+                    prev_vh, prev_idx, next_vh, next_idx = bases[idx]
+                    if prev_vh == prev_idx == next_vh == next_idx == -1:
+                        continue
+                    if idx5p is None or (prev_vh, prev_idx) != (num, idx - step):
+                        idx5p = idx
+                    if (next_vh, next_idx) != (num, idx + step):
+                        # 3p end of strand:
+                        sid = self.add_strand(num, is_scaf, min(idx5p, idx), max(idx5p, idx), drawn5to3)
+                        strand_by_5p[(is_scaf, num, idx5p)] = sid
+                        if next_vh != -1:
+                            links_3p.append((sid, is_scaf, next_vh, next_idx))
+                        idx5p = None
+        for sid, is_scaf, next_vh, next_idx in links_3p:
+            try:
+                next_sid = strand_by_5p[(is_scaf, next_vh, next_idx)]
+            except KeyError:
+                logger.warning("Strand %s links to %s[%s], which is not a strand 5p end; ignoring link.",
+                               sid, next_vh, next_idx)
+                continue
+            self.link_strands(sid, next_sid)
+        self.finalize(colors)
@@ -187,6 +187,30 @@ def overlap(x, y, a, b):
     return c, d
 # end def
 
+def sweep_overlaps(intervals_a, intervals_b):
+    """
+    yields (i, j, low, high) for every overlap between intervals_a[i] and
+    intervals_b[j], in order of increasing index.
+    both lists must contain (low, high, ...) tuples (inclusive), sorted by low,
+    with no overlaps within the same list (like the strands of a strandset).
+    the lists are merged in a single pass, O(len(a) + len(b) + overlaps):
+        >>> list(sweep_overlaps([(0, 9), (12, 20)], [(3, 14), (16, 30)]))
+        [(0, 0, 3, 9), (1, 0, 12, 14), (1, 1, 16, 20)]
+    """
+    i, j = 0, 0
+    n_a, n_b = len(intervals_a), len(intervals_b)
+    while i < n_a and j < n_b:
+        a_low, a_high = intervals_a[i][:2]
+        b_low, b_high = intervals_b[j][:2]
+        if a_low <= b_high and b_low <= a_high:
+            yield i, j, max(a_low, b_low), min(a_high, b_high)
+        # advance whichever interval ends first; it cannot overlap anything further on:
+        if a_high < b_high:
+            i += 1
+        else:
+            j += 1
+# end def
+
 def trace(n):
     """Returns a stack trace n frames deep"""
     s = extract_stack()
@@ -92,26 +92,18 @@ import logging
 logger = logging.getLogger(__name__)
 # Note: Use pytest-capturelog to capture and display logging messages during pytest
 import inspect
-try:
-    from Bio.SeqUtils.MeltingTemp import Tm_NN
-except ImportError:
-    print("staplestatter: Could not import from Bio.SeqUtils.MeltingTemp - Tm calculations will not be available!")
-    # TODO: Consider having a local copy of Bio.SeqUtils.MeltingTemp, so as not to require the whole biopython package.
-    # See your Nascent project (although that one is strictly Python3, I think.
-    # OBS: The biopython package is only 2.3 MB, so not too bad a dependency matplotlib is much larger.
-
-# Cadnano imports:
-try:
-    # cadnano2.5:
-    from cadnano.part.part import Part
-except ImportError:
-    # cadnano2.0:
-    from model.parts.part import Part
+
+# Cadnano is imported by get_part_class() when needed, since importing cadnano (and Qt) is slow.
+_Part = False    # False: not imported yet; None: cadnano is not available.
 
 # Local imports:
 # We just need the `overlap()` function from cadnano's `util.py` module,
 # so I've copied it to a local module, so we can use it independently of cadnano.
 from .cadnanolib import util
+# Tm calculations use a local nearest-neighbour implementation (same results as Bio.SeqUtils.MeltingTemp.Tm_NN):
+from .meltingtemp import get_tm_engine
+from .compactpart import CompactPart
+from . import timing
 
 
 # CADNANO_PATH environment variable is set so that the maya plugin works...
@@ -124,12 +116,34 @@ def ps(obj):
     print(inspect.getsource(obj))
 
 
+def get_part_class():
+    """ Return cadnano's Part class, importing it on first use, or None if cadnano is not available. """
+    global _Part
+    if _Part is False:
+        try:
+            # cadnano2.5:
+            from cadnano.part.part import Part
+        except ImportError:
+            try:
+                # cadnano2.0:
+                from model.parts.part import Part
+            except ImportError:
+                # The hybridization pattern functions also work on parts from cadnanojson, which doesn't need cadnano.
+                print("Could not import cadnano; only parts loaded with staplestatter.cadnanojson can be used.")
+                Part = None
+        _Part = Part
+    return _Part
+
+
 def get_part(doc):
     """
     Get the documents first part.
     This version uses doc.parts()/doc.children(), but you can also use the more direct
     doc.selectedPart() or - for new cadnano - doc.selectedInstance().parent
+    Parts loaded without cadnano (CompactPart, e.g. from fileutils.load_doc_from_file) are returned as-is.
     """
+    if isinstance(doc, CompactPart):
+        return doc
     try:
         parts = doc.parts()  # Older versions.
     except AttributeError:
@@ -147,7 +161,8 @@ def get_part_alt(doc):
         part = doc.selectedPart()
     if VERBOSE > 1:
         print("Part:", part)
-    if not isinstance(part, Part):
+    Part = get_part_class()
+    if Part is not None and not isinstance(part, Part):
         if hasattr(part, "parent"):
             # part is actually just a cadnano.objectinstance.ObjectInstance
             # we need the cadnano.part.squarepart.SquarePart which is ObjectInstance.parent
@@ -162,6 +177,29 @@ def get_part_alt(doc):
     return part
 
 
+def getcomplementstrands(strand):
+    """
+    Return list of strands complementary to strand, ordered from low to high index.
+    """
+    try:
+        return strand.getComplementStrands()  # Cadnano2.5 API
+    except AttributeError:
+        # Cadnano2 API:
+        return strand.strandSet().complementStrandSet()._findOverlappingRanges(strand)
+
+
+def getstrandhybridizationcomplements(strand, sort="5p3p"):
+    """
+    Like getstrandhybridizationregions, but returns a list of (cStrand, (lowIdx, highIdx)) tuples,
+    i.e. each hybridization region together with the complementary strand it hybridizes with.
+    """
+    hyb_complements = [(cStrand, util.overlap(*(strand.idxs() + cStrand.idxs())))
+                       for cStrand in getcomplementstrands(strand)]
+    if sort == "5p3p" and not strand.isDrawn5to3():
+        return hyb_complements[::-1]
+    return hyb_complements
+
+
 def getstrandhybridizationregions(strand, sort="5p3p"):
     """
     A strand may hybridize with one or more strands.
@@ -181,11 +219,7 @@ def getstrandhybridizationregions(strand, sort="5p3p"):
     or use strandset.strand_heap, which is just a list of the strands on the strandset.
     (it is still in master branch as of 2015/04/24, but not in e.g. outlinerdev)
     """
-    try:
-        compl_strands = strand.getComplementStrands()  # Cadnano2.5 API
-    except AttributeError:
-        # Cadnano2 API:
-        compl_strands = strand.strandSet().complementStrandSet()._findOverlappingRanges(strand)
+    compl_strands = getcomplementstrands(strand)
 
     # # Code debugging:
     # print("Strand %s, complementary strands: %s" % (strand, compl_strands))
@@ -210,7 +244,67 @@ def getstrandhybridizationregions(strand, sort="5p3p"):
     return hyb_regions
 
 
-def getstrandhybridizationseqs(strand, **kwargs):
+@timing.traced("hyb_regions")
+def get_part_hyb_regions(part):
+    """
+    Return the hybridization region table for all strands of part, as dict:
+        strand : [(cStrand, (lowIdx, highIdx)), ...]
+    with the regions of each strand ordered 5p to 3p, same as getstrandhybridizationcomplements(strand).
+    Rather than asking each strand for its complementary strands, the strands on each virtual helix are
+    grouped by direction and sorted, and the two strandsets are merged in a single sweep.
+    The table is a snapshot; it is not updated if the part is changed.
+    """
+    strandsets = {}     # (vh key, isDrawn5to3) -> [(lowIdx, highIdx, strand), ...]
+    for oligo in part.oligos():
+        for strand in oligo.strand5p().generator3pStrand():
+            strandsets.setdefault((_strand_vh_key(strand), strand.isDrawn5to3()), []).append(
+                strand.idxs() + (strand,))
+    regions = {strand: [] for strands in strandsets.values() for _, _, strand in strands}
+    for (vh, drawn5to3), strands in strandsets.items():
+        if not drawn5to3 or (vh, False) not in strandsets:
+            continue
+        fwd = sorted(strands, key=lambda entry: entry[0])
+        rev = sorted(strandsets[(vh, False)], key=lambda entry: entry[0])
+        for i, j, lowIdx, highIdx in util.sweep_overlaps(fwd, rev):
+            regions[fwd[i][2]].append((rev[j][2], (lowIdx, highIdx)))
+            regions[rev[j][2]].append((fwd[i][2], (lowIdx, highIdx)))
+    # Regions were added low to high; strands drawn 3p to 5p must be reversed:
+    for strand, strand_regions in regions.items():
+        if not strand.isDrawn5to3():
+            strand_regions.reverse()
+    return regions
+
+
+def getstrandinsertionlengths(strand):
+    """
+    Return dict with {idx: insertion length} for insertions (positive) and skips (-1) on strand.
+    Returns an empty dict if the cadnano version does not provide insertions per strand.
+    """
+    try:
+        insertions = strand.insertionsOnStrand()
+    except AttributeError:
+        return {}
+    return {insertion.idx(): insertion.length() for insertion in insertions}
+
+
+def getstrandsequenceslice(strand, lowIdx, highIdx, insertions=None):
+    """
+    Return (start, end) such that strand.sequence()[start:end] are the bases from lowIdx to highIdx.
+    The strand sequence is stored 5p to 3p, i.e. from the high index for strands drawn 3p to 5p,
+    and includes insertions (and excludes skips).
+    """
+    if insertions is None:
+        insertions = getstrandinsertionlengths(strand)
+    sLowIdx, sHighIdx = strand.idxs()
+    if strand.isDrawn5to3():
+        start = lowIdx - sLowIdx + sum(length for idx, length in insertions.items() if sLowIdx <= idx < lowIdx)
+    else:
+        start = sHighIdx - highIdx + sum(length for idx, length in insertions.items() if highIdx < idx <= sHighIdx)
+    end = start + highIdx - lowIdx + 1 + sum(length for idx, length in insertions.items() if lowIdx <= idx <= highIdx)
+    return start, end
+
+
+def getstrandhybridizationseqs(strand, hyb_regions=None, **kwargs):
     """
     Consider the strand and it's two complementary segments:
         AAAAAAAAAGGGGGGGGGACACACACACACACACACACAC
@@ -218,15 +312,14 @@ def getstrandhybridizationseqs(strand, **kwargs):
     The top strand hybridizes in two places, the AA/TT region and the AC/TG region.
     This should return a list of:
         ["AAAAAAAAA", "ACACACACACACACACACACAC"]
-    DOES NOT ACCOUNT FOR SKIPS OR LOOPS!
+    Insertions and skips are accounted for if the cadnano version provides strand.insertionsOnStrand().
+    hyb_regions is the strand's list of (lowIdx, highIdx) regions, 5p to 3p, if already known
+    (e.g. from get_part_hyb_regions); otherwise they are looked up.
     """
-    hyb_regions = getstrandhybridizationregions(strand)
-    try:
-        # Cadnano2.5:
-        startIdx = strand._base_idx_low
-    except AttributeError:
-        # Cadnano2:
-        startIdx = strand._baseIdxLow
+    if hyb_regions is None:
+        hyb_regions = getstrandhybridizationregions(strand)
+    insertions = getstrandinsertionlengths(strand)
+    slices = [getstrandsequenceslice(strand, regLow, regHigh, insertions) for regLow, regHigh in hyb_regions]
 
     strand_sequence = strand.sequence()
     # It is okay to have unhybridized loops or dangling ends, they don't change anything in terms of kinetic traps.
@@ -236,7 +329,7 @@ def getstrandhybridizationseqs(strand, **kwargs):
     #     print("\nError: strand %s has no sequence;" % strand,
     #     "you should apply a sequence before doing any sequence-specific things.\n")
     # assert strand_sequence  # Make sure we don't try this with an empty strand sequence.
-    hyb_seqs = (strand_sequence[lowIdx-startIdx:highIdx-startIdx+1] for lowIdx, highIdx in hyb_regions)
+    hyb_seqs = (strand_sequence[start:end] for start, end in slices)
     # Uh, maybe just:
     # hyb_seqs = st.getSequenceList()
     # No, not sure this does exactly what I want...
@@ -244,7 +337,7 @@ def getstrandhybridizationseqs(strand, **kwargs):
     return hyb_seqs
 
 
-def getstrandhybridizationtm(strand, **kwargs):
+def getstrandhybridizationtm(strand, hyb_regions=None, **kwargs):
     """
     Consider the strand and it's two complementary segments:
         AAAAAAAAAGGGGGGGGGACACACACACACACACACACAC
@@ -253,11 +346,14 @@ def getstrandhybridizationtm(strand, **kwargs):
     This should return a list of Tm values for each of the hybridization stretches,
     considering ONLY the hybridized part (no dangling sequences or end-stacking, sorry):
         [20, 70]
-    kwargs is passed on to the Tm calculating method (currently Bio.SeqUtils.MeltingTemp.Tm_NN)
+    kwargs is passed on to the Tm calculating engine (meltingtemp.TmEngine, same arguments as
+    Bio.SeqUtils.MeltingTemp.Tm_NN). Segment Tms are memoized per set of kwargs.
+    hyb_regions: see getstrandhybridizationseqs.
     """
-    from Bio.SeqUtils.MeltingTemp import Tm_NN
+    tm_engine = get_tm_engine(**kwargs)
     # Trim out empty strand hybridizations:
-    hyb_seqs = list(seq for seq in getstrandhybridizationseqs(strand) if seq.strip())  # Remove loops and dangling ends
+    # Remove loops and dangling ends:
+    hyb_seqs = list(seq for seq in getstrandhybridizationseqs(strand, hyb_regions) if seq.strip())
     # print("hyb_seqs:")
     # print(hyb_seqs)
     # An oligo consists of one or more strands (straight stretches on the same vhelix).
@@ -268,16 +364,17 @@ def getstrandhybridizationtm(strand, **kwargs):
     #     # No defined hybridization sequences:
     #     raise ValueError("Strand %s does not have any hybridized, sequence-specified " % (strand,))
     try:
-        hyb_TMs = [Tm_NN(seq, **kwargs) for seq in hyb_seqs]
-    except IndexError as e:
+        with timing.span("tm", event=False):
+            hyb_TMs = [tm_engine.tm(seq) for seq in hyb_seqs]
+    except (IndexError, ValueError) as e:
         #print("IndexError:", e)
         #print(" - for hyb_seqs:", hyb_seqs)
-        raise ValueError("hyb_seqs {} produced by strand {} part of oligo {} raised IndexError {}"
-                         .format(hyb_seqs, strand, strand.oligo(), e))
+        raise ValueError("hyb_seqs {} produced by strand {} part of oligo {} raised {} {}"
+                         .format(hyb_seqs, strand, strand.oligo(), type(e).__name__, e))
     return hyb_TMs
 
 
-def getstrandhybridizationlengths(strand, **kwargs):
+def getstrandhybridizationlengths(strand, hyb_regions=None, **kwargs):
     """
     Consider the strand and it's two complementary segments:
         AAAAAAAAAGGGGGGGGGACACACACACACACACACACAC
@@ -285,6 +382,7 @@ def getstrandhybridizationlengths(strand, **kwargs):
     The top strand hybridizes in two places, the AA/TT region and the AC/TG region.
     This should return a list of:
         [9, 22]
+    hyb_regions: see getstrandhybridizationseqs.
     """
     #return strand.totalLength()    # too simple, does not account for ss or hybridized regions...
     #hyb_stretches = list()
@@ -298,7 +396,8 @@ def getstrandhybridizationlengths(strand, **kwargs):
     #    lowIdx, highIdx = util.overlap(sLowIdx, sHighIdx, cLowIdx, cHighIdx)
     #    hyb_stretches.append(highIdx - lowIdx + 1)  # If an oligo starts at idx 30 and ends at idx 31, it is 2 nt long.
 
-    hyb_regions = getstrandhybridizationregions(strand)
+    if hyb_regions is None:
+        hyb_regions = getstrandhybridizationregions(strand)
     hyb_lengths = [(highIdx - lowIdx + 1) for lowIdx, highIdx in hyb_regions]
     return hyb_lengths
 
@@ -341,14 +440,16 @@ def get_oligo_hyb_lengths(cadnanopart, stapleoligos=True, scaffoldoligos=False):
     return hyb_lengths
 
 
-def get_oligo_hyb_pattern(cadnanopart, stapleoligos=True, scaffoldoligos=False, method="length", **kwargs):
+# Strand hybridization methods accepting pre-calculated hyb_regions:
+REGION_METHODS = (getstrandhybridizationlengths, getstrandhybridizationseqs, getstrandhybridizationtm)
+
+
+def get_strand_hyb_method(method):
     """
-    Return oligo hybridization lengths for cadnano part, as dict:
-        oligo_locString : <list of oligo hybridization lenghts>
+    Return the strand hybridization function for method, which can be either a
+    string, e.g. "length", "seq" or "TM", or a function taking a strand (plus kwargs)
+    and returning a list of values.
     """
-    oligoset = cadnanopart.oligos()  # simply returns ._oligos. Includes BOTH staples AND scaffold.
-
-    print("get_oligo_hyb_pattern(): method =", method)
     if isinstance(method, str):
         if "length" in method:
             method = getstrandhybridizationlengths
@@ -359,11 +460,208 @@ def get_oligo_hyb_pattern(cadnanopart, stapleoligos=True, scaffoldoligos=False,
         else:
             err_msg = "ERROR: method='%s' is not a recognized value." % (method,)
             raise ValueError(err_msg)
-    print("- get_oligo_hyb_pattern(): method =", method)
+    return method
+
+
+def get_oligo_hyb_values(oligo, method, region_table=None, **kwargs):
+    """
+    Return the hybridization pattern of a single oligo, i.e. the values produced by
+    the strand hybridization method for all strands of the oligo, from 5p to 3p.
+    method must be a strand hybridization function, c.f. get_strand_hyb_method().
+    If region_table (from get_part_hyb_regions) is given, each strand's hybridization regions
+    are taken from the table and passed to method as hyb_regions.
+    """
+    if region_table is None:
+        return [val for strand in oligo.strand5p().generator3pStrand()
+                for val in method(strand, **kwargs) if val]
+    return [val for strand in oligo.strand5p().generator3pStrand()
+            for val in method(strand, hyb_regions=[region for _, region in region_table.get(strand, ())], **kwargs)
+            if val]
+
+
+@timing.traced("hyb_pattern")
+def get_oligo_hyb_pattern(cadnanopart, stapleoligos=True, scaffoldoligos=False, method="length", **kwargs):
+    """
+    Return oligo hybridization lengths for cadnano part, as dict:
+        oligo_locString : <list of oligo hybridization lenghts>
+    This will traverse all strands of all oligos in the part on every call;
+    use get_hyb_pattern_index(part).hyb_pattern(...) to re-use previous results.
+    For the built-in methods, the hybridization regions of all strands are found once with
+    get_part_hyb_regions() and shared by all oligos.
+    """
+    oligoset = cadnanopart.oligos()  # simply returns ._oligos. Includes BOTH staples AND scaffold.
+
+    logger.debug("get_oligo_hyb_pattern(): method = %s", method)
+    method = get_strand_hyb_method(method)
     # For a strand, getstrandhybridization_methods will return a list of
     # values. This is because strand may not be hybridized to the same complementary strand all the way.
-    hyb_patterns = {oligo.locString(): [val for strand in oligo.strand5p().generator3pStrand()
-                                        for val in method(strand, **kwargs) if val]
+    region_table = get_part_hyb_regions(cadnanopart) if method in REGION_METHODS else None
+    hyb_patterns = {oligo.locString(): get_oligo_hyb_values(oligo, method, region_table, **kwargs)
                     for oligo in oligoset
                     if stapleoligos and oligo.isStaple() or scaffoldoligos and not oligo.isStaple()}
     return hyb_patterns
+
+
+def _strand_vh_key(strand):
+    """ Return a key identifying the virtual helix of strand (the vhelix number). """
+    try:
+        # Cadnano2 and cadnano2.5-legacy:
+        return strand.virtualHelix().number()
+    except AttributeError:
+        # Cadnano2.5:
+        return strand.idNum()
+
+
+def _vh_key(vh):
+    """ Part signals pass either a VirtualHelix (cadnano2) or the vhelix id number (cadnano2.5). """
+    return vh if isinstance(vh, int) else vh.number()
+
+
+class HybPatternIndex(object):
+    """
+    Cached hybridization patterns for a single cadnano part.
+
+    Patterns are calculated per oligo and kept for each (hyb_method, kwargs) combination.
+    Each oligo has a version number, which is bumped when cadnano's model signals
+    report that the oligo (or a strand on one of its virtual helices) has changed.
+    On the next hyb_pattern() call, only oligos with a stale version (or a changed
+    length or 5p strand) are re-traversed. Oligos added to or removed from the part
+    are picked up automatically, since the part's oligo set is checked on every call.
+
+    Use get_hyb_pattern_index(part) to get the (shared) index for a part, rather than
+    instantiating this directly.
+    If you modify a part in a way that does not emit any of the signals listened to,
+    call invalidate() to force re-calculation of everything.
+    """
+
+    # Signals emitted by oligos when the oligo's sequence or composition changes:
+    oligo_signal_names = ('oligoSequenceAddedSignal', 'oligoSequenceClearedSignal',
+                          'oligoIdentityChangedSignal', 'oligoAppearanceChangedSignal')
+    # Signals emitted by the part when strands on a virtual helix changes (args: part, vhelix):
+    part_strand_signal_names = ('partStrandChangedSignal', )
+    # Signals emitted by the part after which nothing cached can be trusted:
+    part_reset_signal_names = ('partVirtualHelixRemovedSignal', 'partVirtualHelixRenumberedSignal',
+                               'partVirtualHelixResizedSignal', 'partDestroyedSignal')
+    # Use a whole-part region table when more than this fraction of the oligos must be re-calculated:
+    region_table_fraction = 0.25
+
+    def __init__(self, part):
+        self.part = part
+        self._patterns = {}         # (method, kwargs-key) -> {oligo: (version, signature, pattern)}
+        self._oligo_version = {}    # oligo -> int
+        self._vh_oligos = {}        # vhelix number -> set of oligos with strands on that vhelix
+        self._connected = set()     # oligos whose signals we are connected to
+        self.traversals = 0         # number of oligo traversals, mostly for testing/benchmarking.
+        self._connect(part, self.part_strand_signal_names, self.partStrandChangedSlot)
+        self._connect(part, self.part_reset_signal_names, self.partResetSlot)
+
+    @staticmethod
+    def _connect(obj, signal_names, slot):
+        """ Connect slot to all of obj's signals in signal_names (signals not available are ignored). """
+        for name in signal_names:
+            signal = getattr(obj, name, None)
+            if signal is not None:
+                signal.connect(slot)
+
+    def invalidate(self, oligos=None):
+        """ Invalidate cached patterns for oligos, or everything if oligos is None. """
+        if oligos is None:
+            self._patterns.clear()
+            self._vh_oligos.clear()
+            return
+        for oligo in oligos:
+            self._oligo_version[oligo] = self._oligo_version.get(oligo, 0) + 1
+
+    ### SLOTS ###
+
+    def oligoChangedSlot(self, oligo, *args):
+        """ Slot for oligo signals; the first argument is always the oligo. """
+        self.invalidate([oligo])
+
+    def partStrandChangedSlot(self, part, vh, *args):
+        """ Slot for part strand-changed signals; invalidates all oligos on the vhelix. """
+        self.invalidate(self._vh_oligos.get(_vh_key(vh), ()))
+
+    def partResetSlot(self, *args):
+        """ Slot for part signals after which all cached patterns are invalid. """
+        self.invalidate()
+
+    ### Pattern calculation ###
+
+    @staticmethod
+    def _signature(oligo):
+        """ Cheap checks that catch structural changes, even if no signal was received. """
+        return oligo.length(), oligo.strand5p()
+
+    def _calculate(self, oligo, method, kwargs, region_table=None):
+        """ Traverse oligo and return its pattern, updating the vhelix -> oligo map. """
+        self.traversals += 1
+        if oligo not in self._connected:
+            self._connect(oligo, self.oligo_signal_names, self.oligoChangedSlot)
+            self._connected.add(oligo)
+        for strand in oligo.strand5p().generator3pStrand():
+            self._vh_oligos.setdefault(_strand_vh_key(strand), set()).add(oligo)
+        return get_oligo_hyb_values(oligo, method, region_table, **kwargs)
+
+    @timing.traced("hyb_pattern")
+    def hyb_pattern(self, stapleoligos=True, scaffoldoligos=False, method="length", **kwargs):
+        """
+        Return oligo hybridization patterns for the part, as dict:
+            oligo_locString : <list of oligo hybridization values>
+        Same as get_oligo_hyb_pattern(), but only re-calculating patterns for oligos that have changed.
+        If more than region_table_fraction of the oligos must be re-calculated, the hybridization
+        regions of the whole part are found in a single sweep (get_part_hyb_regions);
+        otherwise each changed strand looks up its own complementary strands.
+        """
+        method = get_strand_hyb_method(method)
+        cache_key = (method, tuple(sorted(kwargs.items())))
+        cache = self._patterns.setdefault(cache_key, {})
+        oligos = self.part.oligos()
+        selected, stale = [], []
+        for oligo in oligos:
+            if not (stapleoligos and oligo.isStaple() or scaffoldoligos and not oligo.isStaple()):
+                continue
+            version = self._oligo_version.get(oligo, 0)
+            signature = self._signature(oligo)
+            entry = cache.get(oligo)
+            if entry is None or entry[0] != version or entry[1] != signature:
+                stale.append((oligo, version, signature))
+            selected.append(oligo)
+        region_table = None
+        if method in REGION_METHODS and len(stale) > self.region_table_fraction * len(selected):
+            region_table = get_part_hyb_regions(self.part)
+        for oligo, version, signature in stale:
+            cache[oligo] = (version, signature, self._calculate(oligo, method, kwargs, region_table))
+        hyb_patterns = {oligo.locString(): cache[oligo][2] for oligo in selected}
+        if len(cache) > len(hyb_patterns):
+            # Some cached oligos were not visited; they may have been removed from the part:
+            self._prune(oligos)
+        return hyb_patterns
+
+    def _prune(self, oligos):
+        """ Forget everything about oligos that are no longer in the part. """
+        removed = [oligo for oligo in self._connected if oligo not in oligos]
+        for oligo in removed:
+            self._connected.discard(oligo)
+            self._oligo_version.pop(oligo, None)
+            for cache in self._patterns.values():
+                cache.pop(oligo, None)
+        for vh_oligos in self._vh_oligos.values():
+            vh_oligos.difference_update(removed)
+
+
+# Attribute holding a part's HybPatternIndex. The index refers to the part and its oligos, so it is kept on the
+# part itself (rather than in a weak-keyed dict, whose values would keep the keys alive), and freed with the part.
+HYB_PATTERN_INDEX_ATTR = '_staplestatter_hyb_pattern_index'
+
+
+def get_hyb_pattern_index(part, create=True):
+    """
+    Return the HybPatternIndex for part, creating it (and connecting to the part's signals)
+    if this is the first time it is requested (returns None instead if create is False).
+    """
+    index = getattr(part, HYB_PATTERN_INDEX_ATTR, None)
+    if index is None and create:
+        index = HybPatternIndex(part)
+        setattr(part, HYB_PATTERN_INDEX_ATTR, index)
+    return index
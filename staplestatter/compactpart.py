@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module with a compact, array-backed representation of a cadnano part, for headless scoring.
+
+A cadnano part has a QObject-based object for every virtual helix, strandset, strand and oligo,
+and every scoring step is a Python method call on one of these (strand.idxs(), strand.getComplementStrands(),
+oligo.strand5p().generator3pStrand(), ...). When holding many large designs in one process,
+both memory and traversal time add up.
+
+CompactPart stores the design as a structure of arrays:
+    Strand table (array.array columns, indexed by strand id):
+        st_vh, st_scaf, st_low, st_high, st_5to3, st_prev5p, st_next3p, st_oligo
+    Complement table (CSR): the complementary strands of strand sid are
+        compl_ids[compl_offsets[sid]:compl_offsets[sid+1]], ordered from low to high index.
+    Oligo records (CompactOligo, with __slots__): strand ids 5p to 3p, is_staple, color, circular, length.
+    Insertions and skips: {vh: {idx: length}}, with length -1 for skips.
+    Strand sequences: st_sequence list.
+
+The columns can be wrapped as numpy arrays without copying, e.g. np.frombuffer(part.st_low, dtype=np.int32).
+
+For compatibility with the existing scoring code, CompactPart provides strand and oligo objects
+with the parts of the cadnano API used by cadnanoreader, oligo_utils and rotation.
+Strand objects are created on demand (they are just (part, strand id)) and compare equal if they
+refer to the same strand, so they can be used as dict keys like cadnano strands.
+So e.g. cadnanoreader.get_oligo_hyb_pattern(part) works directly on a CompactPart.
+
+Create a CompactPart from a cadnano v2 json file with cadnanojson.load_cadnano_json(filename),
+or from a cadnano part with CompactPart.from_cadnano_part(part).
+
+"""
+
+from __future__ import absolute_import, print_function
+from array import array
+import logging
+logger = logging.getLogger(__name__)
+
+from .cadnanolib.util import rcomp, overlap, sweep_overlaps
+
+DEFAULT_SCAF_COLOR = "#0066cc"
+DEFAULT_STAP_COLOR = "#888888"
+
+
+class CompactVirtualHelix(object):
+    """ Minimal cadnano VirtualHelix: number(), coord(), isEvenParity(). """
+    __slots__ = ('_number', '_coord', '_even')
+
+    def __init__(self, number, coord=(None, None)):
+        self._number = number
+        self._coord = coord
+        if coord[0] is None:
+            self._even = number % 2 == 0
+        else:
+            self._even = coord[0] % 2 == coord[1] % 2
+
+    def number(self):
+        return self._number
+
+    def coord(self):
+        return self._coord
+
+    def isEvenParity(self):
+        return self._even
+
+    def __repr__(self):
+        return "CompactVirtualHelix(%s)" % self._number
+
+
+class CompactInsertion(object):
+    """ Minimal cadnano Insertion: idx() and length() (-1 for skips). """
+    __slots__ = ('_idx', '_length')
+
+    def __init__(self, idx, length):
+        self._idx = idx
+        self._length = length
+
+    def idx(self):
+        return self._idx
+
+    def length(self):
+        return self._length
+
+
+class CompactStrandSet(object):
+    """ Minimal cadnano StrandSet for a single virtual helix (scaffold or staple). """
+    __slots__ = ('part', 'vh', 'is_scaf')
+
+    def __init__(self, part, vh, is_scaf):
+        self.part = part
+        self.vh = vh
+        self.is_scaf = is_scaf
+
+    def isScaffold(self):
+        return self.is_scaf
+
+    def isStaple(self):
+        return not self.is_scaf
+
+    def virtualHelix(self):
+        return self.part.virtual_helices[self.vh]
+
+    def complementStrandSet(self):
+        return CompactStrandSet(self.part, self.vh, not self.is_scaf)
+
+    def _findOverlappingRanges(self, strand):
+        """ Return strands in this strandset overlapping strand, from low to high index. """
+        part = self.part
+        low, high = strand.idxs()
+        return [CompactStrand(part, sid) for sid in part.vh_strands.get((self.vh, self.is_scaf), ())
+                if part.st_low[sid] <= high and part.st_high[sid] >= low]
+
+
+class CompactStrand(object):
+    """
+    Strand object with the parts of the cadnano Strand API used for scoring.
+    All data is kept in the part's arrays; the strand is just (part, strand id).
+    """
+    __slots__ = ('part', 'id')
+
+    def __init__(self, part, sid):
+        self.part = part
+        self.id = sid
+
+    def __eq__(self, other):
+        return isinstance(other, CompactStrand) and other.id == self.id and other.part is self.part
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.part), self.id))
+
+    def __repr__(self):
+        part, sid = self.part, self.id
+        return "CompactStrand(%s %s[%s:%s])" % ("scaf" if part.st_scaf[sid] else "stap", part.st_vh[sid],
+                                                part.st_low[sid], part.st_high[sid])
+
+    def idxs(self):
+        return self.part.st_low[self.id], self.part.st_high[self.id]
+
+    def lowIdx(self):
+        return self.part.st_low[self.id]
+
+    def highIdx(self):
+        return self.part.st_high[self.id]
+
+    def idx5Prime(self):
+        part, sid = self.part, self.id
+        return part.st_low[sid] if part.st_5to3[sid] else part.st_high[sid]
+
+    def idx3Prime(self):
+        part, sid = self.part, self.id
+        return part.st_high[sid] if part.st_5to3[sid] else part.st_low[sid]
+
+    def isDrawn5to3(self):
+        return bool(self.part.st_5to3[self.id])
+
+    def isScaffold(self):
+        return bool(self.part.st_scaf[self.id])
+
+    def isStaple(self):
+        return not self.part.st_scaf[self.id]
+
+    def length(self):
+        return self.part.st_high[self.id] - self.part.st_low[self.id] + 1
+
+    def totalLength(self):
+        return self.part.total_length(self.id)
+
+    def insertionsOnStrand(self):
+        return [CompactInsertion(idx, length) for idx, length in sorted(self.part.insertions(self.id).items())]
+
+    def sequence(self):
+        return self.part.st_sequence[self.id] or ""
+
+    def oligo(self):
+        return self.part.oligo_records[self.part.st_oligo[self.id]]
+
+    def strandSet(self):
+        return CompactStrandSet(self.part, self.part.st_vh[self.id], bool(self.part.st_scaf[self.id]))
+
+    def virtualHelix(self):
+        return self.part.virtual_helices[self.part.st_vh[self.id]]
+
+    def connection3p(self):
+        sid = self.part.st_next3p[self.id]
+        return None if sid < 0 else CompactStrand(self.part, sid)
+
+    def connection5p(self):
+        sid = self.part.st_prev5p[self.id]
+        return None if sid < 0 else CompactStrand(self.part, sid)
+
+    def generator3pStrand(self):
+        """ Iterate over this and all 3p-connected strands (stops after one round for circular oligos). """
+        part = self.part
+        next3p = part.st_next3p
+        sid = self.id
+        while True:
+            yield CompactStrand(part, sid)
+            sid = next3p[sid]
+            if sid < 0 or sid == self.id:
+                return
+
+    def getComplementStrands(self):
+        part = self.part
+        return [CompactStrand(part, cid) for cid in part.complement_ids(self.id)]
+
+
+class CompactOligo(object):
+    """ Oligo record, with the parts of the cadnano Oligo API used for scoring. """
+    __slots__ = ('part', 'id', 'strand_ids', 'is_staple', '_color', 'circular', '_length', '__weakref__')
+    accepts_sequence_views = True   # applySequence only slices the sequence, see oligo_utils.apply_oligo_sequence
+
+    def __init__(self, part, oid, strand_ids, is_staple, color, circular, length):
+        self.part = part
+        self.id = oid
+        self.strand_ids = strand_ids    # strand ids, 5p to 3p
+        self.is_staple = is_staple
+        self._color = color
+        self.circular = circular
+        self._length = length
+
+    def __repr__(self):
+        return "CompactOligo(%s)" % self.locString()
+
+    def strand5p(self):
+        return CompactStrand(self.part, self.strand_ids[0])
+
+    def strands(self):
+        """ Return list of strands, 5p to 3p. """
+        part = self.part
+        return [CompactStrand(part, sid) for sid in self.strand_ids]
+
+    def isStaple(self):
+        return self.is_staple
+
+    def isCircular(self):
+        return self.circular
+
+    def length(self):
+        return self._length
+
+    def color(self):
+        return self._color
+
+    def locString(self):
+        part, sid = self.part, self.strand_ids[0]
+        return "%s[%s]" % (part.st_vh[sid], part.st_low[sid] if part.st_5to3[sid] else part.st_high[sid])
+
+    def sequence(self):
+        seqs = self.part.st_sequence
+        if not any(seqs[sid] for sid in self.strand_ids):
+            return None
+        return "".join(seqs[sid] or " "*self.part.total_length(sid) for sid in self.strand_ids)
+
+    def applySequence(self, sequence, use_undostack=True):  # pylint: disable=W0613
+        """ Apply sequence to this oligo and the complementary strands (None clears the sequence). """
+        self.part.apply_sequence(self.id, sequence)
+
+
+class CompactPart(object):
+    """
+    Array-backed cadnano part, see module docstring.
+    Strands are added with add_strand() and connected with link_strands(), then finalize()
+    builds the oligo records and complement table.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.virtual_helices = {}       # vh number -> CompactVirtualHelix
+        self.vh_insertions = {}         # vh number -> {idx: insertion length (-1 for skips)}
+        # Strand table:
+        self.st_vh, self.st_low, self.st_high = array('i'), array('i'), array('i')
+        self.st_scaf, self.st_5to3 = array('b'), array('b')
+        self.st_prev5p, self.st_next3p, self.st_oligo = array('i'), array('i'), array('i')
+        self.st_sequence = []
+        # Complement table (CSR):
+        self.compl_ids, self.compl_offsets = array('i'), array('i', [0])
+        # Strand ids for each (vh, is_scaf) strandset, ordered by low index:
+        self.vh_strands = {}
+        self.oligo_records = []
+
+    def __repr__(self):
+        return "%s(%s: %s strands, %s oligos)" % (type(self).__name__, self.name, len(self.st_vh),
+                                                 len(self.oligo_records))
+
+    ## Building: ##
+
+    def add_virtual_helix(self, number, coord=(None, None), insertions=None):
+        """ Add virtual helix with the given number and (row, col) coord, and {idx: length} insertions. """
+        vh = self.virtual_helices[number] = CompactVirtualHelix(number, coord)
+        self.vh_insertions[number] = insertions or {}
+        return vh
+
+    def add_strand(self, vh, is_scaf, low, high, drawn5to3, sequence=None):
+        """ Add strand and return the strand id. """
+        sid = len(self.st_vh)
+        self.st_vh.append(vh)
+        self.st_scaf.append(is_scaf)
+        self.st_low.append(low)
+        self.st_high.append(high)
+        self.st_5to3.append(drawn5to3)
+        self.st_prev5p.append(-1)
+        self.st_next3p.append(-1)
+        self.st_oligo.append(-1)
+        self.st_sequence.append(sequence)
+        return sid
+
+    def link_strands(self, sid, next_sid):
+        """ Connect the 3p end of strand sid to the 5p end of strand next_sid. """
+        self.st_next3p[sid] = next_sid
+        self.st_prev5p[next_sid] = sid
+
+    def finalize(self, colors=None):
+        """
+        Build oligo records, strandset and complement tables after all strands have been added and linked.
+        colors is a dict {(vh, idx5p): color} for the oligos with the given 5p end.
+        """
+        if colors is None:
+            colors = {}
+        n_strands = len(self.st_vh)
+        st_vh, st_low, st_high, st_5to3 = self.st_vh, self.st_low, self.st_high, self.st_5to3
+        self.vh_strands = vh_strands = {}
+        for sid in range(n_strands):
+            vh_strands.setdefault((st_vh[sid], bool(self.st_scaf[sid])), []).append(sid)
+        for key, sids in vh_strands.items():
+            sids.sort(key=st_low.__getitem__)
+            vh_strands[key] = array('i', sids)
+        # Oligos: Linear oligos start at strands without 5p connection, the rest are circular:
+        self.oligo_records = []
+        st_oligo, next3p = self.st_oligo, self.st_next3p
+        starts = [(sid, False) for sid in range(n_strands) if self.st_prev5p[sid] < 0]
+        starts += [(sid, True) for sid in range(n_strands)]
+        for sid5p, circular in starts:
+            if st_oligo[sid5p] >= 0:
+                continue
+            oid = len(self.oligo_records)
+            strand_ids = array('i')
+            sid = sid5p
+            while sid >= 0 and st_oligo[sid] < 0:
+                st_oligo[sid] = oid
+                strand_ids.append(sid)
+                sid = next3p[sid]
+            is_staple = not self.st_scaf[sid5p]
+            idx5p = st_low[sid5p] if st_5to3[sid5p] else st_high[sid5p]
+            color = colors.get((st_vh[sid5p], idx5p), DEFAULT_STAP_COLOR if is_staple else DEFAULT_SCAF_COLOR)
+            length = sum(self.total_length(sid) for sid in strand_ids)
+            self.oligo_records.append(CompactOligo(self, oid, strand_ids, is_staple, color, circular, length))
+        self._find_complements()
+
+    def _find_complements(self):
+        """
+        Populate the complement table: overlapping strands in the opposite strandset, low to high.
+        The scaffold and staple strandsets of each virtual helix are merged in a single sweep.
+        """
+        st_low, st_high = self.st_low, self.st_high
+        complements = [[] for _ in range(len(self.st_vh))]
+        for (vh, is_scaf), scaf_ids in self.vh_strands.items():
+            if not is_scaf:
+                continue
+            stap_ids = self.vh_strands.get((vh, False), ())
+            for i, j, _, _ in sweep_overlaps([(st_low[sid], st_high[sid]) for sid in scaf_ids],
+                                             [(st_low[sid], st_high[sid]) for sid in stap_ids]):
+                complements[scaf_ids[i]].append(stap_ids[j])
+                complements[stap_ids[j]].append(scaf_ids[i])
+        self.compl_ids, self.compl_offsets = compl_ids, compl_offsets = array('i'), array('i', [0])
+        for cids in complements:
+            compl_ids.extend(cids)
+            compl_offsets.append(len(compl_ids))
+
+    @classmethod
+    def from_cadnano_part(cls, cadnano_part, name=None):
+        """ Create a CompactPart (including any applied sequences) from a cadnano part. """
+        from .cadnanoreader import getstrandinsertionlengths
+        part = cls(name=name)
+        sids, colors = {}, {}
+        for oligo in cadnano_part.oligos():
+            prev = None
+            for strand in oligo.strand5p().generator3pStrand():
+                vhelix = strand.virtualHelix()
+                num = vhelix.number()
+                if num not in part.virtual_helices:
+                    try:
+                        coord = tuple(vhelix.coord())
+                    except AttributeError:
+                        coord = (None, None)
+                    part.add_virtual_helix(num, coord)
+                part.vh_insertions[num].update(getstrandinsertionlengths(strand))
+                low, high = strand.idxs()
+                sid = sids[strand] = part.add_strand(num, strand.isScaffold(), low, high, strand.isDrawn5to3(),
+                                                     strand.sequence() or None)
+                if prev is not None:
+                    part.link_strands(prev, sid)
+                prev = sid
+            strand5p = oligo.strand5p()
+            colors[(strand5p.virtualHelix().number(), strand5p.idx5Prime())] = str(oligo.color())
+            try:
+                circular = oligo.isCircular()
+            except AttributeError:
+                circular = False
+            if circular:
+                part.link_strands(prev, sids[strand5p])
+        part.finalize(colors)
+        return part
+
+    ## Table queries: ##
+
+    def oligos(self):
+        """ Return list of all oligos (CompactOligo), same as cadnano's part.oligos(). """
+        return self.oligo_records
+
+    def strands(self):
+        """ Return list of all strands (CompactStrand). """
+        return [CompactStrand(self, sid) for sid in range(len(self.st_vh))]
+
+    def complement_ids(self, sid):
+        """ Return the ids of the strands complementary to strand sid, low to high. """
+        return self.compl_ids[self.compl_offsets[sid]:self.compl_offsets[sid+1]]
+
+    def insertions(self, sid):
+        """ Return {idx: length} for insertions (length > 0) and skips (length -1) on strand sid. """
+        low, high = self.st_low[sid], self.st_high[sid]
+        return {idx: length for idx, length in self.vh_insertions[self.st_vh[sid]].items() if low <= idx <= high}
+
+    def base_counts(self, sid):
+        """ Return list of (idx, number of bases) for strand sid, 5p to 3p. """
+        inserted = self.insertions(sid)
+        low, high = self.st_low[sid], self.st_high[sid]
+        idxs = range(low, high+1) if self.st_5to3[sid] else range(high, low-1, -1)
+        return [(idx, 1 + inserted.get(idx, 0)) for idx in idxs]
+
+    def total_length(self, sid):
+        """ Return strand length, including insertions and skips. """
+        return self.st_high[sid] - self.st_low[sid] + 1 + sum(self.insertions(sid).values())
+
+    ## Sequences: ##
+
+    def _idx_groups(self, sid):
+        """ Return {idx: bases} for strand sid; bases at indices without sequence are spaces. """
+        seq = self.st_sequence[sid] or ""
+        groups, pos = {}, 0
+        for idx, n in self.base_counts(sid):
+            groups[idx] = seq[pos:pos+n].ljust(n)
+            pos += n
+        return groups
+
+    def apply_sequence(self, oid, sequence):
+        """
+        Apply sequence to oligo oid (None clears the sequence), and set the complementary sequence on
+        the overlapping parts of complementary strands, same as cadnano's oligo.applySequence().
+        """
+        pos = 0
+        for sid in self.oligo_records[oid].strand_ids:
+            if sequence is None:
+                used = None
+            else:
+                # Slicing by position (instead of taking the remaining sequence[n:] for every strand)
+                # only copies the bases used, and also works for sequtils.CircularSequence views:
+                n = self.total_length(sid)
+                used = sequence[pos:pos+n]
+                pos += n
+            self.st_sequence[sid] = used
+            groups = self._idx_groups(sid)
+            for cid in self.complement_ids(sid):
+                low, high = overlap(self.st_low[sid], self.st_high[sid], self.st_low[cid], self.st_high[cid])
+                cgroups = self._idx_groups(cid)
+                for idx in range(low, high+1):
+                    # The complementary strand runs the opposite way, also through insertions:
+                    cgroups[idx] = " "*len(groups[idx]) if used is None else rcomp(groups[idx])
+                self.st_sequence[cid] = "".join(cgroups[idx] for idx, _ in self.base_counts(cid))
+
+    def _complement_without_insertions(self, cid, sids, assigned):
+        """
+        Return the sequence of strand cid with the overlaps with strands sids set to the complement of
+        their sequences in assigned. The virtual helix must have no insertions or skips, so there is
+        one base per index, and the sequences can be sliced instead of split into {idx: bases} groups.
+        """
+        low_c, high_c = self.st_low[cid], self.st_high[cid]
+        cseq = (self.st_sequence[cid] or "").ljust(high_c - low_c + 1)
+        for sid in sids:
+            low_s, high_s = self.st_low[sid], self.st_high[sid]
+            low, high = overlap(low_s, high_s, low_c, high_c)
+            n = high - low + 1
+            used = assigned[sid]
+            if used is None:
+                bases = " "*n
+            else:
+                start = low - low_s if self.st_5to3[sid] else high_s - high
+                bases = rcomp(used[start:start+n].ljust(n))
+            start = low - low_c if self.st_5to3[cid] else high_c - high
+            cseq = cseq[:start] + bases + cseq[start+n:]
+        return cseq
+
+    def apply_sequences(self, assignments):
+        """
+        Apply sequences to several oligos in one pass; assignments is a list of (oid, sequence).
+        Gives the same result as calling apply_sequence(oid, sequence) for each assignment,
+        but each complementary strand is re-built once, instead of once for every strand it overlaps.
+        Returns set with the ids of oligos whose sequence was changed, including complementary oligos.
+        """
+        assigned = {}   # sid -> used sequence
+        for oid, sequence in assignments:
+            pos = 0
+            for sid in self.oligo_records[oid].strand_ids:
+                if sequence is None:
+                    assigned[sid] = None
+                else:
+                    n = self.total_length(sid)
+                    assigned[sid] = sequence[pos:pos+n]
+                    pos += n
+        complements = {}    # cid -> [sid, ...]
+        for sid in assigned:
+            for cid in self.complement_ids(sid):
+                complements.setdefault(cid, []).append(sid)
+        if any(cid in assigned for cid in complements):
+            # Some of the oligos are complementary to each other, so the order of application matters:
+            for oid, sequence in assignments:
+                self.apply_sequence(oid, sequence)
+        else:
+            for sid, used in assigned.items():
+                self.st_sequence[sid] = used
+            for cid, sids in complements.items():
+                if self.vh_insertions.get(self.st_vh[cid]):
+                    # Same as apply_sequence, one base index at a time:
+                    cgroups = self._idx_groups(cid)
+                    for sid in sids:
+                        groups = self._idx_groups(sid)
+                        low, high = overlap(self.st_low[sid], self.st_high[sid], self.st_low[cid], self.st_high[cid])
+                        for idx in range(low, high+1):
+                            cgroups[idx] = " "*len(groups[idx]) if assigned[sid] is None else rcomp(groups[idx])
+                    self.st_sequence[cid] = "".join(cgroups[idx] for idx, _ in self.base_counts(cid))
+                else:
+                    self.st_sequence[cid] = self._complement_without_insertions(cid, sids, assigned)
+        st_oligo = self.st_oligo
+        return {oid for oid, _ in assignments} | {st_oligo[cid] for cid in complements}
@@ -22,30 +22,42 @@
 
 This module is used to load cadnano json files using cadnano2.5 library.
 
-You have to make sure that cadnano is importable before loading/importing/running this.
+You have to make sure that cadnano is importable before calling load_doc_from_file
+(cadnano is not imported until then). If cadnano cannot be imported, e.g. on a headless server,
+json designs are instead read with cadnanojson, and load_doc_from_file returns the cadnanojson.JsonPart
+(cadnanoreader.get_part returns such parts as-is).
 
 """
 
 from __future__ import absolute_import, print_function
 import os
 import json
-import yaml
 
-# This module is currently only for cadnano2.5 - I need to update this for cadnano2:
-from cadnano.document import Document
-from cadnano.fileio.nnodecode import decodeFile, decode
+from . import timing
 
 
+@timing.traced("load")
 def load_doc_from_file(filename, doc=None):
     """
     Load cadnano json file by filename and return a cadnano Document.
     Usually the doc is not of much use; rather, use the part object:
         part = doc.children()[0]   # or doc.parts() if using an earlier cadnano2.5 commit
+    If cadnano cannot be imported (and no doc is given), a cadnanojson.JsonPart is returned instead.
     """
-    if doc is None:
-        doc = Document()
     with open(filename) as fp:
         nno_dict = json.load(fp)
+    # cadnano is imported here rather than at module level, since importing cadnano (and Qt) is slow.
+    # This function is currently only for cadnano2.5 - I need to update this for cadnano2:
+    try:
+        from cadnano.document import Document
+        from cadnano.fileio.nnodecode import decode
+    except ImportError:
+        if doc is not None:
+            raise
+        from .cadnanojson import JsonPart
+        return JsonPart(nno_dict)
+    if doc is None:
+        doc = Document()
     decode(doc, nno_dict)
     return doc
 
@@ -58,7 +70,11 @@ def load_json_or_yaml(filepath, ext=None):
         except IndexError:
             ext = "yaml"
     with open(filepath) as fd:
-        data = json.load(fd) if "json" in ext else yaml.load(fd)
+        if "json" in ext:
+            data = json.load(fd)
+        else:
+            import yaml
+            data = yaml.safe_load(fd)
     return data
 
 
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for calculating nearest-neighbour melting temperatures of perfectly hybridized segments.
+
+This is a local re-implementation of the default code path of Bio.SeqUtils.MeltingTemp.Tm_NN,
+i.e. perfect-match duplexes using the DNA_NN3 table (Allawi & SantaLucia, 1997)
+and salt correction methods 0-6. The results are identical to those of Tm_NN.
+
+Tm_NN re-parses its arguments and looks up every nearest-neighbour pair in the tables
+for every call. A TmEngine instead looks up the tables and salt correction once per
+set of conditions (Na, K, Tris, Mg, dNTPs, dnac1, dnac2, ...), and memoizes the Tm
+of each segment sequence in a bounded LRU cache. A typical origami has a few thousand
+hybridized segments, but most scoring/rotation runs see the same segments over and over.
+
+Usage:
+    tm_engine = get_tm_engine(Mg=10)
+    tms = [tm_engine.tm(seq) for seq in hyb_seqs]
+or, as a drop-in replacement for Bio.SeqUtils.MeltingTemp.Tm_NN:
+    Tm_NN(seq, Mg=10)
+
+Conditions (or Tm_NN arguments) that are not supported by TmEngine, e.g. custom tables or
+saltcorr=7, are passed to Bio.SeqUtils.MeltingTemp.Tm_NN (results are still memoized).
+
+"""
+
+from __future__ import absolute_import, print_function, division
+import math
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Allawi and SantaLucia (1997), Biochemistry 36: 10581-10594.
+# Same values as Bio.SeqUtils.MeltingTemp.DNA_NN3; (delta_h, delta_s) in kcal/mol and cal/(K mol).
+DNA_NN3 = {
+    "init": (0, 0), "init_A/T": (2.3, 4.1), "init_G/C": (0.1, -2.8),
+    "init_oneG/C": (0, 0), "init_allA/T": (0, 0), "init_5T/A": (0, 0),
+    "sym": (0, -1.4),
+    "AA/TT": (-7.9, -22.2), "AT/TA": (-7.2, -20.4), "TA/AT": (-7.2, -21.3),
+    "CA/GT": (-8.5, -22.7), "GT/CA": (-8.4, -22.4), "CT/GA": (-7.8, -21.0),
+    "GA/CT": (-8.2, -22.2), "CG/GC": (-10.6, -27.2), "GC/CG": (-9.8, -24.4),
+    "GG/CC": (-8.0, -19.9)}
+
+R = 1.987  # universal gas constant in Cal/degrees C*Mol
+
+# Conditions supported by TmEngine (with Tm_NN's default values):
+DEFAULT_CONDITIONS = dict(Na=50, K=0, Tris=0, Mg=0, dNTPs=0, dnac1=25, dnac2=25, selfcomp=False, saltcorr=5)
+
+_COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+
+def clean_seq(seq):
+    """
+    Return seq in upper case with everything except A, C, G, T and I removed and U replaced by T,
+    same as Bio.SeqUtils.MeltingTemp._check(seq, "Tm_NN").
+        >>> clean_seq("acgu tt?")
+        'ACGTTT'
+    """
+    seq = seq.upper()
+    if not seq.strip("ACGT"):   # Only A, C, G and T (works for both python 2 and 3 strings).
+        return seq
+    return "".join(base for base in seq.replace("U", "T") if base in "ACGTI")
+
+
+def nn_pair_table(nn_table=None):
+    """
+    Return a dict with (delta_h, delta_s) for each of the 16 dinucleotides,
+    e.g. "AC" -> nn_table["AC/TG"], or nn_table["GT/CA"] if "AC/TG" is not in nn_table.
+    """
+    if nn_table is None:
+        nn_table = DNA_NN3
+    pairs = {}
+    for b1 in "ACGT":
+        for b2 in "ACGT":
+            neighbors = b1 + b2 + "/" + _COMPLEMENT[b1] + _COMPLEMENT[b2]
+            pairs[b1+b2] = nn_table[neighbors] if neighbors in nn_table else nn_table[neighbors[::-1]]
+    return pairs
+
+
+class TmEngine(object):
+    """
+    Calculates (and memoizes) nearest-neighbour melting temperatures under a single set of conditions.
+    The arguments are the same as for Bio.SeqUtils.MeltingTemp.Tm_NN, plus cachesize, which is the
+    max number of sequences to keep in the LRU cache.
+        >>> round(TmEngine().tm("ACGTTGCAAGTCCATGGTAC"), 2)
+        52.74
+        >>> round(TmEngine(Mg=10).tm("ACGTTGCAAGTCCATGGTAC"), 2)
+        63.29
+    """
+
+    def __init__(self, cachesize=100000, **conditions):
+        self.cachesize = cachesize
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+        unsupported = {k: v for k, v in conditions.items() if k not in DEFAULT_CONDITIONS}
+        cond = dict(DEFAULT_CONDITIONS, **{k: v for k, v in conditions.items() if k in DEFAULT_CONDITIONS})
+        if cond['saltcorr'] not in range(0, 7):
+            unsupported['saltcorr'] = cond['saltcorr']
+        if unsupported:
+            # Let Bio.SeqUtils.MeltingTemp.Tm_NN deal with all of it:
+            logger.debug("TmEngine: conditions %s not supported natively, using Bio Tm_NN.", unsupported)
+            self._bio_kwargs = conditions
+            return
+        self._bio_kwargs = None
+        self.conditions = cond
+        self._pairs = nn_pair_table()
+        nn_table = DNA_NN3
+        self._init = nn_table["init"]
+        self._init_allAT = nn_table["init_allA/T"]
+        self._init_oneGC = nn_table["init_oneG/C"]
+        self._init_5TA = nn_table["init_5T/A"]
+        self._init_AT = nn_table["init_A/T"]
+        self._init_GC = nn_table["init_G/C"]
+        self._sym = nn_table["sym"] if cond['selfcomp'] else None
+        dnac1, dnac2 = cond['dnac1'], cond['dnac2']
+        k = dnac1 * 1e-9 if cond['selfcomp'] else (dnac1 - (dnac2 / 2.0)) * 1e-9
+        self._RlogK = R * (math.log(k))
+        # Salt correction; the same calculations as Bio.SeqUtils.MeltingTemp.salt_correction:
+        self.saltcorr = method = cond['saltcorr']
+        Na, K, Tris, Mg, dNTPs = (cond[key] for key in ('Na', 'K', 'Tris', 'Mg', 'dNTPs'))
+        Mon = Na + K + Tris / 2.0  # millimolar
+        if sum((K, Mg, Tris, dNTPs)) > 0 and dNTPs < Mg:
+            Mon += 120 * math.sqrt(Mg - dNTPs)
+        mon = Mon * 1e-3
+        if method and not mon:
+            raise ValueError("Total ion concentration of zero is not allowed in this method.")
+        self._logmon = math.log(mon) if mon else None
+        self._corr = {1: lambda: 16.6 * math.log10(mon),
+                      2: lambda: 16.6 * math.log10((mon) / (1.0 + 0.7 * (mon))),
+                      3: lambda: 12.5 * math.log10(mon),
+                      4: lambda: 11.7 * math.log10(mon)}.get(method, lambda: 0)()
+
+    def tm(self, seq):
+        """ Return melting temperature of seq hybridized to its perfect complement. """
+        cache = self._cache
+        try:
+            melting_temp = cache.pop(seq)
+            self.hits += 1
+        except KeyError:
+            melting_temp = self.calculate_tm(seq)
+            self.misses += 1
+            if len(cache) >= self.cachesize:
+                cache.popitem(last=False)  # Remove least recently used
+        cache[seq] = melting_temp
+        return melting_temp
+
+    def calculate_tm(self, seq):
+        """ Calculate melting temperature of seq without using the cache. """
+        if self._bio_kwargs is not None:
+            from Bio.SeqUtils.MeltingTemp import Tm_NN
+            return Tm_NN(seq, **self._bio_kwargs)
+        seq = clean_seq(seq)
+        if not seq:
+            raise ValueError("Cannot calculate melting temperature of a sequence without any bases.")
+        if "I" in seq:
+            from Bio.SeqUtils.MeltingTemp import Tm_NN
+            return Tm_NN(seq, **self.conditions)
+        # Same order of summation as Tm_NN, so the results are identical:
+        delta_h = 0
+        delta_s = 0
+        delta_h += self._init[0]
+        delta_s += self._init[1]
+        if "G" in seq or "C" in seq:
+            delta_h += self._init_oneGC[0]
+            delta_s += self._init_oneGC[1]
+        else:
+            delta_h += self._init_allAT[0]
+            delta_s += self._init_allAT[1]
+        if seq[0] == "T":
+            delta_h += self._init_5TA[0]
+            delta_s += self._init_5TA[1]
+        if seq[-1] == "A":
+            delta_h += self._init_5TA[0]
+            delta_s += self._init_5TA[1]
+        ends = seq[0] + seq[-1]
+        AT = ends.count("A") + ends.count("T")
+        GC = 2 - AT
+        delta_h += self._init_AT[0] * AT
+        delta_s += self._init_AT[1] * AT
+        delta_h += self._init_GC[0] * GC
+        delta_s += self._init_GC[1] * GC
+        pairs = self._pairs
+        for i in range(len(seq) - 1):
+            d_h, d_s = pairs[seq[i:i+2]]
+            delta_h += d_h
+            delta_s += d_s
+        if self._sym is not None:
+            delta_h += self._sym[0]
+            delta_s += self._sym[1]
+        return self.tm_from_sums(delta_h, delta_s, len(seq), seq.count("G") + seq.count("C"))
+
+    def end_terms(self, starts_T, ends_A, n_AT_ends, has_GC):
+        """
+        Return the initiation terms (delta_h, delta_s) for segment(s) with the given end bases,
+        number of A/T bases at the two ends (0-2), and whether the segment has any G/C.
+        Works on scalars as well as (numpy) arrays, e.g. for scoring many segments at once.
+        """
+        delta_h = (self._init[0] + self._init_oneGC[0] * has_GC + self._init_allAT[0] * (1 - has_GC)
+                   + self._init_5TA[0] * (starts_T + ends_A)
+                   + self._init_AT[0] * n_AT_ends + self._init_GC[0] * (2 - n_AT_ends))
+        delta_s = (self._init[1] + self._init_oneGC[1] * has_GC + self._init_allAT[1] * (1 - has_GC)
+                   + self._init_5TA[1] * (starts_T + ends_A)
+                   + self._init_AT[1] * n_AT_ends + self._init_GC[1] * (2 - n_AT_ends))
+        if self._sym is not None:
+            delta_h += self._sym[0]
+            delta_s += self._sym[1]
+        return delta_h, delta_s
+
+    def tm_from_sums(self, delta_h, delta_s, length, n_GC):
+        """
+        Return melting temperature from the summed (delta_h, delta_s) of a segment,
+        applying the salt correction. Works on scalars as well as (numpy) arrays.
+        """
+        method = self.saltcorr
+        if method == 5:
+            delta_s = delta_s + 0.368 * (length - 1) * self._logmon
+        melting_temp = (1000 * delta_h) / (delta_s + self._RlogK) - 273.15
+        if method in (1, 2, 3, 4):
+            melting_temp += self._corr
+        elif method == 6:
+            gc = n_GC / length
+            corr = ((4.29 * gc - 3.95) * 1e-5 * self._logmon) + 9.40e-6 * self._logmon ** 2
+            melting_temp = 1 / (1 / (melting_temp + 273.15) + corr) - 273.15
+        return melting_temp
+
+    @property
+    def bio_kwargs(self):
+        """ Conditions passed on to Bio Tm_NN, or None if TmEngine calculates Tm natively. """
+        return self._bio_kwargs
+
+    def nn_table_pairs(self):
+        """ Return dict with (dH, dS) for every nearest-neighbour pair, e.g. "AC", in the engine's table. """
+        return self._pairs
+
+    def clear_cache(self):
+        """ Clear the memoized melting temperatures. """
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+
+_tm_engines = {}
+
+
+def get_tm_engine(**conditions):
+    """
+    Return a (shared) TmEngine for the given conditions, e.g. get_tm_engine(Mg=10).
+    Engines are kept per set of conditions, so the memoized melting temperatures are re-used
+    across calls.
+    """
+    try:
+        key = tuple(sorted(conditions.items()))
+        return _tm_engines[key]
+    except KeyError:
+        engine = _tm_engines[key] = TmEngine(**conditions)
+        return engine
+    except TypeError:
+        # Unhashable conditions, e.g. a custom nn_table dict:
+        return TmEngine(**conditions)
+
+
+def Tm_NN(seq, **conditions):
+    """ Drop-in replacement for Bio.SeqUtils.MeltingTemp.Tm_NN, using a shared, memoizing TmEngine. """
+    return get_tm_engine(**conditions).tm(seq)
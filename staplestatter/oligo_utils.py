@@ -61,12 +61,36 @@ crit_match  - match a single oligo against a single criteria in a criteria set.
 match_oligo - match a single oligo against a criteria set.
 get_matching_oligos - get all matching oligos in part.
 
+get_matching_oligos does not call crit_match for every oligo: The criteria are compiled once
+with compile_criteria into a matcher, which looks up the matching oligos in an OligoAttributeTable,
+a table with a column of attribute values (st_type, length, color, 5p/3p vh number and idx, ...)
+for all oligos in the part. Each column is read from the oligos once, when first needed.
+The table is also an index:
+  - Exact criteria, e.g. {5pvhnumber: 12, idx5Prime: 48, st_type: stap}, are looked up together in a hash
+    index keyed by the tuple of values, e.g. (12, 48, True), made the first time the keys are used together.
+  - Sets of values, e.g. {color: ["#ff0000", "#00ff00", "#0000ff"]}, are looked up in the single-key hash index.
+  - Ranges, e.g. {length: [40, 60]}, are found by bisection in a sorted index (for numeric columns, using numpy).
+    Note that a list with two values is always a (min, max) range, same as in crit_match, so a set of
+    values must have at least three values (repeat a value to match only two, e.g. [a, b, b]).
+Criteria that cannot be looked up in the index only test the oligos found by the other criteria.
+    table = OligoAttributeTable(part)
+    matcher = compile_criteria({"st_type": "stap", "length": [40, 60]})
+    oligos = table.select(matcher)
+
+The attributes used for matching are not changed by applying sequences, so a table can be re-used
+for all seq_specs in apply_seqspecs, and for every offset when applying rotated sequences,
+but must be re-created if the design is edited.
+
 """
 
 from __future__ import absolute_import, print_function
 import os
 import json
-import yaml
+
+from .sequtils import CircularSequence, rotate_sequence
+
+# numpy, imported by _numpy() on first use; None if not available (criteria are then matched using lists).
+np = False
 
 
 VERBOSE = 0
@@ -82,7 +106,11 @@ def load_criteria_list(filepath):
     except IndexError:
         ext = "yaml"
     with open(filepath) as fd:
-        criteria_list = json.load(fd) if "json" in ext else yaml.load(fd)
+        if "json" in ext:
+            criteria_list = json.load(fd)
+        else:
+            import yaml
+            criteria_list = yaml.safe_load(fd)
     return criteria_list
 
 
@@ -255,11 +283,12 @@ def oligo_match_criteriaset_list(oligo, criteriaset_list):
     return any(oligo_match_criteriaset(oligo, criteriaset) for criteriaset in criteriaset_list)
 
 
-def get_matching_oligos(part, criteria):
+def get_matching_oligos(part, criteria, table=None):
     """
     Lifted from cadnano_apply_seq in RsUtils repo.
     Get all oligos on part matching the given set of criteria,
     or, if criteria is a list, any oligo that matches either of the criteria sets in the list.
+    If table (OligoAttributeTable for part) is given, it is used for matching, otherwise a new table is made.
 
     Criteria is usually a set of criteria (a dict, actually) of
         criterium-key: criterium-value(s) or range, e.g.
@@ -273,12 +302,241 @@ def get_matching_oligos(part, criteria):
     # We'd usually expect only one oligo to match the set of criteria,
     # and we'd probably want to verify that exactly one oligo is matching,
     # so generate a list, not a generator.
+    # If we have a criteria_list, the result is the union of oligos matching any criteria (dict) in the list.
+    if table is None:
+        table = OligoAttributeTable(part)
+    return table.select(compile_criteria(criteria))
+
+
+def _numpy():
+    """ Return the numpy module, or None if numpy is not available. """
+    global np
+    if np is False:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
+
+
+def oligo_strand3p(oligo):
+    """ Return the 3p strand of oligo. """
+    for strand in oligo.strand5p().generator3pStrand():
+        pass
+    return strand
+
+
+def resolve_criteria_key(key):
+    """
+    Return (path, method) for criteria key, the same way as crit_match, e.g.
+        "length" -> ((), "length")                                  # oligo.length()
+        "5pvhnumber" -> (("strand5p", "virtualHelix"), "number")    # oligo.strand5p().virtualHelix().number()
+    The "st_type" key gives ((), "isStaple").
+    Unlike crit_match, keys can also start with "3p", e.g. "3pidx3Prime" or "3pvhnumber",
+    to match the oligo's 3p strand (oligo_strand3p), and "idx3Prime" is short for "3pidx3Prime".
+    """
+    if key == "st_type":
+        return (), "isStaple"
+    if key == "idx5Prime":
+        return ("strand5p", ), key
+    if key == "idx3Prime":
+        return ("strand3p", ), key
+    if key == "vhnumber":
+        return ("strand5p", "virtualHelix"), "number"
+    path = []
+    if key[:2] in ("5p", "3p"):
+        path.append("strand" + key[:2])
+        key = key[2:]
+    if key[:2] == "vh":
+        path.append("virtualHelix")
+        key = key[2:]
+    return tuple(path), key
+
+
+# Oligo, strand and virtual helix attributes (methods) that criteria keys can refer to, by path:
+_STRAND_ATTRIBUTES = ("idx5Prime", "idx3Prime", "lowIdx", "highIdx", "length", "totalLength", "isDrawn5to3")
+CRITERIA_ATTRIBUTES = {
+    (): ("isStaple", "length", "color", "isCircular", "locString"),
+    ("strand5p", ): _STRAND_ATTRIBUTES,
+    ("strand3p", ): _STRAND_ATTRIBUTES,
+    ("strand5p", "virtualHelix"): ("number", "coord"),
+    ("strand3p", "virtualHelix"): ("number", "coord"),
+}
+
+
+def is_criteria_key(key):
+    """ Return True if key is a known criteria key, i.e. resolves to one of the CRITERIA_ATTRIBUTES. """
+    path, method = resolve_criteria_key(key)
+    return method in CRITERIA_ATTRIBUTES.get(path, ())
+
+
+class OligoAttributeTable(object):
+    """
+    Table and index of the criteria attribute values of all oligos in a part, see module docstring.
+    Oligos are referred to by row number, i.e. their index in table.oligos.
+    Columns and indices are made on first use.
+    """
+
+    def __init__(self, part=None, oligos=None):
+        self.oligos = list(part.oligos() if oligos is None else oligos)
+        self._objects = {(): self.oligos}   # path -> list of objects, e.g. ("strand5p", ) -> 5p strands
+        self._values = {}                   # (path, method) -> list of attribute values
+        self._columns = {}                  # (path, method) -> numpy array or list of attribute values
+        self._indices = {}                  # tuple of criteria keys -> {tuple of values: [rows]}
+        self._sorted = {}                   # (path, method) -> (rows sorted by value, sorted values)
+
+    def __len__(self):
+        return len(self.oligos)
+
+    def _path_objects(self, path):
+        """ Return list with oligo.<path[0]>().<path[1]>()... for all oligos. """
+        objects = self._objects.get(path)
+        if objects is None:
+            parents = self._path_objects(path[:-1])
+            if path[-1] == "strand3p":
+                objects = [oligo_strand3p(oligo) for oligo in parents]
+            else:
+                objects = [getattr(obj, path[-1])() for obj in parents]
+            self._objects[path] = objects
+        return objects
+
+    def values(self, key):
+        """
+        Return list with the attribute value for criteria key (see crit_match) for all oligos.
+        Raises KeyError if key is not recognized.
+        """
+        path_method = resolve_criteria_key(key)
+        values = self._values.get(path_method)
+        if values is None:
+            path, method = path_method
+            try:
+                values = [getattr(obj, method)() for obj in self._path_objects(path)]
+            except AttributeError as e:
+                raise KeyError('Criteria key "%s" not recognized (%s).' % (key, e))
+            self._values[path_method] = values
+        return values
+
+    def column(self, key):
+        """
+        Return attribute values for criteria key as a column: a numpy array for numeric, bool and str values
+        (if numpy is available), otherwise the list from values(key).
+        """
+        path_method = resolve_criteria_key(key)
+        column = self._columns.get(path_method)
+        if column is None:
+            column = values = self.values(key)
+            types = set(type(value) for value in values)
+            if _numpy() is not None and (types <= {int, float, bool} or types == {str}):
+                column = np.array(values)
+            self._columns[path_method] = column
+        return column
+
+    def index(self, keys):
+        """ Return hash index for keys (tuple of criteria keys), a dict of {tuple of values: list of rows}. """
+        index = self._indices.get(keys)
+        if index is None:
+            index = {}
+            for row, values in enumerate(zip(*[self.values(key) for key in keys])):
+                index.setdefault(values, []).append(row)
+            self._indices[keys] = index
+        return index
+
+    def rows_equal(self, keys, values):
+        """ Return list of rows where the attributes for keys (tuple) are equal to values (tuple). """
+        try:
+            return self.index(keys).get(values, [])
+        except TypeError:
+            # Unhashable attribute or criteria values:
+            columns = [self.values(key) for key in keys]
+            return [row for row in range(len(self)) if all(column[row] == value
+                                                            for column, value in zip(columns, values))]
+
+    def rows_in(self, key, values):
+        """ Return sorted list of rows where the attribute for key is one of values. """
+        rows = set()
+        for value in values:
+            rows.update(self.rows_equal((key, ), (value, )))
+        return sorted(rows)
+
+    def rows_in_range(self, key, low, high):
+        """ Return sorted list of rows where low <= attribute <= high, using a sorted index for numeric columns. """
+        column = self.column(key)
+        if _numpy() is None or not isinstance(column, np.ndarray) or column.dtype.kind not in "iuf":
+            return [row for row, value in enumerate(column) if low <= value <= high]
+        path_method = resolve_criteria_key(key)
+        if path_method not in self._sorted:
+            order = np.argsort(column, kind="stable")
+            self._sorted[path_method] = (order, column[order])
+        order, sorted_values = self._sorted[path_method]
+        start = np.searchsorted(sorted_values, low, side="left")
+        stop = np.searchsorted(sorted_values, high, side="right")
+        return sorted(order[start:stop].tolist())
+
+    def select(self, matcher):
+        """ Return list of oligos matching matcher (from compile_criteria), in the same order as in the part. """
+        return [self.oligos[row] for row in matcher(self)]
+
+
+def _compile_filter(key, value):
+    """
+    Return rowfilter(table, rows) -> rows for criterium (key, value), where value is a tuple,
+    i.e. a coordinate, a (min, max) range, or a set of values, see crit_match.
+    rows is a list of candidate rows, or None for all rows.
+    """
+    def rowfilter(table, rows):
+        values = table.values(key)
+        if values and isinstance(values[0], tuple):
+            # Coordinates, e.g. (5, 2); None matches any row/column, e.g. (5, None):
+            def test(oval):
+                return len(oval) == len(value) and all(v is None or v == a for v, a in zip(value, oval))
+        elif len(value) == 2:
+            if rows is None:
+                return table.rows_in_range(key, value[0], value[1])
+            def test(oval):
+                return value[0] <= oval <= value[1]
+        else:
+            if rows is None:
+                return table.rows_in(key, value)
+            def test(oval):
+                return oval in value
+        return [row for row in (range(len(values)) if rows is None else rows) if test(values[row])]
+    return rowfilter
+
+
+def _compile_criteriaset(criteriaset):
+    """ Return matcher(table) -> rows for a criteria set (dict), see compile_criteria. """
+    exact, filters = {}, []
+    for key, value in criteriaset.items():
+        if key == "st_type":
+            value = (value == "stap")
+        if isinstance(value, (list, tuple)):
+            filters.append(_compile_filter(key, tuple(value)))
+        else:
+            exact[key] = value
+    keys = tuple(sorted(exact))
+    values = tuple(exact[key] for key in keys)
+
+    def matcher(table):
+        # All exact criteria are looked up with a single (composite) hash index, then the candidates are filtered:
+        rows = table.rows_equal(keys, values) if keys else None
+        for rowfilter in filters:
+            rows = rowfilter(table, rows)
+        return list(range(len(table))) if rows is None else rows
+    return matcher
+
+
+def compile_criteria(criteria):
+    """
+    Compile criteria, a criteria set (dict) or a list of criteria sets, into a matcher,
+        matcher(table) -> rows
+    where table is an OligoAttributeTable and rows is the sorted list of rows (oligo numbers) matching criteria.
+    An oligo matches a criteria set if it matches all criteria in the set, and a list of criteria sets
+    if it matches any of the sets, see match_oligo.
+    """
     if isinstance(criteria, list):
-        # if we have a criteria_list, return the union of oligos matching any criteria (dict) in the list:
-        #return {oligo for crit_dict in criteria for oligo in get_matching_oligos(part, crit_dict)}
-        #return {oligo for crit_dict in criteria for oligo in get_matching_oligos(part, crit_dict)}
-        return [oligo for oligo in part.oligos() if oligo_match_criteriaset_list(oligo, criteria)]
-    return [oligo for oligo in part.oligos() if oligo_match_criteriaset(oligo, criteria)]
+        matchers = [compile_criteria(criteriaset) for criteriaset in criteria]
+        return lambda table: sorted(set().union(*[matcher(table) for matcher in matchers]))
+    return _compile_criteriaset(criteria)
 
 
 def print_oligo_criteria_match_report(oligos, criteria, desc=None):
@@ -286,30 +544,96 @@ def print_oligo_criteria_match_report(oligos, criteria, desc=None):
     print("\n{} oligos matching criteria set {}:".format(len(oligos), desc))
     #print("Oligos matching criteria set:", desc)
     if VERBOSE > 1:
+        import yaml
         print(yaml.dump({"criteria": [criteria]}, default_flow_style=False).strip("\n"))
         print("The matching oligos are:")
         print("\n".join(" - {}".format(oligo) for oligo in oligos))
 
 
-def apply_seqspecs(part, seqspecs, offset=None, verbose=None):
-    """ Apply sequences in seq_specs to matching oligos in part. """
+def apply_oligo_sequence(oligo, seq):
+    """
+    Apply seq to oligo, without undo. seq can be a str or a sequtils.CircularSequence view.
+    Views are passed directly to oligos that only slice the sequence (compactpart oligos);
+    other (cadnano) oligos get the full rotated str, which the view makes only once.
+    """
+    if isinstance(seq, CircularSequence) and not getattr(oligo, 'accepts_sequence_views', False):
+        seq = str(seq)
+    oligo.applySequence(seq, use_undostack=False)
+
+
+def apply_oligo_sequences(part, assignments):
+    """
+    Apply sequences to oligos in part in one pass, without undo. assignments is a list of (oligo, seq),
+    applied in order, with seq a str, a sequtils.CircularSequence view, or None to clear the sequence.
+    Returns list of the oligos whose sequence was changed, including complementary oligos.
+
+    oligo.applySequence() runs an ApplySequenceCommand for each oligo, which sets the sequence strand by strand
+    and emits oligoSequenceAddedSignal for the complementary oligo of every strand, and then for the oligo.
+    For a scaffold on a large design, that is tens of thousands of signals, each updating GUI items and caches.
+    Here, the strands are updated the same way as the command does it, with strand.setSequence() and
+    strand.setComplementSequence(), but oligoSequenceAddedSignal is only emitted once for each changed oligo,
+    after all sequences have been applied.
+    CompactPart parts are updated with part.apply_sequences(), and since compact oligos have no signals,
+    the part's cached hybridization patterns (cadnanoreader.HybPatternIndex) are invalidated instead.
+    """
+    if not assignments:
+        return []
+    if hasattr(part, 'apply_sequences'):
+        # CompactPart; sequences are only sliced, so CircularSequence views are not copied.
+        oligos = part.oligos()
+        changed_ids = part.apply_sequences([(oligo.id, seq) for oligo, seq in assignments])
+        changed = [oligos[oid] for oid in sorted(changed_ids)]
+        from . import cadnanoreader
+        hyb_index = cadnanoreader.get_hyb_pattern_index(part, create=False)
+        if hyb_index is not None:
+            hyb_index.invalidate(changed)
+        return changed
+    strand5p = assignments[0][0].strand5p()
+    if not all(hasattr(strand5p, name) for name in ('setSequence', 'setComplementSequence')):
+        # Not the strand API used by ApplySequenceCommand; apply the sequences one oligo at a time:
+        for oligo, seq in assignments:
+            apply_oligo_sequence(oligo, seq)
+        return [oligo for oligo, _ in assignments]
+    from .cadnanolib.util import comp
+    changed = {}    # oligo -> None, in order of first change
+    for oligo, seq in assignments:
+        remaining = None if seq is None else str(seq)
+        for strand in oligo.strand5p().generator3pStrand():
+            used, remaining = strand.setSequence(remaining)
+            used = comp(used) if used else None
+            for comp_strand in strand.getComplementStrands():
+                comp_strand.setComplementSequence(used, strand)
+                changed.setdefault(comp_strand.oligo(), None)
+        changed.setdefault(oligo, None)
+    for oligo in changed:
+        oligo.oligoSequenceAddedSignal.emit(oligo)
+    return list(changed)
+
+
+def apply_seqspecs(part, seqspecs, offset=None, verbose=None, table=None):
+    """
+    Apply sequences in seq_specs to matching oligos in part.
+    Sequences are rotated by the seq_spec's offset (or offset) without copying them, see sequtils.CircularSequence.
+    table is an OligoAttributeTable for part, which can be given to re-use it for several calls.
+    The sequences of all seq_specs are applied in one pass with apply_oligo_sequences.
+    """
     if verbose is None:
         verbose = VERBOSE
+    if table is None:
+        table = OligoAttributeTable(part)  # Shared by all seq_specs; not affected by applying sequences.
+    assignments = []
     for seq_i, seq_spec in enumerate(seqspecs):
         # seq_spec has key "seq" and optional keys "criteria", and "offset".
         # If seq_spec has an offset specified, this is always used.
         # Specifying offset=0 can be used to fix mini-scafs so they are not rotated with the main scaffold.
-        seq = seq_spec["seq"]
-        L = len(seq)
-        seq_offset = seq_spec.get("offset", offset)
-        if seq_offset:
-            seq = (seq*3)[L+seq_offset:L*2+seq_offset]
-        oligos = get_matching_oligos(part, seq_spec["criteria"])
+        seq = rotate_sequence(seq_spec["seq"], seq_spec.get("offset", offset))
+        oligos = get_matching_oligos(part, seq_spec["criteria"], table=table)
         if verbose > 1:
             print_oligo_criteria_match_report(oligos, seq_spec["criteria"],
                                               desc="for application of sequence #{}".format(seq_i))
-        for oligo in oligos:
-            oligo.applySequence(seq, use_undostack=False)
+        assignments.extend((oligo, seq) for oligo in oligos)
+    # All sequences are applied together, so each oligo's change is only signalled once:
+    apply_oligo_sequences(part, assignments)
 
 
 def apply_scaffold_sequence(part, seq, offset=None, verbose=None,
@@ -319,36 +643,36 @@ def apply_scaffold_sequence(part, seq, offset=None, verbose=None,
     Will apply sequence to the first scaffold oligo in part that passes
     match_fun(oligo, L), where L is the sequence length. match_fun default is:
         lambda oligo, L: not oligo.isStaple() and oligo.length() > L/2
+    The sequence is rotated by offset without copying it, see sequtils.CircularSequence.
     """
     L = len(seq)
-    if offset:
-        seq_offset = offset
-        seq = (seq*3)[L+seq_offset:L*2+seq_offset]
+    seq = rotate_sequence(seq, offset)
     oligos = part.oligos()
     # Get the first scaffold oligo:
     scaf_oligo = next(oligo for oligo in oligos if match_fun(oligo, L))
     if verbose:
         print(" - Applying {} nt sequence to oligo of length {}"
               .format(L, scaf_oligo.length()))
-    scaf_oligo.applySequence(seq, use_undostack=False)
+    apply_oligo_sequences(part, [(scaf_oligo, seq)])
 
 
-def apply_sequences(part, seqs, offset=None, verbose=0):
+def apply_sequences(part, seqs, offset=None, verbose=0, table=None):
     """
     Apply sequences in seqs to oligos in part.
     If seqs is just a str, it is assumed to be a single sequence to be applied
     to the first and only scaffold oligo in the design.
     Otherwise, seqs must be a list of seq_spec, each specifying a sequence and a set
     of criteria matching only those oligos to which the sequence should be applied.
+    table is an optional OligoAttributeTable for part, see apply_seqspecs.
     """
     # Apply sequence:
     #with open(os.path.join(folder, sequence_file)) as fd:
     #    scaf_sequence = fd.read()
     #scaf_oligo = next(oligo for oligo in part.oligos() if not oligo.isStaple())
-    if isinstance(seqs, str):
+    if isinstance(seqs, (str, CircularSequence)):
         # Perform simple sequence application using just a single sequence with no selection criteria.
         # Can be used if the design has one and only one scaffold.
         apply_scaffold_sequence(part, seq=seqs, offset=offset, verbose=verbose)
     else:
         # Apply sequences based on seq_spec criteria:
-        apply_seqspecs(part, seqs, offset=offset, verbose=verbose)
+        apply_seqspecs(part, seqs, offset=offset, verbose=verbose, table=table)
@@ -37,47 +37,122 @@ Regarding Qt:
 - http://matplotlib.org/examples/user_interfaces/embedding_in_qt4.html
 - http://stackoverflow.com/questions/12459811/how-to-embed-matplotib-in-pyqt-for-dummies
 
-
+Re-plotting:
+    FrequencyPlotModel keeps one vlines collection per (statspec, design) key for a figure.
+    Plotting the same key again updates the existing lines with set_segments instead of adding new lines,
+    and the figure is redrawn once per run with draw_idle():
+        model = get_plot_model(fig)
+        model.plot(key, scorefreqs, plotspec)   # for each statspec
+        model.draw()
+    Blitting is not used, since the axes limits and ticks usually change along with the lines.
+
+Plot modes:
+    matplotlib is not imported until something is plotted. Use get_pyplot() instead of importing pyplot.
+    The plot mode decides the matplotlib backend, see get_pyplot():
+        interactive (default): Qt backend, for use in cadnano or interactive sessions.
+        headless (or agg):     Agg backend, for saving plots on servers without a display.
+        none:                  No plotting, e.g. for scoring-only batch jobs.
+    The plot mode can be given as "plot_mode" in the staplestatter directive, or with the
+    STAPLESTATTER_PLOT_MODE environment variable.
 
 """
 
 
 from __future__ import absolute_import, print_function
 
+import os
 import logging
 logger = logging.getLogger(__name__)
 # Note: Use pytest-capturelog to capture and display logging messages during pytest
 
 
-try:
-    import matplotlib
-    from matplotlib.ticker import MaxNLocator
-except ImportError:
-    print("matplotlib library not available, unable to plot.")
-    matplotlib = None
-    pyplot = None
-else:
-    # backend must be selected *before* importing pyplot, pylab or matplotlib.backends
-    # See `matplotlib.rcsetup.interactive_bk` for available interactive backends.
-    if not "qt" in matplotlib.get_backend().lower() and not "zmq" in matplotlib.get_backend().lower():
-        try:
-            import PyQt4
-            matplotlib.use('Qt4Agg')    # 'agg' is just "anti-grain". Default is "Anti-Grain Geometry" C++ library.
-        except ImportError:
-            matplotlib.use('Qt5Agg')  # Must always be called *before* importing pyplot
-    # should be the same as setting
-    # matplotlib.rcParams['backend'] = 'Qt4Agg'.
-    # Also check:
-    # matplotlib.rcParams['backend.qt4'] = 'PyQt4' # or 'PySide'
+# matplotlib is imported on first use by get_pyplot(), see module docstring.
+matplotlib = None
+pyplot = None
+
+PLOT_MODES = ('interactive', 'headless', 'none')
+PLOT_MODE_ALIASES = {'agg': 'headless', 'false': 'none', 'off': 'none'}
+PLOT_MODE_ENVVAR = 'STAPLESTATTER_PLOT_MODE'
+_default_plot_mode = 'interactive'
+
+
+def set_plot_mode(mode):
+    """ Set the default plot mode (used if neither the directive nor the environment specifies a plot mode). """
+    global _default_plot_mode
+    _default_plot_mode = _check_plot_mode(mode)
+
+
+def _check_plot_mode(mode):
+    mode = PLOT_MODE_ALIASES.get(str(mode).lower(), str(mode).lower())
+    if mode not in PLOT_MODES:
+        raise ValueError("Unknown plot mode '%s', should be one of %s." % (mode, ", ".join(PLOT_MODES)))
+    return mode
 
-    # Note: If matplotlib is in interactive mode, pyplot.show() seems to be non-blocking.
-    # while if matplotlib is NOT in interactive mode, pyplot.show() will block terminal input.
-    # ALWAYS enable interactive mode before showing/drawing plots.
-    # You can disable interactive mode if you have a lot of things you want to
-    # create before you draw and thus want to postpone rendering until display time.
-    #matplotlib.interactive(True)    # will display things immediately.
 
-    from matplotlib import pyplot
+def get_plot_mode(mode=None):
+    """
+    Return the plot mode to use: mode if given (e.g. from a directive's plot_mode), otherwise the
+    STAPLESTATTER_PLOT_MODE environment variable if set, otherwise the default set with set_plot_mode().
+    """
+    if mode is None or mode == '':
+        mode = os.environ.get(PLOT_MODE_ENVVAR) or _default_plot_mode
+    return _check_plot_mode(mode)
+
+
+def get_pyplot(mode=None):
+    """
+    Return matplotlib's pyplot module, importing matplotlib and selecting the backend on first use:
+        interactive: A Qt backend (unless a Qt or zmq backend is already selected); falls back to
+                     the Agg backend if Qt is not available, e.g. on servers without a display.
+        headless:    The non-interactive Agg backend; plots can only be saved to file.
+        none:        No plotting; returns None.
+    Also returns None if matplotlib is not available.
+    """
+    global matplotlib, pyplot
+    mode = get_plot_mode(mode)
+    if mode == 'none':
+        return None
+    if matplotlib is None:
+        try:
+            import matplotlib as _matplotlib
+        except ImportError:
+            logger.warning("matplotlib library not available, unable to plot.")
+            return None
+        matplotlib = _matplotlib
+    if pyplot is None:
+        # backend must be selected *before* importing pyplot, pylab or matplotlib.backends
+        # See `matplotlib.rcsetup.interactive_bk` for available interactive backends.
+        backend = matplotlib.get_backend().lower()
+        try:
+            if mode == 'headless':
+                matplotlib.use('Agg')
+            elif "qt" not in backend and "zmq" not in backend:
+                try:
+                    import PyQt4
+                    matplotlib.use('Qt4Agg')    # 'agg' is just "anti-grain". Default is "Anti-Grain Geometry" C++ library.
+                except ImportError:
+                    matplotlib.use('Qt5Agg')  # Must always be called *before* importing pyplot
+            # should be the same as setting
+            # matplotlib.rcParams['backend'] = 'Qt4Agg'.
+            # Also check:
+            # matplotlib.rcParams['backend.qt4'] = 'PyQt4' # or 'PySide'
+
+            # Note: If matplotlib is in interactive mode, pyplot.show() seems to be non-blocking.
+            # while if matplotlib is NOT in interactive mode, pyplot.show() will block terminal input.
+            # ALWAYS enable interactive mode before showing/drawing plots.
+            # You can disable interactive mode if you have a lot of things you want to
+            # create before you draw and thus want to postpone rendering until display time.
+            #matplotlib.interactive(True)    # will display things immediately.
+            from matplotlib import pyplot as _pyplot
+        except ImportError as e:
+            # Qt (or another interactive backend) is not available, e.g. on a server without a display:
+            logger.warning("Could not use an interactive matplotlib backend (%s); using the Agg backend.", e)
+            matplotlib.use('Agg', force=True)
+            from matplotlib import pyplot as _pyplot
+        pyplot = _pyplot
+    elif mode == 'headless' and pyplot.get_backend().lower() != 'agg':
+        pyplot.switch_backend('Agg')
+    return pyplot
 
 
 def plotscores_histogram(scores):
@@ -92,6 +167,7 @@ def plotscores_histogram(scores):
     # alternatively, if using matplotlib object-oriented code, use fig.canvas.draw()
     """
     #n, bins, patches = pyplot.hist(x, num_bins, normed=1, facecolor='green', alpha=0.5)
+    pyplot = get_pyplot()
     values = scores.values()
     n, bins, patches = pyplot.hist(values)
     pyplot.xlabel = "Score value (lower is better)"
@@ -100,7 +176,8 @@ def plotscores_histogram(scores):
 
 
 def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Frequency / count", title=None,
-                     ax=None, fig=None, gridspec=None, subplotkey=111, xoffset=0, xlim_min=None, autocolors='krbgcmy', **kwargs):
+                     ax=None, fig=None, gridspec=None, subplotkey=111, xoffset=0, xlim_min=None, autocolors='krbgcmy',
+                     draw=True, **kwargs):
     """
     Plot score frequencies.
     You can re-use an existing figure by providing an axis with ax keyword,
@@ -124,15 +201,18 @@ def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Fr
 
     subplotkey is provided to add_subplot if making subfigure, keys are (numrows, numcols, plotnum)
 
+    If draw is False, the figure is not re-drawn; use this when plotting several things at once.
     """
-    print("xlabel: '%s'; kwargs: %s" % (xlabel, kwargs))
+    logger.debug("plot_frequencies(): xlabel: '%s'; kwargs: %s", xlabel, kwargs)
+    from matplotlib.ticker import MaxNLocator
+    pyplot = get_pyplot()
     if gridspec:
         ax = pyplot.subplot(gridspec)
     elif ax is None:
         if fig is None:
-            print("Making new figure...")
+            logger.debug("Making new figure...")
             fig = pyplot.figure(figsize=(12, 6))    # If you are in interactive mode, the figure will appear immediately.
-        print("Adding subplot/axes to figure...")
+        logger.debug("Adding subplot/axes to figure...")
         ax = fig.add_subplot(subplotkey)
     values, counts = zip(*scorefreqs)
 
@@ -140,7 +220,7 @@ def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Fr
     if kwargs.get('color') == 'auto':
         autocolors = autocolors*10  # Make sure we have sufficient and don't run into IndexErrors
         kwargs['color'] = autocolors[len(ax.collections)]
-        print("color auto adjusted to: ", kwargs['color'])
+        logger.debug("color auto adjusted to: %s", kwargs['color'])
     #else:
     #    print("color: ", kwargs['color'])
 
@@ -148,7 +228,7 @@ def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Fr
     if xoffset == 'auto':
         xoffsetmultiplier = 0.1 if max(values) < 10 else 0.2
         xoffset = 0.1 * len(ax.collections)
-        print("xoffset auto adjusted to: ", xoffset)
+        logger.debug("xoffset auto adjusted to: %s", xoffset)
     #else:
     #    print("xoffset: ", xoffset)
     if xoffset:
@@ -160,18 +240,16 @@ def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Fr
 
     # PLOT:
     #lines = ax.vlines(values, [0], counts, **kwargs)  # lines can also be obtained from ax.collections list.
-    print("Plotting vlines for %s on %s" % ((values, counts), ax))
+    logger.debug("Plotting vlines for %s on %s", (values, counts), ax)
     # matplotlib no longer silently ignores unrecognized parameters, but will raise errors:
-    kwargs.pop('hold')
-    lines = pyplot.vlines(values, [0], counts, axes=ax, **kwargs)  # lines can also be obtained from ax.collections list.
+    kwargs.pop('hold', None)
+    # pyplot.vlines(..., axes=ax) fails on recent matplotlib versions if ax is not the current axes:
+    lines = ax.vlines(values, [0], counts, **kwargs)  # lines can also be obtained from ax.collections list.
+    # Remember how the lines were made, for update_frequencies:
+    lines.staplestatter_plotargs = dict(xoffset=xoffset, min_score_visible=min_score_visible, xlim_min=xlim_min)
 
     # ADJUST THE PLOT:
-    valrange = max(values) - min(values)
-    xlim = [min(values)-0.1*valrange, max(max(values), min_score_visible)+0.1*valrange]
-    if xlim_min is not None and xlim_min < xlim[0]:
-        xlim[0] = xlim_min
-    ax.set_xlim(xlim)
-    ax.set_ylim(0, max(counts)*1.1)
+    valrange = _set_frequencies_lim(ax, values, counts, min_score_visible, xlim_min)
     ax.xaxis.set_major_locator(MaxNLocator(integer=True))
     if xlabel:
         ax.set_xlabel(xlabel)
@@ -181,30 +259,126 @@ def plot_frequencies(scorefreqs, min_score_visible=5, xlabel="Score", ylabel="Fr
         #ax.set_xticks([2*i for i in xrange(0, int(xlim[1]))])
         ax.minorticks_on()
     if title:
-        print("Setting axes/subplot title: ", title)
+        logger.debug("Setting axes/subplot title: %s", title)
         ax.set_title(title)
-    pyplot.draw()  # update figure (if in interactive mode...)
+    if draw:
+        pyplot.draw()  # update figure (if in interactive mode...)
     # fig.draw(artist, renderer)    # requires you to know how to draw...
     return ax, lines
 
 
-def plot_statspec(scorefreqs, plotspec, fig=None, ax=None):
+def _set_frequencies_lim(ax, values, counts, min_score_visible=5, xlim_min=None, autoscale_x=True, autoscale_y=True):
+    """ Set axes limits to show all frequency lines; returns the range of values. """
+    valrange = max(values) - min(values)
+    if autoscale_x:
+        xlim = [min(values)-0.1*valrange, max(max(values), min_score_visible)+0.1*valrange]
+        if xlim_min is not None and xlim_min < xlim[0]:
+            xlim[0] = xlim_min
+        ax.set_xlim(xlim)
+    if autoscale_y:
+        ax.set_ylim(0, max(counts)*1.1)
+    return valrange
+
+
+def update_frequencies(lines, scorefreqs, autoscale_x=True, autoscale_y=True, draw=True):
+    """
+    Update the vlines made by plot_frequencies in place with new score frequencies,
+    instead of adding a new line collection.
+    The x offset used by plot_frequencies is re-used, and the axes limits are adjusted unless disabled
+    with autoscale_x/autoscale_y (e.g. if the limits were set explicitly by a plotspec).
+    If draw is True, a re-draw of the figure is requested with draw_idle().
+    """
+    plotargs = getattr(lines, 'staplestatter_plotargs', {})
+    xoffset = plotargs.get('xoffset') or 0
+    values, counts = zip(*scorefreqs) if scorefreqs else ((), ())
+    lines.set_segments([[(value+xoffset, 0), (value+xoffset, count)] for value, count in zip(values, counts)])
+    ax = lines.axes
+    if values and ax is not None:
+        _set_frequencies_lim(ax, [value+xoffset for value in values], counts,
+                             plotargs.get('min_score_visible', 5), plotargs.get('xlim_min'),
+                             autoscale_x=autoscale_x, autoscale_y=autoscale_y)
+    if draw and lines.figure is not None:
+        lines.figure.canvas.draw_idle()
+    return lines
+
+
+def plot_statspec(scorefreqs, plotspec, fig=None, ax=None, draw=True):
     """
     Used by staplestatter.process_statspec() to plot score frequences.
+    If ax is given, the plotspec's subplot is ignored.
     """
     subplot = plotspec.get('subplot')
-    if subplot:
+    if subplot and ax is None:
         if fig:
             ax = fig.add_subplot(subplot)
         else:
-            ax = pyplot.subplot(subplot)
-    ax, lines = plot_frequencies(scorefreqs, fig=fig, ax=ax, **plotspec.get('plot_kwargs', dict()))
-    print("plotspec: ", plotspec)
+            ax = get_pyplot().subplot(subplot)
+    ax, lines = plot_frequencies(scorefreqs, fig=fig, ax=ax, draw=draw, **plotspec.get('plot_kwargs', dict()))
+    logger.debug("plotspec: %s", plotspec)
+    apply_plotspec(ax, plotspec)
+    return ax, lines
+
+
+def apply_plotspec(ax, plotspec):
+    """ Set the title, xlim, ylim, ylabel and legend of ax, if specified by plotspec. """
     adjustfuncs = ('title', 'xlim', 'ylim', 'ylabel')
     for cand in adjustfuncs:
         if cand in plotspec and plotspec[cand]:
-            # consider using ax instead of pyplot? However, then you should use 'set_'+cand
-            getattr(pyplot, cand)(plotspec[cand]) # equivalent to pyplot.title(plotspec['title'])
+            getattr(ax, 'set_'+cand)(plotspec[cand]) # equivalent to ax.set_title(plotspec['title'])
     if 'legend' in plotspec:
-        pyplot.legend(**plotspec['legend'])
-    return ax, lines
+        ax.legend(**plotspec['legend'])
+
+
+class FrequencyPlotModel(object):
+    """
+    Persistent frequency plots for a single figure, see module docstring.
+    Each key, e.g. (statspec, design), has one vlines collection, which is updated in place when
+    the key is plotted again. Axes are kept per plotspec subplot, so re-runs do not add new axes.
+    Use get_plot_model(fig) rather than instantiating this directly.
+    """
+
+    def __init__(self, figure):
+        self.figure = figure
+        self._lines = {}    # key -> LineCollection
+        self._axes = {}     # subplot -> Axes
+
+    def _get_axes(self, subplot):
+        """ Return axes for subplot, adding it to the figure if needed. """
+        ax = self._axes.get(subplot)
+        if ax is None or ax not in self.figure.axes:
+            ax = self._axes[subplot] = self.figure.add_subplot(subplot)
+        return ax
+
+    def plot(self, key, scorefreqs, plotspec):
+        """
+        Plot scorefreqs for key as specified by plotspec, updating the existing lines if key has been
+        plotted before. The figure is not re-drawn until draw() is called. Returns the LineCollection.
+        """
+        lines = self._lines.get(key)
+        if lines is not None and lines.axes is not None and lines.axes in self.figure.axes:
+            update_frequencies(lines, scorefreqs, autoscale_x=not plotspec.get('xlim'),
+                               autoscale_y=not plotspec.get('ylim'), draw=False)
+            apply_plotspec(lines.axes, plotspec)
+            return lines
+        ax = self._get_axes(plotspec.get('subplot') or 111)
+        _, lines = plot_statspec(scorefreqs, plotspec, ax=ax, draw=False)
+        self._lines[key] = lines
+        return lines
+
+    def draw(self):
+        """ Request a single re-draw of the figure. """
+        self.figure.canvas.draw_idle()
+
+
+# Attribute holding a figure's FrequencyPlotModel. The model refers to the figure (and its axes and lines),
+# so it is kept on the figure itself rather than in a weak-keyed dict, and freed when the figure is closed.
+PLOT_MODEL_ATTR = '_staplestatter_plot_model'
+
+
+def get_plot_model(fig):
+    """ Return the FrequencyPlotModel for fig, creating it if this is the first time it is requested. """
+    model = getattr(fig, PLOT_MODEL_ATTR, None)
+    if model is None:
+        model = FrequencyPlotModel(fig)
+        setattr(fig, PLOT_MODEL_ATTR, model)
+    return model
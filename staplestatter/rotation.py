@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for scoring all rotations (offsets) of a circular scaffold sequence on a cadnano design.
+
+The naive way to do a rotation scan is to apply the rotated sequence to the design for every offset
+and then re-read the hybridization patterns from the cadnano model (see bin/scaffold_rotation.py).
+However, the design does not change between offsets, only the sequence does.
+
+RotationScorer therefore extracts the design geometry once: For each staple (scored oligo),
+the hybridized segments are recorded, 5p to 3p, as (sequence, start position, length),
+where start position is the position on the scaffold (sequenced oligo) that the segment is hybridized to.
+For a given offset, the staple segment sequence is then just the reverse complement of
+    rotated_scaffold[start:start+length]
+where rotated_scaffold[i] = scaffold[(i+offset) % L], so no sequences are applied to the cadnano model.
+
+The nearest-neighbour sums are not re-calculated for every segment either:
+The (delta_h, delta_s) of every dinucleotide step of the (doubled) scaffold sequence is
+looked up once and accumulated (as exact integers), so the sums for any segment at any offset
+are just the difference of two cumulative sums. Shifting the window to the next offset is thus O(1) per segment,
+and all segments are processed at once with numpy.
+
+Usage:
+    scorer = RotationScorer(part, seq, hyb_kwargs={'Mg': 10})
+    scores = scorer.scores(range(len(seq)))  # list of (offset, score) tuples
+
+The scores are the same as staplestatter.score_part_v1(part, hyb_method="TM") after applying
+the sequence with the given offset (up to floating point rounding).
+
+"""
+
+from __future__ import absolute_import, print_function, division
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    print("Could not import numpy; sliding-window rotation scoring is not available.")
+    np = None
+
+from . import cadnanoreader
+from . import statutils
+from .meltingtemp import get_tm_engine
+from .oligo_utils import get_matching_oligos, OligoAttributeTable
+from .sequtils import CircularSequence
+from .cadnanolib.util import rcomp
+
+BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+NN_SCALE = 10  # Nearest-neighbour values are summed as integers in units of 1/NN_SCALE.
+
+
+def get_sequence_sources(part, seqs):
+    """
+    Return a list of (seq, fixed_offset, oligos) tuples, describing which oligos gets which sequence,
+    the same way as oligo_utils.apply_sequences does it.
+    If seqs is a str, it is applied to the first scaffold oligo longer than half the sequence.
+    Otherwise seqs is a list of seq_specs. A seq_spec with an "offset" is not rotated, fixed_offset
+    is None for sequences that are rotated.
+    """
+    if isinstance(seqs, (str, CircularSequence)):
+        L = len(seqs)
+        scaf_oligo = next(oligo for oligo in part.oligos() if not oligo.isStaple() and oligo.length() > L/2)
+        return [(seqs, None, [scaf_oligo])]
+    table = OligoAttributeTable(part)
+    return [(seq_spec["seq"], seq_spec.get("offset"), get_matching_oligos(part, seq_spec["criteria"], table=table))
+            for seq_spec in seqs]
+
+
+class RotationScorer(object):
+    """
+    Scores rotations of the sequence(s) in seqs on part without applying the sequences.
+    seqs is either a single sequence (str), or a list of seq_specs (same as for apply_sequences).
+    Sequences must consist of A, C, G, T (or U) only.
+    hyb_kwargs is passed to the Tm engine (default: {'Mg': 10}, same as score_part_v1).
+
+    The staple segment geometry is read from part when the scorer is created;
+    create a new scorer if the design is changed.
+    """
+
+    def __init__(self, part, seqs, stapleoligos=True, scaffoldoligos=False, hyb_kwargs=None):
+        if np is None:
+            raise ImportError("RotationScorer requires numpy.")
+        if hyb_kwargs is None:
+            hyb_kwargs = {'Mg': 10}
+        self.tm_engine = get_tm_engine(**hyb_kwargs)
+        sources = get_sequence_sources(part, seqs)
+        # Scaffold positions of each sequenced strand: {strand: (source idx, position of 5p base)}
+        self._strand_positions = {}
+        for src_idx, (seq, _, oligos) in enumerate(sources):
+            for oligo in oligos:
+                pos = 0
+                for strand in oligo.strand5p().generator3pStrand():
+                    # Later seq_specs overwrite earlier ones, same as when applying sequences:
+                    self._strand_positions[strand] = (src_idx, pos)
+                    pos += strand.totalLength()
+        self._init_sequences(sources)
+        self._init_segments(part, stapleoligos, scaffoldoligos)
+
+    def _init_sequences(self, sources):
+        """ Encode the doubled sequences of all sources in a single buffer with cumulative NN sums. """
+        codes, buf_starts = [], []
+        self.seq_lengths = np.array([len(seq) for seq, _, _ in sources], dtype=np.int64)
+        self.rotating = np.array([fixed_offset is None for _, fixed_offset, _ in sources])
+        self.fixed_offsets = np.array([fixed_offset or 0 for _, fixed_offset, _ in sources], dtype=np.int64)
+        self.sequences = []
+        start = 0
+        for seq, _, _ in sources:
+            seq = str(seq).upper().replace("U", "T")   # seq may be a sequtils.CircularSequence
+            try:
+                codes.extend(BASE_CODES[base] for base in seq*2)
+            except KeyError as e:
+                raise ValueError("Rotation scoring requires sequences with only A, C, G, T; found %s" % e)
+            self.sequences.append(seq)
+            buf_starts.append(start)
+            start += 2*len(seq)
+        self._buf_starts = np.array(buf_starts, dtype=np.int64)
+        self._buf = buf = np.array(codes, dtype=np.int8)
+        # Nearest-neighbour (delta_h, delta_s) for every dinucleotide step in the buffer.
+        # Steps spanning two sources are never used, since segments never span sources.
+        # The table values have one decimal, so the sums are kept as exact integers (in tenths);
+        # that way, segments with the same nearest neighbours always get exactly the same Tm.
+        if self.tm_engine.bio_kwargs is None:
+            pairs = self.tm_engine.nn_table_pairs()
+            pair_dh = np.array([int(round(pairs[b1+b2][0]*NN_SCALE)) for b1 in "ACGT" for b2 in "ACGT"])
+            pair_ds = np.array([int(round(pairs[b1+b2][1]*NN_SCALE)) for b1 in "ACGT" for b2 in "ACGT"])
+            steps = buf[:-1].astype(np.int64)*4 + buf[1:]
+            self._cum_dh = np.concatenate(([0], np.cumsum(pair_dh[steps])))
+            self._cum_ds = np.concatenate(([0], np.cumsum(pair_ds[steps])))
+        self._cum_gc = np.concatenate(([0], np.cumsum((buf == 1) | (buf == 2))))
+
+    def _init_segments(self, part, stapleoligos, scaffoldoligos):
+        """ Extract the hybridized segments of all scored oligos as (source, start position, length). """
+        strand_positions = self._strand_positions
+        region_table = cadnanoreader.get_part_hyb_regions(part)
+        insertions = {}
+        keys, lengths, seg_src, seg_start, seg_len = [], [], [], [], []
+        oligos = [oligo for oligo in part.oligos()
+                  if (oligo.isStaple() and stapleoligos) or (not oligo.isStaple() and scaffoldoligos)]
+        for oligo in oligos:
+            n_segments = 0
+            for strand in oligo.strand5p().generator3pStrand():
+                if strand in strand_positions:
+                    raise ValueError("Oligo %s is both scored and has a sequence applied; "
+                                     "use the per-offset apply-and-score approach instead." % (oligo, ))
+                for cStrand, (lowIdx, highIdx) in region_table[strand]:
+                    if cStrand not in strand_positions:
+                        continue  # No sequence on the complementary strand; excluded from the pattern.
+                    src_idx, pos5p = strand_positions[cStrand]
+                    if cStrand not in insertions:
+                        insertions[cStrand] = cadnanoreader.getstrandinsertionlengths(cStrand)
+                    start, end = cadnanoreader.getstrandsequenceslice(cStrand, lowIdx, highIdx, insertions[cStrand])
+                    start, length = pos5p + start, end - start
+                    # Only the first L bases of an oligo receives sequence:
+                    length = min(length, self.seq_lengths[src_idx] - start)
+                    if length <= 0:
+                        continue
+                    seg_src.append(src_idx)
+                    seg_start.append(start)
+                    seg_len.append(length)
+                    n_segments += 1
+            keys.append(oligo.locString())
+            lengths.append(n_segments)
+        self.keys = keys
+        self.offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        self._seg_src = np.array(seg_src, dtype=np.int64)
+        self._seg_start = np.array(seg_start, dtype=np.int64)
+        self._seg_len = np.array(seg_len, dtype=np.int64)
+        logger.debug("RotationScorer: %s oligos with %s hybridized segments.", len(keys), len(seg_len))
+
+    def _segment_indices(self, offset):
+        """ Return the buffer index of the scaffold-side 5p base of every segment for the given offset. """
+        src = self._seg_src
+        L = self.seq_lengths[src]
+        seg_offsets = np.where(self.rotating[src], offset, self.fixed_offsets[src])
+        return self._buf_starts[src] + (self._seg_start + seg_offsets) % L
+
+    def segment_seqs(self, offset):
+        """ Return list with the (staple) sequence of every hybridized segment, 5p to 3p. """
+        idx = self._segment_indices(offset)
+        letters = "ACGT"
+        return [rcomp("".join(letters[code] for code in self._buf[i:i+n])) for i, n in zip(idx, self._seg_len)]
+
+    def segment_tms(self, offset):
+        """ Return array with the melting temperature of every hybridized segment. """
+        if self.tm_engine.bio_kwargs is not None:
+            # Conditions not supported natively by TmEngine; calculate Tm for each segment sequence:
+            return np.array([self.tm_engine.tm(seq) for seq in self.segment_seqs(offset)], dtype=float)
+        idx = self._segment_indices(offset)
+        n = self._seg_len
+        last = idx + n - 1
+        first_base, last_base = self._buf[idx], self._buf[last]
+        n_GC = self._cum_gc[idx+n] - self._cum_gc[idx]
+        # The staple segment is the reverse complement of the scaffold segment: It starts with T if the
+        # scaffold segment ends with A, and it ends with A if the scaffold segment starts with T.
+        starts_T = (last_base == 0).astype(int)
+        ends_A = (first_base == 3).astype(int)
+        n_AT_ends = ((first_base == 0) | (first_base == 3)).astype(int) + ((last_base == 0) | (last_base == 3))
+        delta_h, delta_s = self.tm_engine.end_terms(starts_T, ends_A, n_AT_ends, (n_GC > 0).astype(int))
+        delta_h = delta_h + (self._cum_dh[last] - self._cum_dh[idx]) / NN_SCALE
+        delta_s = delta_s + (self._cum_ds[last] - self._cum_ds[idx]) / NN_SCALE
+        return self.tm_engine.tm_from_sums(delta_h, delta_s, n, n_GC)
+
+    def hyb_pattern(self, offset, method="TM"):
+        """
+        Return dict with hybridization patterns for all scored oligos for the given offset,
+        same as cadnanoreader.get_oligo_hyb_pattern after applying the rotated sequence(s).
+        method can be "TM", "seq" or "length".
+        """
+        if method == "TM":
+            values = self.segment_tms(offset).tolist()
+        elif method == "seq":
+            values = self.segment_seqs(offset)
+        elif method == "length":
+            values = self._seg_len.tolist()
+        else:
+            raise ValueError("Hybridization method %s not recognized." % method)
+        offsets = self.offsets
+        return {key: values[offsets[i]:offsets[i+1]] for i, key in enumerate(self.keys)}
+
+    def score(self, offset):
+        """ Return valley score (same as score_part_v1 with hyb_method="TM") for the given offset. """
+        valleydepths = statutils.batch_valleydepth(self.segment_tms(offset), self.offsets)
+        return -float(np.sqrt(-valleydepths).sum())
+
+    def scores(self, offsetrange):
+        """ Return list of (offset, score) tuples for all offsets in offsetrange. """
+        return [(offset, self.score(offset)) for offset in offsetrange]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for exporting per-oligo scores as a stream of rows, one row per statspec and oligo,
+e.g. for analysis with pandas, R or command line tools.
+
+Rows are written as soon as a statspec has been scored, so the full table is never held in memory:
+    with ScoreExporter.open("scores.csv") as exporter:      # .csv, .tsv, .ndjson/.jsonl, or "-" for stdout
+        scored = staplestatter.compute_statspecs(directive, part, exporter=exporter)
+or add an "export_file: scores.csv" entry to the directive.
+
+Columns:
+    design, statspec, scoremethod, hyb_method, oligo, length, score, hyb_pattern, tm
+where statspec is the statspec number, oligo is the oligo locString, and length is the oligo length.
+hyb_pattern is the pattern that was scored, and tm is the oligo's melting temperature pattern:
+the hyb_pattern if the statspec uses hyb_method TM, otherwise calculated with tm_kwargs if given, else empty.
+Patterns are lists in ndjson, and space-separated values in csv/tsv.
+
+"""
+
+from __future__ import absolute_import, print_function
+import os
+import sys
+import csv
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from . import cadnanoreader
+from . import timing
+
+COLUMNS = ('design', 'statspec', 'scoremethod', 'hyb_method', 'oligo', 'length', 'score', 'hyb_pattern', 'tm')
+FORMATS = {'.csv': 'csv', '.tsv': 'tsv', '.txt': 'tsv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson'}
+
+
+def format_pattern(pattern):
+    """ Return hybridization pattern as a string of space-separated values for csv/tsv. """
+    return " ".join("%g" % value for value in pattern)
+
+
+class ScoreExporter(object):
+    """
+    Writes scores to an open file as rows, see module docstring.
+    fmt is "csv", "tsv" or "ndjson".
+    If tm_kwargs is given (e.g. {'Mg': 10}), the tm column is also filled for statspecs not using hyb_method TM.
+    """
+
+    def __init__(self, fp, fmt="csv", designname=None, tm_kwargs=None, close=False):
+        if fmt not in ('csv', 'tsv', 'ndjson'):
+            raise ValueError("Unknown export format: %r" % (fmt,))
+        self.fp = fp
+        self.fmt = fmt
+        self.designname = designname
+        self.tm_kwargs = tm_kwargs
+        self.rows = 0
+        self._close = close
+        self._lengths = self._lengths_part = None
+        if fmt == 'ndjson':
+            self._writer = None
+        else:
+            self._writer = csv.writer(fp, delimiter="," if fmt == 'csv' else "\t", lineterminator="\n")
+            self._writer.writerow(COLUMNS)
+
+    @classmethod
+    def open(cls, filepath, fmt=None, **kwargs):
+        """
+        Open filepath for writing and return exporter. If filepath is "-", rows are written to stdout.
+        The format is determined from the file extension unless fmt is given (default: csv).
+        """
+        if fmt is None:
+            fmt = FORMATS.get(os.path.splitext(filepath)[1].lower(), 'csv')
+        if filepath == "-":
+            return cls(sys.stdout, fmt, **kwargs)
+        return cls(open(filepath, 'w'), fmt, close=True, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Flush rows and close the file, unless it was opened by the caller (e.g. stdout). """
+        if self._close:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+    def _oligo_lengths(self, part):
+        """ Return {oligo_key: length} for part, calculated once per part. """
+        if self._lengths_part is not part:
+            self._lengths = {oligo.locString(): oligo.length() for oligo in part.oligos()}
+            self._lengths_part = part
+        return self._lengths
+
+    def write_row(self, row):
+        """ Write a single row (a dict with the COLUMNS as keys). """
+        if self._writer is None:
+            self.fp.write(json.dumps(row) + "\n")
+        else:
+            self._writer.writerow([format_pattern(row[column] or ()) if column in ('hyb_pattern', 'tm')
+                                   else row[column] for column in COLUMNS])
+        self.rows += 1
+
+    def write_statspec(self, number, statspec, scores, part):
+        """
+        Write a row for each oligo scored for statspec (number), with the
+        hybridization patterns and oligo lengths taken from part.
+        """
+        hyb_method = statspec.get('hyb_method', 'length')
+        hyb_index = cadnanoreader.get_hyb_pattern_index(part)
+        hyb_patterns = hyb_index.hyb_pattern(method=hyb_method, **statspec.get('hyb_kwargs', dict()))
+        if hyb_method == 'TM':
+            tm_patterns = hyb_patterns
+        elif self.tm_kwargs is not None:
+            tm_patterns = hyb_index.hyb_pattern(method='TM', **self.tm_kwargs)
+        else:
+            tm_patterns = {}
+        lengths = self._oligo_lengths(part)
+        with timing.span("export"):
+            for oligo_key, score in scores.items():
+                self.write_row(dict(
+                    design=self.designname, statspec=number, scoremethod=statspec.get('scoremethod'),
+                    hyb_method=hyb_method, oligo=oligo_key, length=lengths.get(oligo_key), score=score,
+                    hyb_pattern=hyb_patterns.get(oligo_key), tm=tm_patterns.get(oligo_key)))
+            self.fp.flush()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for saving and loading staplestatter scores in a compact, columnar format.
+
+staplestatter.savestats saves the scores from process_statspecs (a list with a {oligo locString: score}
+dict for each statspec) as yaml, which is human readable, but slow to write and very slow to read back
+for large designs. A ScoreTable holds the same scores as flat arrays, with one row per (statspec, oligo):
+    statspec        int32       statspec number, i.e. index in directive['statspecs']
+    oligo           int32       index into the oligos array
+    score           float64
+    hyb_offsets     int64       (n_rows + 1), the hyb pattern of row i is hyb_values[hyb_offsets[i]:hyb_offsets[i+1]]
+    hyb_values      float64     hybridization lengths or melting temperatures
+and the oligo locStrings and statspecs:
+    oligos          unicode     oligo locStrings, e.g. '33[4]'
+    statspecs       unicode     the statspecs as a json string (0-d array)
+
+The table is saved as a numpy .npz file. All arrays have plain dtypes, so the file is read without pickle:
+    table = ScoreTable.from_scores(result['scores'], directive['statspecs'], result['hyb_patterns'])
+    table.save("scores.npz")
+    table = ScoreTable.load("scores.npz")
+    table.scores(0)                         # {locString: score} for the first statspec, as in the yaml file
+    table.column('score', statspec=0)       # numpy array with the scores for the first statspec
+    table.hyb_pattern(row)                  # numpy array with the hybridization pattern for a row
+
+"""
+
+from __future__ import absolute_import, print_function
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    print("numpy library not available, score tables (.npz) will not be available.")
+    np = None
+
+from . import timing
+
+COLUMNS = ('statspec', 'oligo', 'score', 'hyb_offsets', 'hyb_values')
+
+
+class ScoreTable(object):
+    """
+    Scores for one or more statspecs as flat arrays, see module docstring.
+    """
+
+    def __init__(self, oligos, statspec, oligo, score, hyb_offsets, hyb_values, statspecs=None):
+        if np is None:
+            raise ImportError("numpy is required for score tables.")
+        self.oligos = np.asarray(oligos, dtype=np.str_)
+        self.statspec = np.asarray(statspec, dtype=np.int32)
+        self.oligo = np.asarray(oligo, dtype=np.int32)
+        self.score = np.asarray(score, dtype=np.float64)
+        self.hyb_offsets = np.asarray(hyb_offsets, dtype=np.int64)
+        self.hyb_values = np.asarray(hyb_values, dtype=np.float64)
+        self.statspecs = statspecs
+        if not len(self.statspec) == len(self.oligo) == len(self.score) == len(self.hyb_offsets) - 1:
+            raise ValueError("ScoreTable columns must have the same number of rows.")
+
+    def __len__(self):
+        return len(self.score)
+
+    @classmethod
+    def from_scores(cls, allscores, statspecs=None, hyb_patterns=None):
+        """
+        Make table from a list with the {oligo_key: score} dict (or None) for each statspec,
+        e.g. the "scores" returned by process_statspecs.
+        hyb_patterns is an optional list with the {oligo_key: hyb_pattern} dict (or None) for each statspec,
+        e.g. the "hyb_patterns" returned by process_statspecs.
+        """
+        if np is None:
+            raise ImportError("numpy is required for score tables.")
+        with timing.span("score_table"):
+            oligo_numbers = {}
+            statspec_col, oligo_col, score_col, lengths, values = [], [], [], [], []
+            for i, scores in enumerate(allscores):
+                if not scores:
+                    continue
+                patterns = (hyb_patterns[i] if hyb_patterns else None) or {}
+                for key, score in scores.items():
+                    try:
+                        score_col.append(float(score))
+                    except TypeError:
+                        raise ValueError("Score tables only support a single score per oligo, but statspec %s "
+                                         "gave %r for oligo %s; save as yaml instead." % (i, score, key))
+                    statspec_col.append(i)
+                    oligo_col.append(oligo_numbers.setdefault(key, len(oligo_numbers)))
+                    pattern = patterns.get(key, ())
+                    lengths.append(len(pattern))
+                    values.extend(pattern)
+            hyb_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=hyb_offsets[1:])
+            oligos = sorted(oligo_numbers, key=oligo_numbers.get)
+            return cls(oligos, statspec_col, oligo_col, score_col, hyb_offsets, values, statspecs=statspecs)
+
+    def save(self, filepath, compressed=False):
+        """ Save table to filepath as .npz. Compression makes the file smaller, but saving slower. """
+        savez = np.savez_compressed if compressed else np.savez
+        with timing.span("save"):
+            with open(filepath, 'wb') as fp:
+                savez(fp, oligos=self.oligos, statspecs=np.array(json.dumps(self.statspecs, default=str)),
+                      **{name: getattr(self, name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, filepath):
+        """ Load table saved with save(). """
+        if np is None:
+            raise ImportError("numpy is required for score tables.")
+        with timing.span("load"):
+            with np.load(filepath, allow_pickle=False) as data:
+                columns = {name: data[name] for name in COLUMNS}
+                return cls(data['oligos'], statspecs=json.loads(data['statspecs'].item()), **columns)
+
+    def rows(self, statspec=None):
+        """ Return index array with the rows for statspec (number), or a slice with all rows if statspec is None. """
+        if statspec is None:
+            return slice(None)
+        return np.flatnonzero(self.statspec == statspec)
+
+    def column(self, name, statspec=None):
+        """
+        Return column <name> for all rows, or only the rows for statspec (number).
+        name is 'statspec', 'oligo', 'score' or 'locString' (the oligo locStrings).
+        """
+        if name not in ('statspec', 'oligo', 'score', 'locString'):
+            raise ValueError("Unknown score table column: %r" % (name,))
+        if name == 'locString':
+            return self.oligos[self.oligo[self.rows(statspec)]]
+        return getattr(self, name)[self.rows(statspec)]
+
+    def hyb_pattern(self, row):
+        """ Return the hybridization pattern for row as a numpy array. """
+        return self.hyb_values[self.hyb_offsets[row]:self.hyb_offsets[row+1]]
+
+    def scores(self, statspec):
+        """ Return {oligo_key: score} dict for statspec (number), i.e. the dict returned by score_part_oligos. """
+        rows = self.rows(statspec)
+        return dict(zip(self.oligos[self.oligo[rows]].tolist(), self.score[rows].tolist()))
+
+    def to_scores(self):
+        """
+        Return list with the {oligo_key: score} dict (or None) for each statspec, as saved to yaml by savestats.
+        Note that all scores are floats.
+        """
+        n_statspecs = max(len(self.statspecs or ()), int(self.statspec.max()) + 1 if len(self) else 0)
+        return [self.scores(i) or None for i in range(n_statspecs)]
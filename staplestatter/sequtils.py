@@ -21,17 +21,311 @@
 
 Module with sequence utility functions.
 
+CircularSequence is a rotated view of a (circular scaffold) sequence, used to apply a sequence at different
+offsets without making a rotated copy of the sequence for every offset:
+    rotated = CircularSequence(seq, offset)     # same bases as seq[offset:] + seq[:offset]
+    rotated[:100]                               # str, only these 100 bases are copied
+    str(rotated)                                # the full rotated sequence (made once and cached)
+
+Sequence files (plain text, multi-record fasta and genbank) are read with read_sequence_records,
+which memory maps large files and removes whitespace and numbers with bytes.translate.
+load_seq returns the sequence or seq_specs from a sequence file, as used by the scripts in bin/.
+
 """
 
 from __future__ import absolute_import, print_function
 import os
-import yaml
 import json
+import mmap
 
 
 VERBOSE = 0
 
 
+class CircularSequence(object):
+    """
+    Read-only view of sequence seq, rotated by offset, see module docstring.
+    The view has the same bases as seq[offset:] + seq[:offset], i.e. (seq*3)[L+offset:L*2+offset] for -L < offset < L,
+    but any offset is accepted (offsets are modulo the sequence length L).
+    Indexing and slicing returns str (only copying the selected bases), so views can be used where a sequence
+    is sliced strand by strand, e.g. by compactpart.CompactPart.apply_sequence.
+    """
+    __slots__ = ('seq', 'offset', '_str')
+
+    def __init__(self, seq, offset=0):
+        if isinstance(seq, CircularSequence):
+            seq, offset = seq.seq, seq.offset + offset
+        self.seq = seq
+        self.offset = offset % len(seq) if seq else 0
+        self._str = None
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __str__(self):
+        if self._str is None:
+            self._str = self.seq[self.offset:] + self.seq[:self.offset] if self.offset else self.seq
+        return self._str
+
+    def __repr__(self):
+        return "CircularSequence(<%s nt>, offset=%s)" % (len(self.seq), self.offset)
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __iter__(self):
+        seq, offset = self.seq, self.offset
+        for i in range(offset, len(seq)):
+            yield seq[i]
+        for i in range(offset):
+            yield seq[i]
+
+    def __getitem__(self, key):
+        seq, L = self.seq, len(self.seq)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(L)
+            if step != 1:
+                return str(self)[key]
+            if stop <= start:
+                return seq[:0]
+            start, stop = start + self.offset, stop + self.offset
+            if stop <= L:
+                return seq[start:stop]
+            if start >= L:
+                return seq[start-L:stop-L]
+            return seq[start:] + seq[:stop-L]
+        if key < 0:
+            key += L
+        if not 0 <= key < L:
+            raise IndexError("CircularSequence index out of range")
+        return seq[(key + self.offset) % L]
+
+    def rotated(self, offset):
+        """ Return a view of the same sequence, rotated by another offset. """
+        return CircularSequence(self.seq, self.offset + offset)
+
+    def upper(self):
+        """ Return view of the upper-case sequence with the same offset. """
+        return CircularSequence(self.seq.upper(), self.offset)
+
+
+def rotate_sequence(seq, offset):
+    """ Return seq rotated by offset as a CircularSequence view, or seq itself if offset is 0 or None. """
+    if not offset:
+        return seq
+    return CircularSequence(seq, offset)
+
+
+## Sequence files: ##
+
+SEQFILE_FORMATS = {".txt": "txt", ".seq": "txt",
+                   ".fasta": "fasta", ".fa": "fasta", ".fas": "fasta", ".fna": "fasta", ".fsa": "fasta",
+                   ".gb": "genbank", ".gbk": "genbank", ".genbank": "genbank",
+                   ".yaml": "yaml", ".yml": "yaml", ".json": "json"}
+
+# Files at least this large are memory mapped instead of read:
+MMAP_MIN_SIZE = 1 << 20
+
+# Translation table and deleted bytes for clean_sequence (works with both python 2 str and python 3 bytes):
+_UPPER_TABLE = bytes(bytearray(range(256))).upper()
+_WHITESPACE_DIGITS = b" \t\r\n\v\f0123456789"
+_BASES = b"ACGTU"
+
+
+# Memory mapped files are cleaned in chunks of this size:
+_CLEAN_CHUNK_SIZE = 1 << 22
+
+
+def clean_sequence(data, name=None):
+    """
+    Return the bases in data (bytes, or a buffer such as a memory mapped file) as an upper-case str,
+    removing whitespace, line breaks and numbers.
+    Raises ValueError if data contains anything else than A, C, G, T and U, e.g. N or other IUPAC codes,
+    since removing them would shift all following bases. name is the record name used in the error message.
+    """
+    if not isinstance(data, bytes):
+        # mmap objects have no translate(); slice them to bytes a chunk at a time:
+        return "".join(clean_sequence(data[i:i+_CLEAN_CHUNK_SIZE], name)
+                       for i in range(0, len(data), _CLEAN_CHUNK_SIZE))
+    seq = data.translate(_UPPER_TABLE, _WHITESPACE_DIGITS)
+    invalid = seq.translate(None, _BASES)
+    if invalid:
+        raise ValueError("Sequence %s contains characters that are not bases (A, C, G, T or U): %s" % (
+            name or "", ", ".join(sorted(set(repr(c) for c in invalid.decode("utf-8", "replace"))))))
+    return seq if isinstance(seq, str) else seq.decode("ascii")
+
+
+def _read_data(fd):
+    """ Return the content of fd (opened in binary mode), memory mapped if the file is large. """
+    size = os.fstat(fd.fileno()).st_size
+    if size >= MMAP_MIN_SIZE:
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    return fd.read()
+
+
+def _fasta_records(data):
+    """ Return list of (header, sequence) for the records in fasta data. """
+    records = []
+    start = data.find(b">")
+    while start >= 0:
+        header_end = data.find(b"\n", start)
+        if header_end < 0:
+            header_end = len(data)
+        next_start = data.find(b"\n>", header_end)
+        end = len(data) if next_start < 0 else next_start
+        header = data[start+1:header_end].strip().decode("utf-8", "replace")
+        records.append((header, clean_sequence(data[header_end:end], header)))
+        start = next_start + 1 if next_start >= 0 else -1
+    return records
+
+
+def _genbank_records(data):
+    """ Return list of (LOCUS name, sequence) for the records in genbank data (sequences from the ORIGIN section). """
+    records = []
+    start = data.find(b"LOCUS")
+    while start >= 0:
+        end = data.find(b"\n//", start)
+        if end < 0:
+            end = len(data)
+        locus = data[start:data.find(b"\n", start)].split()
+        name = locus[1].decode("utf-8", "replace") if len(locus) > 1 else str(len(records))
+        origin = data.find(b"\nORIGIN", start, end)
+        if origin < 0:
+            raise ValueError("GenBank record %s has no ORIGIN (sequence) section." % name)
+        records.append((name, clean_sequence(data[data.find(b"\n", origin+1):end], name)))
+        start = data.find(b"\nLOCUS", end)
+        if start >= 0:
+            start += 1
+    return records
+
+
+def _txt_records(data):
+    """ Return the sequence in a plain text file, skipping lines starting with "#", as a single record. """
+    if data.find(b"#") >= 0:
+        data = b"\n".join(line for line in data[:].splitlines() if not line.lstrip().startswith(b"#"))
+    return [(None, clean_sequence(data))]
+
+
+def read_sequence_records(filepath, fmt=None):
+    """
+    Read sequence file and return list of (name, sequence) records, with upper-case sequences.
+    fmt is "txt", "fasta" or "genbank"; default is determined from the file extension.
+      fasta:    One record per ">" header; name is the full header line (without ">").
+      genbank:  One record per LOCUS, name is the LOCUS name, sequence from the ORIGIN section.
+      txt:      A single record (name None) with all bases in the file; lines starting with "#" are skipped.
+    Whitespace, line breaks and numbers are removed from the sequences; other characters than A, C, G, T and U
+    (e.g. N) raise ValueError.
+    Large files are memory mapped, and sequences are cleaned with bytes.translate, so even multi-megabase
+    scaffolds and sequence libraries are read at about the speed of the disk.
+    """
+    if fmt is None:
+        fmt = SEQFILE_FORMATS.get(os.path.splitext(filepath)[1].lower(), "txt")
+    parse = {"txt": _txt_records, "fasta": _fasta_records, "genbank": _genbank_records}[fmt]
+    with open(filepath, "rb") as fd:
+        data = _read_data(fd)
+        try:
+            return parse(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def _parse_header_value(value):
+    """ Return header value as int if possible, otherwise as str. """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def seqspecs_from_records(records):
+    """
+    Return list of seq_specs from (name, sequence) records, e.g. from read_sequence_records.
+    The seq_spec name is the first word of the record name, and key=value words after that are used as
+    criteria, except "offset", e.g.
+        >p7560 st_type=scaf offset=10
+        >miniscaf st_type=scaf length=420 offset=0
+    A single record without criteria is applied to the scaffold, same as a plain sequence.
+    Raises ValueError for key=value words that are not criteria keys (oligo_utils.is_criteria_key),
+    e.g. "OS=Homo sapiens" in UniProt headers.
+    """
+    from .oligo_utils import is_criteria_key
+    seqspecs = []
+    for name, seq in records:
+        words = (name or "").split()
+        seq_spec = {"seq": seq, "bp": len(seq)}
+        if words and "=" not in words[0]:
+            seq_spec["name"] = words.pop(0)
+        criteria = dict((key, _parse_header_value(value)) for key, value in
+                        (word.split("=", 1) for word in words if "=" in word))
+        if "offset" in criteria:
+            seq_spec["offset"] = criteria.pop("offset")
+        unknown = sorted(key for key in criteria if not is_criteria_key(key))
+        if unknown:
+            raise ValueError("Sequence record header %r has key=value words that are not criteria keys: %s"
+                             % (name, ", ".join(unknown)))
+        if criteria:
+            seq_spec["criteria"] = criteria
+        seqspecs.append(seq_spec)
+    if len(seqspecs) == 1 and "criteria" not in seqspecs[0]:
+        seqspecs[0]["criteria"] = {"st_type": "scaf"}
+    missing = [seq_spec.get("name") for seq_spec in seqspecs if "criteria" not in seq_spec]
+    if missing:
+        raise ValueError("Sequence records %s have no criteria (key=value words in the record name), "
+                         "and there is more than one record." % ", ".join(str(name) for name in missing))
+    return seqspecs
+
+
+def _record_id(name):
+    """ Return the first word of a record name (the fasta id), or "" if there is no name. """
+    words = (name or "").split(None, 1)
+    return words[0] if words else ""
+
+
+# (abspath, mtime) -> {record id: sequence}
+_sequence_libraries = {}
+
+
+def load_sequence_library(filepath, fmt=None):
+    """
+    Return {name: sequence} for the records in a fasta or genbank file, e.g. a library of scaffold sequences.
+    Fasta records are named by the first word of the header. Libraries are cached by path and modification time,
+    so each file is only read once when the seq_specs for e.g. a batch of rotation scans refer to it.
+    """
+    key = (os.path.abspath(filepath), os.path.getmtime(filepath))
+    if key not in _sequence_libraries:
+        records = read_sequence_records(filepath, fmt)
+        _sequence_libraries[key] = {_record_id(name): seq for name, seq in records}
+    return _sequence_libraries[key]
+
+
+def resolve_seqspec_records(seqspecs, basedir=""):
+    """
+    Set "seq" for seq_specs that refer to a record in a sequence library instead of having a sequence:
+        - {record: p7560, seqfile: scaffolds.fasta, criteria: {st_type: scaf}}
+    seqfile is relative to basedir (the directory of the yaml/json file with the seq_specs).
+    Returns seqspecs (updated in place).
+    """
+    for seq_spec in seqspecs:
+        if "seq" in seq_spec or "record" not in seq_spec:
+            continue
+        if "seqfile" not in seq_spec:
+            raise ValueError("seq_spec for record %s has no seqfile." % (seq_spec["record"],))
+        library = load_sequence_library(os.path.join(basedir, seq_spec["seqfile"]))
+        try:
+            seq_spec["seq"] = library[str(seq_spec["record"])]
+        except KeyError:
+            raise ValueError("Sequence record %s not found in %s." % (seq_spec["record"], seq_spec["seqfile"]))
+        seq_spec.setdefault("name", seq_spec["record"])
+    return seqspecs
+
+
 def load_seq(args):
     """
     I figure there are a couple of ways I'd want to specify the sequences, from low to high complexity:
@@ -63,35 +357,32 @@ def load_seq(args):
                 }
             offset: <integer, positive or negative>,
          }, (...) ]
+
+    Sequence files can be plain text, fasta or genbank (see read_sequence_records), or yaml/json files
+    with a list of seq_specs. seq_specs in yaml/json files can take the sequence from a record in
+    a fasta or genbank sequence library, instead of having a "seq" entry, see resolve_seqspec_records.
+    The format is determined from the file extension, unless args has a "seqfileformat".
     """
     seqfile = args["seqfile"]
-    try:
-        ext = os.path.splitext(seqfile)[1]
-    except IndexError:
-        ext = "txt"
+    fmt = args.get("seqfileformat") or SEQFILE_FORMATS.get(os.path.splitext(seqfile)[1].lower(), "txt")
     if VERBOSE > 1:
-        print("seqfile:", seqfile, "- ext:", ext)
-    with open(seqfile) as fd:
-        if "txt" in ext:
-            if args["simple_seq"]:
-                print("Returning simple sequence rather than seq_spec.")
-                return fd.read().strip()
-            # Treat the file as a simple txt file
-            seq = next(line for line in (l.strip() for l in fd) if line and line[0] != "#")
-            seq = "".join(b for b in seq.upper() if b in "ATGCU")
-            seqs = [{"seq": seq,
-                     "criteria": {"st_type": "scaf"}
-                    }]
-        elif "fasta" in ext:
-            # File is fasta format
-            raise NotImplementedError("Fasta files are not yet implemented. (But that is easy to do when needed.)")
-        elif "yaml" in ext:
-            seqs = yaml.load(fd)
-        elif "json" in ext:
-            seqs = json.load(fd)
-        else:
-            raise ValueError("seqfile extension %s not recognized format." % ext)
-    return seqs
+        print("seqfile:", seqfile, "- format:", fmt)
+    if fmt in ("yaml", "json"):
+        with open(seqfile) as fd:
+            if fmt == "yaml":
+                import yaml
+                seqs = yaml.safe_load(fd)
+            else:
+                seqs = json.load(fd)
+        return resolve_seqspec_records(seqs, basedir=os.path.dirname(seqfile))
+    if fmt not in ("txt", "fasta", "genbank"):
+        raise ValueError("seqfile format %s not recognized." % fmt)
+    records = read_sequence_records(seqfile, fmt)
+    # A single record with offset or criteria in the header (key=value words) is returned as seq_spec, so they are used:
+    if args.get("simple_seq") and len(records) == 1 and "=" not in (records[0][0] or ""):
+        print("Returning simple sequence rather than seq_spec.")
+        return records[0][1]
+    return seqspecs_from_records(records)
 
 
 def apply_sequence_reminder(part, sequence, criteria=None):
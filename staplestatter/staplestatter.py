@@ -37,52 +37,55 @@ designname = os.path.splitext(os.path.basename(dc().filename()))[0]
 from __future__ import absolute_import, print_function
 import os
 import math
-import yaml
 import logging
 logger = logging.getLogger(__name__)
 # Note: Use pytest-capturelog to capture and display logging messages during pytest
 
-try:
-    import matplotlib
-    if not "qt" in matplotlib.get_backend().lower() \
-    and not "zmq" in matplotlib.get_backend().lower():
-        matplotlib.use('Qt5Agg') # Must always be called *before* importing pyplot
-    from matplotlib import pyplot
-except ImportError:
-    print("matplotlib library not available, unable to plot.")
-    matplotlib = None
-    pyplot = None
-
 #from statutils import valleyscore, globalmaxcount, maxlength
 from . import statutils
 from . import cadnanoreader
 from . import plotutils
+from . import timing
 from .plotutils import plot_frequencies
 from .cadnanoreader import get_part
 
 
-try:
-    import cadnano_api
-except ImportError:
-    try:
-        from cadnano import cadnano_api
-    except ImportError:
-        print("Could not import cadnano api...")
-        class cadnano_api(object):
-            """ Used as namespace to simulate the cadnano_api module (by defining a range of static methods) """
-            @staticmethod
-            def a():
-                """ Returns app instance. """
-                import cadnano
-                return cadnano.app()
-            @staticmethod
-            def d():
-                """ Returns document object (model). """
-                return cadnano_api.a().d
-            @staticmethod
-            def p():
-                """ Returns part object (model). """
-                return get_part(cadnano_api.d())
+class cadnano_api(object):
+    """ Used as namespace to simulate the cadnano_api module (by defining a range of static methods) """
+    @staticmethod
+    def a():
+        """ Returns app instance. """
+        import cadnano
+        return cadnano.app()
+    @staticmethod
+    def d():
+        """ Returns document object (model). """
+        return cadnano_api.a().d
+    @staticmethod
+    def p():
+        """ Returns part object (model). """
+        return get_part(cadnano_api.d())
+
+_cadnano_api = None
+
+
+def get_cadnano_api():
+    """
+    Return the cadnano_api module, importing it on first use (importing cadnano is slow),
+    or the cadnano_api namespace class above if the module is not available.
+    """
+    global _cadnano_api
+    if _cadnano_api is None:
+        try:
+            import cadnano_api as _api
+        except ImportError:
+            try:
+                from cadnano import cadnano_api as _api
+            except ImportError:
+                print("Could not import cadnano api...")
+                _api = cadnano_api
+        _cadnano_api = _api
+    return _cadnano_api
 
 
 def score_part_v1(cadnano_part, hyb_method="TM", hyb_kwargs=None):
@@ -99,7 +102,7 @@ def score_part_v1(cadnano_part, hyb_method="TM", hyb_kwargs=None):
     * Calculate per-method score, then combine this?
     * Calculate positive contributions and subtract negative? Or only have negative?
     """
-    print("\nscore_part_v1\n")
+    logger.debug("score_part_v1(): hyb_method = %s", hyb_method)
     if hyb_kwargs is None:
         hyb_kwargs = {'Mg': 10}
     oligo_hybridizations = cadnanoreader.get_oligo_hyb_pattern(cadnano_part, method=hyb_method, **hyb_kwargs)
@@ -112,10 +115,11 @@ def score_part_v1(cadnano_part, hyb_method="TM", hyb_kwargs=None):
     #valley_stretches = [statutils.valleyfinder(T_array) for T_array in T_arrays]
     # valleydepths returns negative values for valleys and 0 for non-valleys.
     # T_array can be empty if oligo does not hybridize on any (well-defined) sequence.
-    valleydepths = [statutils.valleydepth(T_array) for T_array in T_arrays if T_array]
+    with timing.span("score"):
+        valleydepths = [statutils.valleydepth(T_array) for T_array in T_arrays if T_array]
 
-    valleyscores = [-sum(math.sqrt(-valley) for valley in oligo_valleys) for oligo_valleys in valleydepths]
-    valleyscore = sum(valleyscores)
+        valleyscores = [-sum(math.sqrt(-valley) for valley in oligo_valleys) for oligo_valleys in valleydepths]
+        valleyscore = sum(valleyscores)
     return valleyscore
 
 
@@ -131,22 +135,51 @@ def score_part_oligos(cadnano_part, scoremethod=None, scoremethod_kwargs=None, h
         scoremethod = statutils.valleyscore
     if scoremethod_kwargs is None:
         scoremethod_kwargs = {}
-    print("scoremethod:", scoremethod)
-    oligo_hybridization_patterns = cadnanoreader.get_oligo_hyb_pattern(cadnano_part, method=hyb_method, **hyb_kwargs)
-    print("oligo_hybridization_patterns:", oligo_hybridization_patterns)
+    logger.debug("score_part_oligos(): scoremethod = %s", scoremethod)
+    # Use the part's hyb pattern index, so that statspecs using the same hyb_method share a single traversal:
+    hyb_index = cadnanoreader.get_hyb_pattern_index(cadnano_part)
+    oligo_hybridization_patterns = hyb_index.hyb_pattern(method=hyb_method, **hyb_kwargs)
+    logger.debug("oligo_hybridization_patterns: %s", oligo_hybridization_patterns)
+    return score_hyb_patterns(oligo_hybridization_patterns, scoremethod, scoremethod_kwargs)
+
+
+def score_hyb_patterns(hyb_patterns, scoremethod, scoremethod_kwargs=None):
+    """
+    Score hybridization patterns, dict of {oligo_key: hyb_pattern}, returning {oligo_key: score}.
+    Oligos that cannot be scored (e.g. if no sequence has been applied) are left out.
+    """
+    if scoremethod_kwargs is None:
+        scoremethod_kwargs = {}
     #scores = {oligo_key : scoremethod(hyb_pattern, **scoremethod_kwargs) for oligo_key, hyb_pattern in oligo_hybridization_patterns.items()}
     # Dict comprehensions is not compatible with Maya2012's python2.6, so falling back to :
     # scores = {oligo_key: scoremethod(hyb_pattern, **scoremethod_kwargs)
     #           for oligo_key, hyb_pattern in oligo_hybridization_patterns.items()}
-    # Let us catch oligos with no sequence, where the scoremethod may give an error:
-    scores = {}
-    for oligo_key, hyb_pattern in oligo_hybridization_patterns.items():
-        try:
-            scores[oligo_key] = scoremethod(hyb_pattern, **scoremethod_kwargs)
-        except ValueError as e:
-            print("ValueError (%s) while scoring oligo %s using scoremethod '%s'" % (e, oligo_key, scoremethod),
-                  " - make sure a sequence has been applied!")
-    return scores
+    with timing.span("score"):
+        scores, remaining = {}, hyb_patterns
+        name = getattr(scoremethod, '__name__', None)
+        if statutils.np is not None and name in statutils.BATCH_SCOREMETHODS:
+            # Score all oligos with a single vectorized call. Empty patterns, where the scoremethod may raise
+            # ValueError, are scored one at a time below, as are all patterns if the batch call fails:
+            batch = {oligo_key: hyb_pattern for oligo_key, hyb_pattern in hyb_patterns.items() if len(hyb_pattern)}
+            try:
+                scores = statutils.batch_score_hyb_patterns(batch, scoremethod, **scoremethod_kwargs)
+            except (ValueError, TypeError) as e:
+                logger.warning("Batch scoring using scoremethod '%s' failed (%s); scoring oligos one at a time.",
+                               name, e)
+                batch = {}
+            remaining = {oligo_key: hyb_pattern for oligo_key, hyb_pattern in hyb_patterns.items()
+                         if oligo_key not in batch}
+        # Let us catch oligos with no sequence, where the scoremethod may give an error:
+        for oligo_key, hyb_pattern in remaining.items():
+            try:
+                scores[oligo_key] = scoremethod(hyb_pattern, **scoremethod_kwargs)
+            except ValueError as e:
+                logger.warning("ValueError (%s) while scoring oligo %s using scoremethod '%s'"
+                               " - make sure a sequence has been applied!", e, oligo_key, scoremethod)
+        if remaining is not hyb_patterns and remaining:
+            # Same order as hyb_patterns:
+            scores = {oligo_key: scores[oligo_key] for oligo_key in hyb_patterns if oligo_key in scores}
+        return scores
 
 
 def get_highest_scores(scores, highest=10, threshold=0, printstats=False, printtofile=False, hightolow=True):
@@ -169,12 +202,12 @@ def get_highest_scores(scores, highest=10, threshold=0, printstats=False, printt
             print(output)
         if printtofile:
             try:
-                with open(printtofile, 'wb') as fh:
+                with open(printtofile, 'w') as fh:
                     fh.write(output)
             except (IOError, OSError) as e:
                 print("Could not save to file '", printtofile, "', got error: ", e)
 
-    logging.debug("Scored oligos from part: %s", score_name_tups)
+    logger.debug("Scored oligos from part: %s", score_name_tups)
     return score_name_tups
 
 
@@ -185,13 +218,14 @@ def plotpartstats(part=None, designname=None, figsize=None, scoremethod_kwargs=N
         f7, scoreaxes, allscores = plotpartstats(p())
     """
     print("\nplotpartstats(): using hyb_method=%s" % (hyb_method,))
-    if not matplotlib:
+    pyplot = plotutils.get_pyplot()
+    if pyplot is None:
         print("No matplotlib")
         return
     else:
         from matplotlib import gridspec
     if part is None:
-        part = cadnano_api.p()
+        part = get_cadnano_api().p()
     if designname is None:
         dc = part.document().controller()
         if not dc:
@@ -238,6 +272,22 @@ def plotpartstats(part=None, designname=None, figsize=None, scoremethod_kwargs=N
     return fig, allscores
 
 
+class Cancelled(Exception):
+    """ Raised by a compute_statspecs progress callback to stop processing a directive. """
+    pass
+
+
+def get_designname(part):
+    """ Return design name for part, i.e. the basename of the design file without extension. """
+    if not hasattr(part, 'document'):
+        # compactpart.CompactPart, e.g. a snapshot or a design loaded with cadnanojson:
+        return part.name or 'Origami'
+    dc = part.document().controller()
+    if not dc:
+        return getattr(part.document(), 'basename', 'Origami')
+    return os.path.splitext(os.path.basename(dc.filename()))[0]
+
+
 def process_statspec(statspec, part=None, designname=None, fig=None, ax=None):
     """
     Will process a single stat specification.
@@ -255,30 +305,26 @@ def process_statspec(statspec, part=None, designname=None, fig=None, ax=None):
         # subfigkeys = [211, 223, 224]  # the first plot will second and third plot will update automatically.
     """
     if part is None:
-        part = cadnano_api.p()
-    plotspec = statspec.get('plotspec', dict())
-    try:
-        scoremethod = getattr(statutils, statspec['scoremethod'])
-    except AttributeError:
-        print("ERROR -- Method '", statspec['scoremethod'],
-              "' in statspec was not found in statutils, continuing with next!")
+        part = get_cadnano_api().p()
+    scored = score_statspec(statspec, part)
+    if scored is None:
         return
-    except KeyError:
-        print("ERROR -- statspec does not have a key 'scoremethod', aborting this entry!")
+    scores, scorefreqs = scored
+    plot_scored_statspec(statspec, scores, scorefreqs, designname, fig=fig, ax=ax)
+    return scores
+
+
+def score_statspec(statspec, part):
+    """
+    Score all oligos in part as specified by statspec, and bin the scores (unless plot_frequencies is false).
+    Returns (scores, scorefreqs) tuple, or None if the oligos could not be scored.
+    This does not use matplotlib, and can be run in a background thread, e.g. on a compactpart snapshot.
+    """
+    scoremethod = get_scoremethod(statspec)
+    if scoremethod is None:
         return
     scoremethod_kwargs = statspec.get('scoremethod_kwargs', dict())
 
-    # Adjust auto stuff:
-    format_keys = dict(plotspec, designname=designname, scoremethod=statspec['scoremethod'], **scoremethod_kwargs)
-    print("format_keys:", format_keys)
-    autoformat_defaults = dict(title="{scoremethod}", label="{designname}", xlabel="{scoremethod}")
-    for autofmtkey in ('title', 'label', 'xlabel'):
-        if plotspec.get(autofmtkey, None) in (None, 'auto'):
-            fmt = plotspec.get(autofmtkey+'_fmt', autoformat_defaults[autofmtkey])
-            # I might want to set to None in the plotspec to NOT have it.
-            if fmt:
-                plotspec.setdefault('plot_kwargs', dict())[autofmtkey] = fmt.format(**format_keys)
-
     # Get scores:
     # TODO: Instead of using different `hyb_method`s (one for length, another for TM),
     # TODO: it might make better sense to have more `scoremethod` variants,
@@ -289,26 +335,121 @@ def process_statspec(statspec, part=None, designname=None, fig=None, ax=None):
     scores = score_part_oligos(
         part, scoremethod=scoremethod, scoremethod_kwargs=scoremethod_kwargs,
         hyb_method=statspec.get('hyb_method', 'length'), hyb_kwargs=statspec.get('hyb_kwargs', dict()))
+    return _scores_and_frequencies(statspec, scores, scoremethod)
+
+
+def _scores_and_frequencies(statspec, scores, scoremethod):
+    """ Return (scores, scorefreqs) for score_statspec, or None if there are no scores. """
     # Make frequencies:
     if not scores:
-        print("process_statspec(): No oligos could be scored using scoremethod '%s' - aborting..." % (scoremethod,))
-        print("scores is:", scores)
+        logger.warning("process_statspec(): No oligos could be scored using scoremethod '%s' - aborting...",
+                       scoremethod)
+        logger.debug("scores is: %s", scores)
         return
-    print("Scored %s oligos using scoremethod '%s'" % (len(scores), scoremethod))
-    scorefreqs = statutils.frequencies(scores, binning=int) if statspec.get('plot_frequencies', True) else None
-    print("%s different scores using scoremethod '%s'" % (len(scorefreqs), scoremethod))
+    logger.info("Scored %s oligos using scoremethod '%s'", len(scores), scoremethod)
+    with timing.span("frequencies"):
+        scorefreqs = statutils.frequencies(scores, binning=int) if statspec.get('plot_frequencies', True) else None
+    if scorefreqs is not None:
+        logger.info("%s different scores using scoremethod '%s'", len(scorefreqs), scoremethod)
+    return scores, scorefreqs
+
+
+def get_scoremethod(statspec):
+    """ Return the statutils scoremethod for statspec, or None (logging an error) if it is not found. """
+    try:
+        return getattr(statutils, statspec['scoremethod'])
+    except AttributeError:
+        logger.error("Method '%s' in statspec was not found in statutils, continuing with next!",
+                     statspec['scoremethod'])
+    except KeyError:
+        logger.error("statspec does not have a key 'scoremethod', aborting this entry!")
+
+
+class IncrementalScorer(object):
+    """
+    Scores a part for all statspecs in a directive, like compute_statspecs, but on repeated calls to update(),
+    only oligos whose hybridization pattern has changed are re-scored.
+    Hybridization patterns are taken from the part's cadnanoreader.HybPatternIndex, which only re-calculates
+    patterns for oligos that have changed, and returns the same pattern objects for unchanged oligos.
+    Used by the plugin to update the plots while the design is being edited.
+    """
+
+    def __init__(self, directive, part):
+        self.directive = directive
+        self.part = part
+        self._patterns = {}     # statspec number -> {oligo_key: hyb_pattern} as of the last update
+        self._scores = {}       # statspec number -> {oligo_key: score} as of the last update
+        self.rescored = 0       # number of oligos re-scored in the last update, mostly for testing.
+
+    def update(self):
+        """ Return list with a (scores, scorefreqs) tuple (or None) for each statspec, see compute_statspecs. """
+        hyb_index = cadnanoreader.get_hyb_pattern_index(self.part)
+        self.rescored = 0
+        scored = []
+        for i, statspec in enumerate(self.directive['statspecs']):
+            scoremethod = get_scoremethod(statspec)
+            if scoremethod is None:
+                scored.append(None)
+                continue
+            with timing.span("statspec"):
+                hyb_patterns = hyb_index.hyb_pattern(method=statspec.get('hyb_method', 'length'),
+                                                     **statspec.get('hyb_kwargs', dict()))
+                last_patterns, last_scores = self._patterns.get(i, {}), self._scores.get(i, {})
+                changed = {key: hyb_pattern for key, hyb_pattern in hyb_patterns.items()
+                           if last_patterns.get(key) is not hyb_pattern or key not in last_scores}
+                scores = {key: last_scores[key] for key in hyb_patterns if key not in changed}
+                scores.update(score_hyb_patterns(changed, scoremethod, statspec.get('scoremethod_kwargs')))
+                self.rescored += len(changed)
+                self._patterns[i], self._scores[i] = hyb_patterns, scores
+                scored.append(_scores_and_frequencies(statspec, scores, scoremethod))
+        return scored
+
+
+def get_statspec_plot_key(statspec, designname):
+    """ Return key identifying the plotted lines for statspec and design, see plotutils.FrequencyPlotModel. """
+    plotspec = statspec.get('plotspec', dict())
+    return (designname, plotspec.get('subplot'), statspec.get('scoremethod'), statspec.get('hyb_method', 'length'),
+            repr(sorted(statspec.get('hyb_kwargs', dict()).items())),
+            repr(sorted(statspec.get('scoremethod_kwargs', dict()).items())))
+
+
+def plot_scored_statspec(statspec, scores, scorefreqs, designname, fig=None, ax=None, plot_model=None):
+    """
+    Plot scores made by score_statspec(statspec, ...) as specified by statspec's plotspec,
+    and print the highest scores if statspec has a printspec.
+    If plot_model (plotutils.FrequencyPlotModel) is given, lines previously plotted for the same
+    statspec and design are updated instead of plotting new lines, and the figure is not re-drawn.
+    Returns (ax, lines) tuple.
+    """
+    plotspec = statspec.get('plotspec', dict())
+    scoremethod_kwargs = statspec.get('scoremethod_kwargs', dict())
+    # Adjust auto stuff:
+    format_keys = dict(plotspec, designname=designname, scoremethod=statspec['scoremethod'], **scoremethod_kwargs)
+    logger.debug("format_keys: %s", format_keys)
+    autoformat_defaults = dict(title="{scoremethod}", label="{designname}", xlabel="{scoremethod}")
+    for autofmtkey in ('title', 'label', 'xlabel'):
+        if plotspec.get(autofmtkey, None) in (None, 'auto'):
+            fmt = plotspec.get(autofmtkey+'_fmt', autoformat_defaults[autofmtkey])
+            # I might want to set to None in the plotspec to NOT have it.
+            if fmt:
+                plotspec.setdefault('plot_kwargs', dict())[autofmtkey] = fmt.format(**format_keys)
+
     # TODO: Instead of using frequencies, use a generic `plot_type` parameter to change how the scores are plotted.
     # TODO: Rename `plot_statspec()` to `plot_scorefreqs`, and make another `plot_scores` that take a simple array
     #       rather than taking a binned histogram
     # Plot
-    plotutils.plot_statspec(scorefreqs, plotspec, fig=fig, ax=ax)
+    with timing.span("plot"):
+        if plot_model is not None:
+            lines = plot_model.plot(get_statspec_plot_key(statspec, designname), scorefreqs, plotspec)
+            ax = lines.axes
+        else:
+            ax, lines = plotutils.plot_statspec(scorefreqs, plotspec, fig=fig, ax=ax)
     # Post-processing (?)
 
     if 'printspec' in statspec:
-        print("Printing highest scores with: statspec['printspec']")
+        logger.debug("Printing highest scores with printspec %s", statspec['printspec'])
         get_highest_scores(scores, **statspec['printspec'])  # This logic is subject to change.
-
-    return scores
+    return ax, lines
 
 
 def process_statspecs(directive, part=None, designname=None):
@@ -317,43 +458,152 @@ def process_statspecs(directive, part=None, designname=None):
     1) Initialize figure and optionally axes as specified by the directive instructions.
     2) Loop over all statspecs and call process_statspec.
     3) Aggregate and return a list of stats/scores.
+
+    The scoring and the plotting can also be done separately, with compute_statspecs and plot_statspecs.
+    The directive's "plot_mode" can be "interactive", "headless" (plots can be saved but are not shown)
+    or "none" (scoring only), see plotutils.get_pyplot. The figure is None if nothing was plotted.
+
+    If the directive has "trace: true" or "trace_file: <filepath>", the time spent in each stage
+    (hybridization patterns, Tm calculation, scoring, plotting, etc) is logged, and saved to trace_file
+    as json, see timing module. The tracer is returned as "trace".
+    If a timing.Tracer is already active, the stages are recorded by that tracer instead.
+
+    The hybridization patterns used for each statspec are returned as "hyb_patterns", so they can be
+    saved with the scores, see savestats.
     """
-    if pyplot is None:
-        print("\n\nERROR: matplotlib.pyplot is not available; cannot process stats specifications.\n")
-        return
     if part is None:
-        part = cadnano_api.p()
+        part = get_cadnano_api().p()
     if designname is None:
-        designname = os.path.splitext(os.path.basename(part.document().controller().filename()))[0]
-    print("designname:", designname)
+        designname = get_designname(part)
+    logger.debug("designname: %s", designname)
 
+    tracer = timing.get_tracer()
+    own_tracer = tracer is None and bool(directive.get('trace') or directive.get('trace_file'))
+    if own_tracer:
+        tracer = timing.Tracer(designname).start()
+    try:
+        with timing.span("process_statspecs"):
+            result = plot_statspecs(directive, compute_statspecs(directive, part, designname=designname), designname)
+        result['hyb_patterns'] = get_statspecs_hyb_patterns(directive, part)
+    finally:
+        if own_tracer:
+            tracer.stop()
+            tracer.log_summary()
+    if tracer is not None and directive.get('trace_file'):
+        tracer.save(directive['trace_file'])
+    result['trace'] = tracer
+    return result
+
+
+def compute_statspecs(directive, part, progress=None, exporter=None, designname=None):
+    """
+    Score part for all statspecs in directive, see score_statspec.
+    Returns a list with a (scores, scorefreqs) tuple (or None) for each statspec,
+    which can be plotted with plot_statspecs.
+    If given, progress(fraction, message) is called before each statspec and when done.
+    The progress callback can raise Cancelled to stop processing.
+    If exporter (scoreexport.ScoreExporter) is given, or the directive has an "export_file" entry,
+    a row is written for each scored oligo as soon as each statspec has been scored.
+    The export format can be given as "export_format" (csv, tsv or ndjson), and the Tm patterns can be
+    included for statspecs not using hyb_method TM with "export_tm_kwargs", e.g. {Mg: 10}.
+    designname is only used for the export, and defaults to get_designname(part).
+    """
     statspecs = directive['statspecs']
+    own_exporter = exporter is None and bool(directive.get('export_file'))
+    if own_exporter:
+        from .scoreexport import ScoreExporter
+        exporter = ScoreExporter.open(directive['export_file'], fmt=directive.get('export_format'),
+                                      designname=designname or get_designname(part), tm_kwargs=directive.get('export_tm_kwargs'))
+    scored = []
+    try:
+        for i, statspec in enumerate(statspecs):
+            if progress is not None:
+                progress(float(i)/len(statspecs), "Scoring %s (%s of %s)" % (
+                    statspec.get('scoremethod'), i+1, len(statspecs)))
+            with timing.span("statspec"):
+                scored.append(score_statspec(statspec, part))
+            if exporter is not None and scored[-1] is not None:
+                exporter.write_statspec(i, statspec, scored[-1][0], part)
+    finally:
+        if own_exporter:
+            exporter.close()
+    if progress is not None:
+        progress(1.0, "Scored %s statspecs" % len(statspecs))
+    return scored
+
+
+def get_statspecs_hyb_patterns(directive, part):
+    """
+    Return list with the {oligo_key: hyb_pattern} dict used to score each statspec in directive.
+    The patterns are taken from the part's cadnanoreader.HybPatternIndex, so after compute_statspecs
+    this does not calculate any patterns, unless the part has been changed.
+    """
+    hyb_index = cadnanoreader.get_hyb_pattern_index(part)
+    return [hyb_index.hyb_pattern(method=statspec.get('hyb_method', 'length'), **statspec.get('hyb_kwargs', dict()))
+            for statspec in directive['statspecs']]
+
+
+def plot_statspecs(directive, scored, designname):
+    """
+    Set up the figure and plot the scores made by compute_statspecs for all statspecs in directive.
+    Returns dict with figure, scores (a list with the scores for each statspec), and lines
+    (a list with the vlines LineCollection for each statspec, which can be updated with plotutils.update_frequencies).
+    Lines plotted by a previous call for the same statspec and design in the same figure are updated in place,
+    and the figure is re-drawn once, see plotutils.FrequencyPlotModel.
+    If the directive's plot_mode is "none" (or matplotlib is not available), nothing is plotted,
+    and figure and lines are None.
+    """
+    statspecs = directive['statspecs']
+    pyplot = plotutils.get_pyplot(directive.get('plot_mode'))
+    if pyplot is None:
+        if plotutils.get_plot_mode(directive.get('plot_mode')) != 'none':
+            logger.error("matplotlib.pyplot is not available; cannot plot stats specifications.")
+        allscores = [statspec_scored[0] if statspec_scored else None for statspec_scored in scored]
+        for statspec, scores in zip(statspecs, allscores):
+            if scores and 'printspec' in statspec:
+                get_highest_scores(scores, **statspec['printspec'])
+        return dict(figure=None, scores=allscores, lines=None)
     figspec = directive.get('figure', dict())
-    print("figspec:", figspec)
-    if figspec.get('newfigure', False) or len(pyplot.get_fignums()) < 1:
-        fig = pyplot.figure(**figspec.get('figure_kwargs', {}))
-    else:
-        fig = pyplot.gcf() # Will make a new figure if no figure has been created.
-    # Here you can add more "figure/axes" specification logic:
-    adjustfuncs = ('title', 'size_inches', 'dpi')
-    for cand in adjustfuncs:
-        if cand in figspec and figspec[cand]:
-            getattr(fig, 'set_'+cand)(figspec[cand]) # equivalent to fig.title(figspec['title'])
-
-    pyplot.ion()
-    allscores = list()
-    for _, statspec in enumerate(statspecs):
-        scores = process_statspec(statspec, part=part, designname=designname, fig=fig)
+    logger.debug("figspec: %s", figspec)
+    with timing.span("plot"):
+        if figspec.get('newfigure', False) or len(pyplot.get_fignums()) < 1:
+            fig = pyplot.figure(**figspec.get('figure_kwargs', {}))
+        else:
+            fig = pyplot.gcf() # Will make a new figure if no figure has been created.
+        # Here you can add more "figure/axes" specification logic:
+        adjustfuncs = ('title', 'size_inches', 'dpi')
+        for cand in adjustfuncs:
+            if cand in figspec and figspec[cand]:
+                getattr(fig, 'set_'+cand)(figspec[cand]) # equivalent to fig.title(figspec['title'])
+
+        pyplot.ion()
+    plot_model = plotutils.get_plot_model(fig)
+    allscores, alllines = list(), list()
+    for statspec, statspec_scored in zip(statspecs, scored):
+        if statspec_scored is None:
+            allscores.append(None)
+            alllines.append(None)
+            continue
+        scores, scorefreqs = statspec_scored
+        _, lines = plot_scored_statspec(statspec, scores, scorefreqs, designname, plot_model=plot_model)
         allscores.append(scores)
-    return dict(figure=fig, scores=allscores)
+        alllines.append(lines)
+    with timing.span("plot"):
+        plot_model.draw()
+    return dict(figure=fig, scores=allscores, lines=alllines)
+
+
+def load_directive(directive_string):
+    """ Parse a staplestatter directive (yaml format) and return it as a dict. """
+    import yaml
+    return yaml.safe_load(directive_string)
 
 
 def process_statspecs_string(directive_string):
     """
     Process a statspecs string, yaml format.
     """
-    directive = yaml.load(directive_string)
-    return process_statspecs(directive)
+    return process_statspecs(load_directive(directive_string))
 
 
 def process_statspecs_file(filepath):
@@ -361,13 +611,36 @@ def process_statspecs_file(filepath):
     Process a statspecs file, yaml format.
     """
     with open(filepath) as fd:
-        directive = yaml.load(fd)
+        directive = load_directive(fd)
     return process_statspecs(directive)
 
 
-def savestats(stats, filepath):
-    """ save stats to filepath """
+def savestats(stats, filepath, statspecs=None, hyb_patterns=None):
+    """
+    Save stats, i.e. the list of scores returned by process_statspecs, to filepath.
+    If filepath ends with .npz, the stats are saved as a scorestore.ScoreTable, together with
+    statspecs and hyb_patterns (if given). This is much faster to save and load for large designs.
+    Otherwise, the stats are saved as yaml.
+    """
     try:
-        yaml.dump(stats, open(filepath, 'w'))  # 'wb' mode for python2, 'w' mode for python3.
+        if os.path.splitext(filepath)[1].lower() == '.npz':
+            from .scorestore import ScoreTable
+            ScoreTable.from_scores(stats, statspecs, hyb_patterns).save(filepath)
+            return
+        import yaml
+        with timing.span("save"):
+            with open(filepath, 'w') as fp:
+                yaml.dump(stats, fp)
     except IOError as e:
         print("IOError while saving stats to file:", filepath, " : ", e)
+
+
+def loadstats(filepath):
+    """ Load stats saved with savestats, returning the list of scores (a {oligo_key: score} dict for each statspec). """
+    if os.path.splitext(filepath)[1].lower() == '.npz':
+        from .scorestore import ScoreTable
+        return ScoreTable.load(filepath).to_scores()
+    import yaml
+    with timing.span("load"):
+        with open(filepath) as fp:
+            return yaml.safe_load(fp)
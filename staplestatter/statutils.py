@@ -22,6 +22,14 @@
 
 Takes arbitrary numeric arrays and process them.
 
+The scoremethods (maxlength, valleyscore, globalmaxcount, etc) take a single hybridization
+pattern (list of hybridization lengths or melting temperatures) at a time.
+The batch_* functions take the hybridization patterns of *all* oligos packed into a single ragged
+array, i.e. a flat `values` array and an `offsets` array where oligo i's pattern is
+values[offsets[i]:offsets[i+1]], and score all oligos using vectorized numpy operations.
+Use pack_hyb_patterns() to produce the ragged array and batch_score_hyb_patterns() to get
+a dict of scores just like staplestatter.score_part_oligos.
+
 """
 
 from __future__ import absolute_import, print_function
@@ -31,6 +39,12 @@ import logging
 logger = logging.getLogger(__name__)
 # Note: Use pytest-capturelog to capture and display logging messages during pytest
 
+try:
+    import numpy as np
+except ImportError:
+    print("numpy library not available, batch scoring will not be available.")
+    np = None
+
 
 def leftrightmaxdiff(T_array, boundary=None, boundary_min=None):
     """
@@ -38,25 +52,45 @@ def leftrightmaxdiff(T_array, boundary=None, boundary_min=None):
     (T_array is expected to be an array of strand hybridization lengths or melting temperatures)
     Returns two arrays, one with the difference vs the max to the left
     and another array with the difference vs the max to the right.
+    The max to the left (right) of the first (last) element is the boundary value,
+    which defaults to min(T_array).
     >>> leftrightmaxdiff([7, 14, 21])
-    ([7, 7, 7], [-14, -7, 21])
+    ([0, 7, 7], [-14, -7, 14])
     >>> leftrightmaxdiff([14, 7, 14, 21])
-    ([14, -7, 0, 7], [-7, -14, -7, 21])
+    ([7, -7, 0, 7], [-7, -14, -7, 14])
     >>> leftrightmaxdiff([14, 7, 7, 21])
-    ([14, -7, -7, 7], [-7, -14, -14, 21])
+    ([7, -7, -7, 7], [-7, -14, -14, 14])
     >>> leftrightmaxdiff([14, 13, 12, 13, 14])
-    ([14, -1, -2, -1, 0], [0, -1, -2, -1, 14])
+    ([2, -1, -2, -1, 0], [0, -1, -2, -1, 2])
+    >>> leftrightmaxdiff([7, 14, 21], boundary=0)
+    ([7, 7, 7], [-14, -7, 21])
     >>> leftrightmaxdiff([23])
-    ([23], [23])
+    ([0], [0])
     >>> leftrightmaxdiff([])
-    ([], [])
+    Traceback (most recent call last):
+    ...
+    ValueError: min() arg is an empty sequence
+
+    Implemented as a single prefix-max scan and a single suffix-max scan, i.e. O(n).
+    (The original implementation did max(T_pad[:i]) and max(T_pad[i+1:]) for every i, which is O(n^2).)
     """
     if boundary is None:
         boundary = min(boundary_min, *T_array) if boundary_min else min(T_array)
-    T_pad = [boundary] + T_array + [boundary] # use 1-based indexing
-    # remember, array[0:2] slice goes from index 0 up to BUT NOT INCLUDING 2, i.e. 0 and 1.
-    leftbound = [T_pad[i]-max(T_pad[:i]) for i in range(1, len(T_array)+1)]
-    rightbound = [T_pad[i]-max(T_pad[i+1:]) for i in range(1, len(T_array)+1)]
+    # Prefix-max scan, left to right:
+    leftbound = []
+    runmax = boundary
+    for t in T_array:
+        leftbound.append(t - runmax)
+        if t > runmax:
+            runmax = t
+    # Suffix-max scan, right to left:
+    rightbound = []
+    runmax = boundary
+    for t in reversed(T_array):
+        rightbound.append(t - runmax)
+        if t > runmax:
+            runmax = t
+    rightbound.reverse()
     return leftbound, rightbound
 
 
@@ -80,7 +114,9 @@ def valleyfinder(T_array, margin=0):
         >>> valleyfinder([23])
         [0]
         >>> valleyfinder([])
-        []
+        Traceback (most recent call last):
+        ...
+        ValueError: min() arg is an empty sequence
 
     """
     #leftbound, rightbound = leftrightmaxdiff(T_array)
@@ -123,7 +159,9 @@ def valleydepth(T_array, margin=0):
         >>> valleydepth([23])
         [0]
         >>> valleydepth([])
-        []
+        Traceback (most recent call last):
+        ...
+        ValueError: min() arg is an empty sequence
     """
     #leftbound, rightbound = leftrightmaxdiff(T_array)
     #valleyarray = [1 if leftbound[i] < margin and rightbound[i] < margin else 0 for i in range(len(T_array))]
@@ -149,7 +187,9 @@ def valleyscore(T_array, margin=0):
         >>> valleyscore([23])
         0
         >>> valleyscore([])
-        0
+        Traceback (most recent call last):
+        ...
+        ValueError: min() arg is an empty sequence
     """
     return sum(valleyfinder(T_array, margin))
 
@@ -170,10 +210,27 @@ def isglobalmax(T_array, margin=0):
         >>> isglobalmax([])
         []
     """
-    if len(T_array) == 1:
-        # T_array[i+1:] would fail for this
+    n = len(T_array)
+    if n == 0:
+        return []
+    if n == 1:
         return [1]
-    return [1 if t-max(T_array[:i]+T_array[i+1:]) >= -margin else 0 for i, t in enumerate(T_array)]
+    # For each element, the max of all *other* elements is the global max,
+    # except for a unique global max, where it is the second-highest value.
+    # Finding the two highest values in one pass makes this O(n) instead of O(n^2).
+    max1 = max2 = None
+    max1count = 0
+    for t in T_array:
+        if max1 is None or t > max1:
+            max2 = max1
+            max1, max1count = t, 1
+        elif t == max1:
+            max1count += 1
+        elif max2 is None or t > max2:
+            max2 = t
+    if max1count > 1:
+        max2 = max1
+    return [1 if t - (max2 if t == max1 else max1) >= -margin else 0 for t in T_array]
 
 
 def globalmaxcount(T_array, margin=0):
@@ -261,3 +318,175 @@ def frequencies(scores, binning=None):
     #scorefreq = sorted((value, values.count(value)) for value in set(values)) # Faster short lists with few unique values.
     scorefreq = sorted(Counter(values).items())  # Faster for long list with many unique elements.
     return scorefreq
+
+
+def pack_hyb_patterns(hyb_patterns):
+    """
+    Pack a dict of hybridization patterns, e.g. as returned by cadnanoreader.get_oligo_hyb_pattern,
+    into a ragged numpy array. Returns a three-tuple:
+        keys, values, offsets
+    where the hybridization pattern for keys[i] is values[offsets[i]:offsets[i+1]].
+        >>> keys, values, offsets = pack_hyb_patterns({'a': [7, 14, 21], 'b': [], 'c': [23]})
+        >>> keys, values.tolist(), offsets.tolist()
+        (['a', 'b', 'c'], [7, 14, 21, 23], [0, 3, 3, 4])
+    """
+    keys = list(hyb_patterns.keys())
+    lengths = np.fromiter((len(hyb_patterns[key]) for key in keys), dtype=np.int64, count=len(keys))
+    offsets = np.zeros(len(keys)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.array([val for key in keys for val in hyb_patterns[key]])
+    return keys, values, offsets
+
+
+def _segments(values, offsets):
+    """
+    Returns segment info for a ragged array:
+        starts, seg_ids, nonempty
+    where starts are the start indices of the non-empty segments, seg_ids gives the
+    (non-empty) segment number for each element in values, and nonempty is a boolean mask
+    over all segments.
+    """
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    starts = offsets[:-1][nonempty]
+    seg_ids = np.repeat(np.arange(len(starts)), lengths[nonempty])
+    return starts, seg_ids, nonempty
+
+
+def _expand(segment_values, nonempty, fill=0):
+    """ Expand values for non-empty segments to an array with one value for every segment. """
+    out = np.full(len(nonempty), fill, dtype=np.result_type(segment_values, type(fill)))
+    out[nonempty] = segment_values
+    return out
+
+
+def batch_leftrightmaxdiff(values, offsets):
+    """
+    Vectorized leftrightmaxdiff() for all segments of a ragged array.
+    Returns two flat arrays (leftbound, rightbound), aligned with values.
+        >>> left, right = batch_leftrightmaxdiff([7, 14, 21, 14, 13, 12, 13, 14], [0, 3, 3, 8])
+        >>> left.tolist(), right.tolist()
+        ([0, 7, 7, 2, -1, -2, -1, 0], [-14, -7, 14, 0, -1, -2, -1, 2])
+
+    The segmented running max is computed on integer value ranks offset by segment number,
+    so a single maximum.accumulate() over the whole array restarts at every segment boundary.
+    Values are looked up from the ranks afterwards, so the differences are exactly the same
+    as those from leftrightmaxdiff().
+    """
+    values = np.asarray(values)
+    if values.size == 0:
+        return values.copy(), values.copy()
+    starts, seg_ids, _ = _segments(values, offsets)
+    uniq, ranks = np.unique(values, return_inverse=True)
+    ranks = ranks.reshape(-1).astype(np.int64)
+    nranks = len(uniq)
+    ends = np.append(starts[1:], len(values)) - 1
+    # Boundary is min(T_array) for each segment:
+    boundary = np.minimum.reduceat(ranks, starts)
+    # Prefix max (inclusive), shifted one position right within each segment:
+    shift = seg_ids * nranks
+    leftmax = np.empty_like(ranks)
+    leftmax[1:] = np.maximum.accumulate(ranks + shift)[:-1] - shift[1:]
+    leftmax[starts] = boundary
+    # Suffix max (inclusive), computed on the reversed array where the segment order is also reversed:
+    shift = (seg_ids[-1] - seg_ids) * nranks
+    rightmax = np.empty_like(ranks)
+    rightmax[:-1] = np.maximum.accumulate((ranks + shift)[::-1])[::-1][1:] - shift[:-1]
+    rightmax[ends] = boundary
+    leftbound = values - uniq[leftmax]
+    rightbound = values - uniq[rightmax]
+    return leftbound, rightbound
+
+
+def batch_valleyfinder(values, offsets, margin=0):
+    """ Vectorized valleyfinder(), returns a flat int array aligned with values. """
+    leftbound, rightbound = batch_leftrightmaxdiff(values, offsets)
+    return ((leftbound < -margin) & (rightbound < -margin)).astype(int)
+
+
+def batch_valleydepth(values, offsets, margin=0):
+    """ Vectorized valleydepth(), returns a flat array aligned with values. """
+    leftbound, rightbound = batch_leftrightmaxdiff(values, offsets)
+    return np.minimum(0, np.maximum(leftbound+margin, rightbound+margin))
+
+
+def batch_valleyscore(values, offsets, margin=0):
+    """
+    Vectorized valleyscore(), returns an array with one score for each segment.
+        >>> batch_valleyscore([14, 7, 14, 21, 23, 14, 13, 12, 13, 14], [0, 4, 4, 5, 10]).tolist()
+        [1, 0, 0, 3]
+    """
+    starts, _, nonempty = _segments(values, offsets)
+    if not len(starts):
+        return np.zeros(len(nonempty), dtype=int)
+    return _expand(np.add.reduceat(batch_valleyfinder(values, offsets, margin), starts), nonempty)
+
+
+def batch_globalmaxcount(values, offsets, margin=0):
+    """
+    Vectorized globalmaxcount(), returns an array with one count for each segment.
+        >>> batch_globalmaxcount([7, 14, 21, 23, 14, 13, 12, 13, 14], [0, 3, 3, 4, 9]).tolist()
+        [1, 0, 1, 2]
+        >>> batch_globalmaxcount([7, 14, 21, 23, 14, 13, 12, 13, 14], [0, 3, 3, 4, 9], margin=1).tolist()
+        [1, 0, 1, 4]
+    """
+    values = np.asarray(values)
+    starts, seg_ids, nonempty = _segments(values, offsets)
+    if not len(starts):
+        return np.zeros(len(nonempty), dtype=int)
+    max1 = np.maximum.reduceat(values, starts)
+    ismax1 = values == max1[seg_ids]
+    max1count = np.add.reduceat(ismax1.astype(int), starts)
+    # Second-highest value in each segment; for segments with several maxima this is the max itself.
+    others = np.where(ismax1, np.min(values), values)
+    max2 = np.where(max1count > 1, max1, np.maximum.reduceat(others, starts))
+    othermax = np.where(ismax1, max2[seg_ids], max1[seg_ids])
+    isglobal = (values - othermax) >= -margin
+    # A single-element segment is always its own global max:
+    lengths = np.diff(np.asarray(offsets))[nonempty]
+    isglobal[starts[lengths == 1]] = True
+    return _expand(np.add.reduceat(isglobal.astype(int), starts), nonempty)
+
+
+def batch_maxlength(values, offsets, margin=0):
+    """ Vectorized maxlength(), returns an array with one value for each segment (0 for empty segments). """
+    starts, _, nonempty = _segments(values, offsets)
+    if not len(starts):
+        return np.zeros(len(nonempty), dtype=int)
+    return _expand(np.maximum.reduceat(np.asarray(values), starts), nonempty)
+
+
+# Batch implementations of the per-oligo scoremethods, by scoremethod name.
+# Scoremethods returning a value per oligo give an array with one value per segment,
+# scoremethods returning a list per oligo (listed in PER_ELEMENT_SCOREMETHODS) give a flat array aligned with values.
+BATCH_SCOREMETHODS = {
+    'maxlength': batch_maxlength,
+    'valleyscore': batch_valleyscore,
+    'valleydepth': batch_valleydepth,
+    'globalmaxcount': batch_globalmaxcount,
+}
+PER_ELEMENT_SCOREMETHODS = {'valleydepth'}
+
+
+def batch_score_hyb_patterns(hyb_patterns, scoremethod, **scoremethod_kwargs):
+    """
+    Score all hybridization patterns in the dict hyb_patterns using a single vectorized call.
+    scoremethod can be the name of a scoremethod or the scoremethod function itself,
+    but must have an entry in BATCH_SCOREMETHODS.
+    Returns a dict with the same keys as hyb_patterns and the same values as
+        {key: scoremethod(hyb_pattern, **scoremethod_kwargs) for key, hyb_pattern in hyb_patterns.items()}
+    for non-empty patterns. Empty patterns give 0 (or []), where the valley scoremethods raise ValueError;
+    staplestatter.score_hyb_patterns leaves those oligos out, same as when scoring one oligo at a time.
+    Raises KeyError if scoremethod does not have a batch implementation.
+        >>> batch_score_hyb_patterns({'a': [14, 7, 14, 21], 'b': [14, 13, 12, 13, 14]}, 'valleyscore')
+        {'a': 1, 'b': 3}
+    """
+    name = getattr(scoremethod, '__name__', scoremethod)
+    batchmethod = BATCH_SCOREMETHODS[name]
+    keys, values, offsets = pack_hyb_patterns(hyb_patterns)
+    scores = batchmethod(values, offsets, **scoremethod_kwargs)
+    if name in PER_ELEMENT_SCOREMETHODS:
+        # Per-element values; split into one list per oligo:
+        return {key: scores[start:end].tolist() for key, start, end in zip(keys, offsets[:-1], offsets[1:])}
+    return dict(zip(keys, scores.tolist()))
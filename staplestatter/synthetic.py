@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for generating synthetic cadnano designs of a given size, e.g. for benchmarks and tests.
+
+The designs are made as cadnano v2 json data (dict), so they can be loaded with
+cadnanojson.JsonPart without cadnano, or saved and opened in cadnano:
+    nno_dict = make_synthetic_design(n_helices=100, n_staples=2000)
+    part = make_synthetic_part(n_helices=100, n_staples=2000)   # JsonPart with scaffold sequence applied
+
+Layout:
+    The helices are placed in a single row, all with the same length.
+    The scaffold is a single linear oligo: It first runs through the left half of all helices
+    (raster-style, 0, 1, 2, ...) and then back through the right half (..., 2, 1, 0).
+    There is thus a scaffold "seam" in the middle of every helix.
+    Staples pair up helices (0, 1), (2, 3), etc: Each staple starts on the odd helix, runs
+    a random number of bases, crosses over to the even helix and runs back the same number of bases.
+    Staples crossing the seam hybridize to two scaffold strands on each helix.
+    The helix length is chosen so the number of staples is close to n_staples.
+
+"""
+
+from __future__ import absolute_import, print_function
+import random
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _empty_vstrand(num, length):
+    return {"num": num, "row": 0, "col": num,
+            "scaf": [[-1, -1, -1, -1] for _ in range(length)],
+            "stap": [[-1, -1, -1, -1] for _ in range(length)],
+            "loop": [0]*length, "skip": [0]*length,
+            "scafLoop": [], "stapLoop": [], "stap_colors": []}
+
+
+def _add_oligo(vstrands, key, strand_ranges):
+    """
+    Add oligo to vstrands[...][key] ("scaf" or "stap"), going through strand_ranges from 5p to 3p.
+    strand_ranges is a list of (helix number, 5p idx, 3p idx).
+    """
+    bases = [(num, idx) for num, idx5p, idx3p in strand_ranges
+             for idx in (range(idx5p, idx3p+1) if idx5p <= idx3p else range(idx5p, idx3p-1, -1))]
+    for i, (num, idx) in enumerate(bases):
+        prev_vh, prev_idx = bases[i-1] if i > 0 else (-1, -1)
+        next_vh, next_idx = bases[i+1] if i+1 < len(bases) else (-1, -1)
+        vstrands[num][key][idx] = [prev_vh, prev_idx, next_vh, next_idx]
+
+
+def get_helix_length(n_helices, n_staples, staple_segment_lengths=(8, 16)):
+    """ Return helix length giving approximately n_staples staples for n_helices helices. """
+    n_pairs = (n_helices + 1) // 2
+    mean_segment = sum(staple_segment_lengths) / 2.0
+    return max(int(round(n_staples * mean_segment / n_pairs)), 2*staple_segment_lengths[1])
+
+
+def make_synthetic_design(n_helices, n_staples, seed=0, staple_segment_lengths=(8, 16), name=None):
+    """
+    Return a synthetic cadnano v2 design (json dict) with n_helices helices and approximately
+    n_staples staples (see module docstring for the layout).
+    staple_segment_lengths is the (min, max) number of bases a staple runs on each helix.
+    The same seed gives the same design.
+    """
+    rnd = random.Random(seed)
+    length = get_helix_length(n_helices, n_staples, staple_segment_lengths)
+    seam = length // 2
+    vstrands = [_empty_vstrand(num, length) for num in range(n_helices)]
+    # Scaffold runs 5p->3p from low to high idx on even helices and from high to low on odd helices:
+    left = [(num, 0, seam-1) if num % 2 == 0 else (num, seam-1, 0) for num in range(n_helices)]
+    right = [(num, seam, length-1) if num % 2 == 0 else (num, length-1, seam) for num in reversed(range(n_helices))]
+    _add_oligo(vstrands, "scaf", left + right)
+    # Staples:
+    for num in range(0, n_helices, 2):
+        idx = 0
+        while idx < length:
+            end = min(idx + rnd.randint(*staple_segment_lengths), length) - 1
+            if length - end - 1 < staple_segment_lengths[0]:
+                end = length - 1   # Do not leave a stub at the end of the helix
+            if num + 1 < n_helices:
+                # Starting on the odd helix (low to high), crossover to the even helix (high to low):
+                _add_oligo(vstrands, "stap", [(num+1, idx, end), (num, end, idx)])
+                vstrands[num+1]["stap_colors"].append([idx, rnd.randint(0, 0xffffff)])
+            else:
+                _add_oligo(vstrands, "stap", [(num, end, idx)])
+                vstrands[num]["stap_colors"].append([end, rnd.randint(0, 0xffffff)])
+            idx = end + 1
+    if name is None:
+        name = "synthetic_%sh_%ss" % (n_helices, n_staples)
+    return {"name": name, "vstrands": vstrands}
+
+
+def random_sequence(length, seed=0):
+    """ Return random DNA sequence of the given length. """
+    rnd = random.Random(seed)
+    return "".join(rnd.choice("ACGT") for _ in range(length))
+
+
+def make_synthetic_part(n_helices, n_staples, seed=0, apply_sequence=True, **kwargs):
+    """
+    Return cadnanojson.JsonPart with a synthetic design, see make_synthetic_design().
+    If apply_sequence is True, a random scaffold sequence is applied.
+    """
+    from .cadnanojson import JsonPart
+    part = JsonPart(make_synthetic_design(n_helices, n_staples, seed=seed, **kwargs))
+    if apply_sequence:
+        scaffold = next(oligo for oligo in part.oligos() if not oligo.isStaple())
+        scaffold.applySequence(random_sequence(scaffold.length(), seed=seed))
+    return part
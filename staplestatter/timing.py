@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##
+
+# pylint: disable-msg=C0103
+
+"""
+
+Module for timing the stages of a staplestatter run (design load, hybridization pattern extraction,
+Tm calculation, scoring, frequency binning, plotting, saving).
+
+The code is instrumented with named spans:
+    with timing.span("score"):
+        ...
+Spans are no-ops unless a Tracer is active in the current thread:
+    with timing.Tracer("my design") as tracer:
+        staplestatter.process_statspecs(directive, part)
+    print(tracer.format_summary())     # wall/cpu time and call count per stage
+    tracer.save("trace.json")
+
+A stage's time includes the time of stages nested within it, e.g. "hyb_pattern" includes "tm".
+The saved trace uses the Chrome trace event format, so it can be opened in chrome://tracing or
+https://ui.perfetto.dev. Very frequent spans, e.g. the per-strand "tm" spans, are created with
+span(name, event=False), and are only included in the summary, not as individual events.
+
+"""
+
+from __future__ import absolute_import, print_function
+import os
+import json
+import time
+import threading
+import functools
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+# time.perf_counter and time.process_time are not available on python 2:
+wall_timer = getattr(time, 'perf_counter', time.time)
+cpu_timer = getattr(time, 'process_time', time.clock if hasattr(time, 'clock') else time.time)
+
+_local = threading.local()
+
+
+def get_tracer():
+    """ Return the active tracer for the current thread, or None if no tracer is active. """
+    stack = getattr(_local, 'tracers', None)
+    return stack[-1] if stack else None
+
+
+class Tracer(object):
+    """
+    Collects span timings while active, see module docstring.
+    Use as a context manager, or call start() and stop().
+    Tracers can be nested; spans are recorded by the innermost active tracer of the current thread.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.stages = OrderedDict()     # stage name -> [calls, wall, cpu]
+        self.events = []                # (name, start, wall, cpu, depth)
+        self.depth = 0
+        self.wall = self.cpu = None
+        self._start = self._cpu_start = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """ Make this the active tracer of the current thread. """
+        if not hasattr(_local, 'tracers'):
+            _local.tracers = []
+        _local.tracers.append(self)
+        self._start, self._cpu_start = wall_timer(), cpu_timer()
+        return self
+
+    def stop(self):
+        """ Stop recording spans with this tracer. """
+        self.wall, self.cpu = wall_timer() - self._start, cpu_timer() - self._cpu_start
+        try:
+            _local.tracers.remove(self)
+        except (AttributeError, ValueError):
+            logger.warning("Tracer %s was stopped, but was not active in this thread.", self.name)
+        return self
+
+    def add(self, name, start, wall, cpu, depth=0, event=True):
+        """ Record a span; usually called by span.__exit__. """
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0, 0.0, 0.0]
+        stage[0] += 1
+        stage[1] += wall
+        stage[2] += cpu
+        if event:
+            self.events.append((name, start, wall, cpu, depth))
+
+    def summary(self):
+        """ Return list of dicts with stage, calls, wall and cpu (seconds), in order of first completion. """
+        return [dict(stage=name, calls=calls, wall=wall, cpu=cpu)
+                for name, (calls, wall, cpu) in self.stages.items()]
+
+    def format_summary(self):
+        """ Return the summary as a plain-text table. """
+        rows = [("stage", "calls", "wall (s)", "cpu (s)")]
+        rows += [(stage['stage'], str(stage['calls']), "%.4f" % stage['wall'], "%.4f" % stage['cpu'])
+                 for stage in self.summary()]
+        if self.wall is not None:
+            rows.append(("total", "", "%.4f" % self.wall, "%.4f" % self.cpu))
+        widths = [max(len(row[i]) for row in rows) for i in range(4)]
+        return "\n".join("  ".join([row[0].ljust(widths[0])] + [val.rjust(width) for val, width in
+                                                                 zip(row[1:], widths[1:])]) for row in rows)
+
+    def log_summary(self, level=logging.INFO):
+        """ Log the summary table with the module logger. """
+        logger.log(level, "Timings for %s:\n%s", self.name, self.format_summary())
+
+    def as_dict(self):
+        """ Return dict with the summary and events in Chrome trace event format (times in microseconds). """
+        t0 = self._start or 0
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "ts": (start - t0)*1e6, "dur": wall*1e6,
+                   "pid": pid, "tid": depth, "args": {"cpu": cpu}}
+                  for name, start, wall, cpu, depth in self.events]
+        return {"name": self.name, "wall": self.wall, "cpu": self.cpu,
+                "stages": self.summary(), "traceEvents": events}
+
+    def save(self, filepath):
+        """ Save summary and events as json to filepath. """
+        with span("save"):
+            with open(filepath, 'w') as fp:
+                json.dump(self.as_dict(), fp, indent=1)
+
+
+class span(object):
+    """
+    Context manager timing a stage of a staplestatter run, see module docstring.
+    Does nothing (except looking up the active tracer) if no tracer is active.
+    If event is False, the span is only included in the tracer's summary.
+    """
+    __slots__ = ('name', 'event', 'tracer', 'start', 'cpu')
+
+    def __init__(self, name, event=True):
+        self.name = name
+        self.event = event
+        self.tracer = get_tracer()
+        self.start = self.cpu = None
+
+    def __enter__(self):
+        if self.tracer is not None:
+            self.tracer.depth += 1
+            self.start, self.cpu = wall_timer(), cpu_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        tracer = self.tracer
+        if tracer is not None:
+            wall, cpu = wall_timer() - self.start, cpu_timer() - self.cpu
+            tracer.depth -= 1
+            tracer.add(self.name, self.start, wall, cpu, tracer.depth, self.event)
+
+
+def traced(name):
+    """ Decorator, timing all calls to the decorated function as stage <name>. """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
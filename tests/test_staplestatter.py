@@ -23,3 +23,537 @@ logger = logging.getLogger(__name__)
 # Note: Use pytest-capturelog to capture and display logging messages during pytest
 
 
+
+import random
+
+from staplestatter import statutils
+from staplestatter.cadnanolib.util import rcomp
+
+
+def _leftrightmaxdiff_bruteforce(T_array):
+    """ Reference O(n^2) implementation of statutils.leftrightmaxdiff. """
+    boundary = min(T_array)
+    T_pad = [boundary] + list(T_array) + [boundary]
+    return ([T_pad[i]-max(T_pad[:i]) for i in range(1, len(T_array)+1)],
+            [T_pad[i]-max(T_pad[i+1:]) for i in range(1, len(T_array)+1)])
+
+
+def _isglobalmax_bruteforce(T_array, margin=0):
+    """ Reference O(n^2) implementation of statutils.isglobalmax. """
+    if len(T_array) == 1:
+        return [1]
+    return [1 if t-max(T_array[:i]+T_array[i+1:]) >= -margin else 0 for i, t in enumerate(T_array)]
+
+
+def test_linear_kernels_match_bruteforce():
+    rng = random.Random(0)
+    for _ in range(2000):
+        T_array = [rng.choice((rng.randint(0, 6), rng.uniform(0, 60))) for _ in range(rng.randint(1, 12))]
+        margin = rng.choice((0, 0.5, 1))
+        assert statutils.leftrightmaxdiff(T_array) == _leftrightmaxdiff_bruteforce(T_array)
+        assert statutils.isglobalmax(T_array, margin) == _isglobalmax_bruteforce(T_array, margin)
+
+
+def test_empty_hyb_pattern():
+    # Same as before the linear-time kernels: valley scores raise for empty patterns, so the oligo is left out.
+    for scoremethod in (statutils.leftrightmaxdiff, statutils.valleyfinder, statutils.valleydepth,
+                        statutils.valleyscore):
+        with pytest.raises(ValueError):
+            scoremethod([])
+    assert statutils.leftrightmaxdiff([], boundary=0) == ([], [])
+    assert statutils.isglobalmax([]) == [] and statutils.globalmaxcount([]) == 0
+    assert statutils.maxlength([]) == 0
+    from staplestatter import staplestatter
+    scores = staplestatter.score_hyb_patterns({"0[0]": [14, 7, 21], "1[0]": []}, statutils.valleyscore)
+    assert scores == {"0[0]": 1}
+
+
+def _random_hyb_patterns(rng, n=200):
+    """ Random hybridization patterns, including empty and single-element ones, with int or float values. """
+    return {"%s[%s]" % (i, rng.randint(0, 400)) if i else "0[0]":
+            [rng.choice((rng.randint(0, 8), rng.randint(5, 30) + 0.1*rng.randint(0, 9)))
+             for _ in range(rng.choice((0, 1, 2, rng.randint(3, 12))))]
+            for i in range(n)}
+
+
+def test_batch_scoremethods_match_per_oligo():
+    rng = random.Random(1)
+    for _ in range(20):
+        # Empty patterns are scored one oligo at a time, see test_score_hyb_patterns_batch_matches_per_oligo:
+        hyb_patterns = {key: pattern for key, pattern in _random_hyb_patterns(rng).items() if pattern}
+        for name in statutils.BATCH_SCOREMETHODS:
+            for margin in (0, 1, 0.5):
+                scoremethod = getattr(statutils, name)
+                expected = {key: scoremethod(pattern, margin=margin) for key, pattern in hyb_patterns.items()}
+                assert statutils.batch_score_hyb_patterns(hyb_patterns, scoremethod, margin=margin) == expected
+    # Per-element results are lists, also when there are as many values as oligos:
+    for hyb_patterns in ({'a': [5], 'b': [6]}, {'a': [5, 1], 'b': []}):
+        expected = {key: statutils.valleydepth(pattern) if pattern else [] for key, pattern in hyb_patterns.items()}
+        assert statutils.batch_score_hyb_patterns(hyb_patterns, 'valleydepth') == expected
+
+
+def test_score_hyb_patterns_batch_matches_per_oligo(monkeypatch):
+    from staplestatter import staplestatter
+    hyb_patterns = _random_hyb_patterns(random.Random(4))
+    hyb_patterns.update({"1[0]": [], "1[1]": [7], "1[2]": []})
+    for name in statutils.BATCH_SCOREMETHODS:
+        scoremethod = getattr(statutils, name)
+        batch_scores = staplestatter.score_hyb_patterns(hyb_patterns, scoremethod)
+        with monkeypatch.context() as m:
+            m.setattr(statutils, "np", None)     # Score each oligo with the scoremethod.
+            assert batch_scores == staplestatter.score_hyb_patterns(hyb_patterns, scoremethod)
+        assert list(batch_scores) == [key for key in hyb_patterns if key in batch_scores]
+
+
+def test_tm_engine_matches_biopython():
+    MeltingTemp = pytest.importorskip("Bio.SeqUtils.MeltingTemp")
+    from staplestatter.meltingtemp import TmEngine
+    rng = random.Random(2)
+    for conditions in ({}, {'Mg': 10}, {'Mg': 12.5, 'Na': 5, 'dNTPs': 0.8}, {'saltcorr': 2, 'K': 10},
+                       {'saltcorr': 6, 'Mg': 5}, {'saltcorr': 7, 'Mg': 10}):
+        tm_engine = TmEngine(**conditions)
+        for _ in range(300):
+            seq = "".join(rng.choice("ACGT") for _ in range(rng.randint(2, 40)))
+            assert tm_engine.tm(seq) == MeltingTemp.Tm_NN(seq, **conditions)
+            assert tm_engine.tm(seq) == MeltingTemp.Tm_NN(seq, **conditions)  # memoized
+
+
+def test_tm_engine_sums_match_tm():
+    from staplestatter.meltingtemp import TmEngine
+    rng = random.Random(3)
+    for conditions in ({}, {'Mg': 10}, {'saltcorr': 2, 'K': 10}, {'saltcorr': 6, 'Mg': 5}):
+        tm_engine = TmEngine(**conditions)
+        assert tm_engine.bio_kwargs is None
+        pairs = tm_engine.nn_table_pairs()
+        for _ in range(300):
+            seq = "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 40)))
+            ends = seq[0] + seq[-1]
+            n_GC = seq.count("G") + seq.count("C")
+            delta_h, delta_s = tm_engine.end_terms(int(seq[0] == "T"), int(seq[-1] == "A"),
+                                                   ends.count("A") + ends.count("T"), int(n_GC > 0))
+            for i in range(len(seq) - 1):
+                delta_h += pairs[seq[i:i+2]][0]
+                delta_s += pairs[seq[i:i+2]][1]
+            assert tm_engine.tm_from_sums(delta_h, delta_s, len(seq), n_GC) == pytest.approx(tm_engine.tm(seq))
+
+
+def _batch_task(filename, factor):
+    if filename == "missing.json":
+        raise IOError("No such file")
+    return {'design': filename.split(".")[0], 'value': len(filename)*factor}
+
+
+def test_run_batch_collects_results_in_order():
+    from staplestatter import batchutils
+    results = batchutils.run_batch(_batch_task, ["b.json", "missing.json", "a.json"], (2,), jobs=1, progress=None)
+    assert [result['file'] for result in results] == ["b.json", "missing.json", "a.json"]
+    assert [result['status'] for result in results] == ["ok", "error", "ok"]
+    assert results[0]['value'] == 12 and "No such file" in results[1]['error']
+    table = batchutils.format_summary_table(results)
+    assert table.splitlines()[0].split() == ['file', 'status', 'design', 'value', 'wall', 'cpu', 'error']
+
+
+def _two_helix_json():
+    """
+    Two 16 bp helices; scaffold 0[0] -> 0[15] -> 1[15] -> 1[0], and two staples,
+    0[15] -> 0[8] -> 1[8] -> 1[15] and 0[7] -> 0[0] -> 1[0] -> 1[7]. One base inserted at 0[3].
+    """
+    W = 16
+    vstrands = [{"num": num, "row": 0, "col": num, "scaf": [[-1, -1, -1, -1] for _ in range(W)],
+                 "stap": [[-1, -1, -1, -1] for _ in range(W)], "loop": [0]*W, "skip": [0]*W, "stap_colors": []}
+                for num in (0, 1)]
+
+    def link(key, bases):
+        for i, (num, idx) in enumerate(bases):
+            prev_base = bases[i-1] if i else (-1, -1)
+            next_base = bases[i+1] if i+1 < len(bases) else (-1, -1)
+            vstrands[num][key][idx] = list(prev_base + next_base)
+
+    link("scaf", [(0, idx) for idx in range(W)] + [(1, idx) for idx in reversed(range(W))])
+    link("stap", [(0, idx) for idx in range(15, 7, -1)] + [(1, idx) for idx in range(8, 16)])
+    link("stap", [(0, idx) for idx in range(7, -1, -1)] + [(1, idx) for idx in range(0, 8)])
+    vstrands[0]["loop"][3] = 1
+    vstrands[0]["stap_colors"].append([15, 0xcc0000])
+    return {"name": "two_helix", "vstrands": vstrands}
+
+
+def test_cadnanojson_part():
+    from staplestatter import cadnanoreader
+    from staplestatter.cadnanojson import JsonPart
+    part = JsonPart(_two_helix_json())
+    oligos = {oligo.locString(): oligo for oligo in part.oligos()}
+    assert sorted(oligos) == ["0[0]", "0[15]", "0[7]"]
+    assert [oligo.length() for oligo in (oligos["0[0]"], oligos["0[15]"], oligos["0[7]"])] == [33, 16, 17]
+    assert oligos["0[15]"].color() == "#cc0000" and not oligos["0[0]"].isStaple()
+    assert cadnanoreader.get_oligo_hyb_pattern(part, method="length") == {"0[15]": [8, 8], "0[7]": [8, 8]}
+    scaffold = "".join(random.Random(4).choice("ACGT") for _ in range(33))
+    oligos["0[0]"].applySequence(scaffold)
+    # The first staple binds scaffold positions 9-16 (after the insertion) and 17-24:
+    assert oligos["0[15]"].sequence() == rcomp(scaffold[9:17]) + rcomp(scaffold[17:25])
+    assert list(cadnanoreader.get_oligo_hyb_pattern(part, method="seq")["0[7]"]) == \
+        [rcomp(scaffold[:9]), rcomp(scaffold[25:])]
+
+
+def test_compactpart_from_part():
+    from staplestatter import cadnanoreader
+    from staplestatter.cadnanojson import JsonPart
+    from staplestatter.compactpart import CompactPart
+    part = JsonPart(_two_helix_json())
+    scaffold = next(oligo for oligo in part.oligos() if not oligo.isStaple())
+    scaffold.applySequence("".join(random.Random(5).choice("ACGT") for _ in range(scaffold.length())))
+    compact = CompactPart.from_cadnano_part(part)
+    for method in ("length", "seq", "TM"):
+        expected = cadnanoreader.get_oligo_hyb_pattern(part, method=method)
+        assert {key: list(values) for key, values in expected.items()} == \
+            {key: list(values) for key, values in cadnanoreader.get_oligo_hyb_pattern(compact, method=method).items()}
+    assert cadnanoreader.get_hyb_pattern_index(compact).hyb_pattern(method="length") == {"0[15]": [8, 8], "0[7]": [8, 8]}
+    strand = compact.oligos()[0].strand5p()
+    assert strand == compact.strands()[strand.id] and strand in {compact.strands()[strand.id]}
+
+
+def test_part_hyb_regions_match_per_strand():
+    from staplestatter import cadnanoreader
+    from staplestatter.cadnanojson import JsonPart
+    from staplestatter.cadnanolib.util import sweep_overlaps
+    assert list(sweep_overlaps([(0, 9), (12, 20)], [(3, 14), (16, 30)])) == [(0, 0, 3, 9), (1, 0, 12, 14), (1, 1, 16, 20)]
+    part = JsonPart(_two_helix_json())
+    region_table = cadnanoreader.get_part_hyb_regions(part)
+    strands = [strand for oligo in part.oligos() for strand in oligo.strand5p().generator3pStrand()]
+    assert sorted(region_table, key=repr) == sorted(strands, key=repr)
+    for strand in strands:
+        assert region_table[strand] == cadnanoreader.getstrandhybridizationcomplements(strand)
+
+
+def test_synthetic_design_size():
+    from staplestatter import cadnanoreader
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=6, n_staples=60, seed=1)
+    staples = [oligo for oligo in part.oligos() if oligo.isStaple()]
+    scaffolds = [oligo for oligo in part.oligos() if not oligo.isStaple()]
+    assert len(scaffolds) == 1 and abs(len(staples) - 60) < 10
+    assert all(oligo.sequence() and " " not in oligo.sequence() for oligo in staples)
+    # Staples crossing the scaffold seam hybridize in two places on each helix:
+    lengths = cadnanoreader.get_oligo_hyb_pattern(part, method="length")
+    assert {len(pattern) for pattern in lengths.values()} == {2, 4}
+    assert sum(map(sum, lengths.values())) == scaffolds[0].length()
+
+
+def test_tracer_records_stages():
+    from staplestatter import cadnanoreader, timing
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=4, n_staples=20)
+    with timing.span("untraced"):   # No tracer active; does nothing.
+        pass
+    with timing.Tracer("test") as tracer:
+        assert timing.get_tracer() is tracer
+        cadnanoreader.get_oligo_hyb_pattern(part, method="TM", Mg=10)
+    assert timing.get_tracer() is None
+    stages = {stage['stage']: stage for stage in tracer.summary()}
+    assert stages['hyb_pattern']['calls'] == 1 and stages['tm']['calls'] > 1
+    assert stages['hyb_pattern']['wall'] >= stages['tm']['wall']
+    # Per-strand "tm" spans are only summarized:
+    assert sorted(event['name'] for event in tracer.as_dict()['traceEvents']) == ['hyb_pattern', 'hyb_regions']
+
+
+def test_compute_statspecs_progress_and_cancel():
+    from staplestatter import staplestatter
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=4, n_staples=20)
+    directive = staplestatter.load_directive(
+        "statspecs:\n - {scoremethod: maxlength}\n - {scoremethod: valleyscore, hyb_method: TM}\n")
+    progress = []
+    scored = staplestatter.compute_statspecs(directive, part, progress=lambda *args: progress.append(args))
+    assert [fraction for fraction, _ in progress] == [0, 0.5, 1]
+    scores, scorefreqs = scored[0]
+    assert scores == staplestatter.score_part_oligos(part, scoremethod=statutils.maxlength)
+    assert sum(count for _, count in scorefreqs) == len(scores)
+
+    def cancel(fraction, message):
+        if fraction > 0:
+            raise staplestatter.Cancelled()
+    with pytest.raises(staplestatter.Cancelled):
+        staplestatter.compute_statspecs(directive, part, progress=cancel)
+
+
+def test_incremental_scorer_rescores_changed_oligos():
+    from staplestatter import staplestatter, cadnanoreader
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=4, n_staples=20)
+    directive = staplestatter.load_directive(
+        "statspecs:\n - {scoremethod: maxlength}\n - {scoremethod: valleyscore, hyb_method: TM}\n")
+    scorer = staplestatter.IncrementalScorer(directive, part)
+    scored = scorer.update()
+    n_staples = len(scored[0][0])
+    assert scorer.rescored == 2*n_staples
+    assert scored == staplestatter.compute_statspecs(directive, part)
+    assert scorer.update() == scored and scorer.rescored == 0
+    staple = next(oligo for oligo in part.oligos() if oligo.isStaple())
+    cadnanoreader.get_hyb_pattern_index(part).invalidate([staple])
+    assert scorer.update() == scored and scorer.rescored == 2
+
+
+def test_hyb_pattern_index_is_freed_with_part():
+    import gc
+    import weakref
+    from staplestatter import cadnanoreader
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=4, n_staples=20)
+    cadnanoreader.get_hyb_pattern_index(part).hyb_pattern(method="TM")
+    assert cadnanoreader.get_hyb_pattern_index(part, create=False) is cadnanoreader.get_hyb_pattern_index(part)
+    part_ref = weakref.ref(part)
+    del part
+    gc.collect()
+    assert part_ref() is None
+
+
+def test_plot_mode(monkeypatch):
+    from staplestatter import plotutils
+    monkeypatch.delenv(plotutils.PLOT_MODE_ENVVAR, raising=False)
+    assert plotutils.get_plot_mode() == 'interactive'
+    assert plotutils.get_plot_mode('Agg') == 'headless'
+    monkeypatch.setenv(plotutils.PLOT_MODE_ENVVAR, 'none')
+    assert plotutils.get_plot_mode() == 'none' and plotutils.get_pyplot() is None
+    assert plotutils.get_plot_mode('headless') == 'headless'    # The directive takes precedence.
+    with pytest.raises(ValueError):
+        plotutils.get_plot_mode('svg')
+
+
+def test_process_statspecs_replots_in_place():
+    pytest.importorskip("matplotlib")
+    from staplestatter import staplestatter
+    from staplestatter.synthetic import make_synthetic_part
+    part = make_synthetic_part(n_helices=4, n_staples=20)
+    directive = staplestatter.load_directive(
+        "plot_mode: headless\nfigure: {newfigure: false}\n"
+        "statspecs:\n - {scoremethod: maxlength, plotspec: {subplot: 211}}\n"
+        " - {scoremethod: valleyscore, plotspec: {subplot: 212}}\n")
+    result = staplestatter.process_statspecs(directive, part, designname="a")
+    fig = result['figure']
+    assert len(fig.axes) == 2 and all(len(ax.collections) == 1 for ax in fig.axes)
+    again = staplestatter.process_statspecs(directive, part, designname="a")
+    assert again['figure'] is fig and again['lines'] == result['lines']
+    assert len(fig.axes) == 2 and all(len(ax.collections) == 1 for ax in fig.axes)
+    staplestatter.process_statspecs(directive, part, designname="b")
+    assert all(len(ax.collections) == 2 for ax in fig.axes)
+    fig.clf()
+    # The figure (and its plot model) is freed when closed:
+    import gc
+    import weakref
+    from staplestatter import plotutils
+    fig_ref = weakref.ref(fig)
+    plotutils.get_pyplot('headless').close(fig)
+    del fig, result, again
+    gc.collect()
+    assert fig_ref() is None
+
+
+def test_import_does_not_load_optional_dependencies():
+    """ yaml, matplotlib and cadnano are only imported when needed (see bin/benchmark.py import.*). """
+    import os
+    import sys
+    import subprocess
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys; import staplestatter.staplestatter, staplestatter.oligo_utils, staplestatter.fileutils; "
+            "print(' '.join(m for m in ('yaml', 'matplotlib', 'cadnano', 'Bio') if m in sys.modules))")
+    env = dict(os.environ, PYTHONPATH=rootdir)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=rootdir, env=env)
+    assert output.decode().split() == []
+
+
+def test_score_table_roundtrip(tmp_path):
+    pytest.importorskip("numpy")
+    from staplestatter import staplestatter
+    from staplestatter.scorestore import ScoreTable
+    stats = [{'1[2]': 3, '4[5]': 1}, None, {'4[5]': 7.5}]
+    statspecs = [{'scoremethod': 'valleyscore'}, {'scoremethod': 'nonexisting'}, {'scoremethod': 'maxlength'}]
+    hyb_patterns = [{'1[2]': [14, 7, 14, 21], '4[5]': [8]}, None, {'4[5]': [8]}]
+    filepath = str(tmp_path / "scores.npz")
+    staplestatter.savestats(stats, filepath, statspecs=statspecs, hyb_patterns=hyb_patterns)
+    table = ScoreTable.load(filepath)
+    assert len(table) == 3 and table.statspecs == statspecs
+    assert staplestatter.loadstats(filepath) == stats
+    assert table.column('locString', statspec=0).tolist() == ['1[2]', '4[5]']
+    assert table.hyb_pattern(0).tolist() == [14, 7, 14, 21]
+    assert table.hyb_pattern(2).tolist() == [8]
+    yamlpath = str(tmp_path / "scores.yaml")
+    staplestatter.savestats(stats, yamlpath)
+    assert staplestatter.loadstats(yamlpath) == stats
+    with pytest.raises(ValueError):
+        ScoreTable.from_scores([{'1[2]': [1, 2]}])
+
+
+def test_score_export_rows(tmp_path):
+    import csv
+    import json
+    from staplestatter import staplestatter, synthetic
+    part = synthetic.make_synthetic_part(n_helices=4, n_staples=20)
+    csvpath, ndjsonpath = str(tmp_path / "scores.csv"), str(tmp_path / "scores.ndjson")
+    directive = {'export_file': csvpath, 'export_tm_kwargs': {'Mg': 10},
+                 'statspecs': [{'scoremethod': 'maxlength', 'hyb_method': 'length'},
+                               {'scoremethod': 'valleyscore', 'hyb_method': 'TM', 'hyb_kwargs': {'Mg': 10}}]}
+    scored = staplestatter.compute_statspecs(directive, part, designname="test")
+    with open(csvpath) as fp:
+        rows = list(csv.DictReader(fp))
+    assert len(rows) == sum(len(scores) for scores, _ in scored)
+    row = rows[0]
+    assert row['design'] == "test" and row['statspec'] == "0" and row['hyb_method'] == "length"
+    lengths = [int(value) for value in row['hyb_pattern'].split()]
+    assert max(lengths) == float(row['score']) == scored[0][0][row['oligo']]
+    assert len(row['tm'].split()) == len(lengths)
+    directive.update(export_file=ndjsonpath, export_tm_kwargs=None)
+    staplestatter.compute_statspecs(directive, part)
+    with open(ndjsonpath) as fp:
+        rows = [json.loads(line) for line in fp]
+    assert [row['tm'] for row in rows if row['statspec'] == 0] == [None]*len(scored[0][0])
+    assert all(row['tm'] == row['hyb_pattern'] for row in rows if row['statspec'] == 1)
+
+
+def test_compiled_criteria_match_crit_match(monkeypatch):
+    from staplestatter import synthetic, oligo_utils
+    part = synthetic.make_synthetic_part(n_helices=6, n_staples=60)
+    oligos = part.oligos()
+    strand = oligos[7].strand5p()
+    criteria_sets = [{"st_type": "scaf"}, {"st_type": "stap", "length": [20, 30]}, {"length": [16, 18, 20]},
+                     {"color": oligos[3].color()}, {"vhnumber": 3, "idx5Prime": strand.idx5Prime()},
+                     [{"5pvhnumber": strand.virtualHelix().number()}, {"st_type": "scaf"}], []]
+    for use_numpy in (True, False):
+        if not use_numpy:
+            monkeypatch.setattr(oligo_utils, "np", None)
+        table = oligo_utils.OligoAttributeTable(part)
+        for criteria in criteria_sets:
+            expected = [oligo for oligo in oligos if oligo_utils.match_oligo(oligo, criteria)]
+            assert oligo_utils.get_matching_oligos(part, criteria, table=table) == expected
+        assert oligo_utils.get_matching_oligos(part, {"5pvhcoord": [0, None]}, table=table) == oligos
+    with pytest.raises(KeyError):
+        oligo_utils.get_matching_oligos(part, {"nonexisting": 1})
+
+
+def test_oligo_attribute_table_index():
+    from staplestatter import synthetic, oligo_utils
+    part = synthetic.make_synthetic_part(n_helices=6, n_staples=60)
+    oligos = part.oligos()
+    table = oligo_utils.OligoAttributeTable(part)
+    for oligo in oligos[::5]:
+        strand3p = oligo_utils.oligo_strand3p(oligo)
+        criteria = {"3pvhnumber": strand3p.virtualHelix().number(), "idx3Prime": strand3p.idx3Prime(),
+                    "st_type": "stap" if oligo.isStaple() else "scaf"}
+        assert oligo_utils.get_matching_oligos(part, criteria, table=table) == [oligo]
+    lengths = sorted(set(oligo.length() for oligo in oligos))
+    low, high = lengths[1], lengths[-2]
+    assert table.rows_in_range("length", low, high) == [
+        row for row, oligo in enumerate(oligos) if low <= oligo.length() <= high]
+    assert table.rows_in("length", (low, high, -1)) == [
+        row for row, oligo in enumerate(oligos) if oligo.length() in (low, high)]
+
+
+def test_circular_sequence_matches_rotated_copy():
+    from staplestatter.sequtils import CircularSequence
+    from staplestatter import synthetic, oligo_utils
+    seq = "ACGTTGCAAGGCT"
+    L = len(seq)
+    for offset in range(-L+1, L):
+        rotated, view = (seq*3)[L+offset:L*2+offset], CircularSequence(seq, offset)
+        assert str(view) == "".join(view) == rotated and len(view) == L
+        slices = [(i, j) for i in range(L+1) for j in range(L+1)]
+        assert [view[i:j] for i, j in slices] == [rotated[i:j] for i, j in slices]
+        assert view[-1] == rotated[-1] and view[::2] == rotated[::2]
+    assert CircularSequence(seq, L+2) == CircularSequence(seq, 2) == CircularSequence(seq, 1).rotated(1)
+    # Applying a rotated view gives the same sequences as applying a rotated copy:
+    part = synthetic.make_synthetic_part(n_helices=4, n_staples=20, apply_sequence=False)
+    scaffold = next(oligo for oligo in part.oligos() if not oligo.isStaple())
+    scafseq = synthetic.random_sequence(scaffold.length())
+    L = len(scafseq)
+    oligo_utils.apply_sequences(part, scafseq, offset=17)
+    assert scaffold.sequence() == (scafseq*3)[L+17:L*2+17]
+    staple_seqs = [oligo.sequence() for oligo in part.oligos()]
+    oligo_utils.apply_sequences(part, [{"seq": (scafseq*3)[L+17:L*2+17], "criteria": {"st_type": "scaf"}}])
+    assert [oligo.sequence() for oligo in part.oligos()] == staple_seqs
+
+
+def test_bulk_sequence_application_matches_per_oligo():
+    from staplestatter import synthetic, oligo_utils, cadnanoreader
+    from staplestatter.cadnanojson import JsonPart
+    design = synthetic.make_synthetic_design(n_helices=4, n_staples=20)
+    design["vstrands"][1]["loop"][20] = 2    # Insertion and skip, so both ways of re-building complements are used.
+    design["vstrands"][1]["skip"][30] = -1
+    bulk, single = JsonPart(design), JsonPart(design)
+    scaffold = next(oligo for oligo in bulk.oligos() if not oligo.isStaple())
+    scafseq = synthetic.random_sequence(scaffold.length())
+    staples = [oligo for oligo in bulk.oligos() if oligo.isStaple()]
+    # Scaffold and staples together are complementary, so the order of application matters:
+    for assignments in ([(scaffold, scafseq)], [(staples[0], "TTGCA"*30), (staples[1], "GATC"*40)],
+                        [(staples[3], "ACGT"*20), (scaffold, scafseq), (staples[5], None)]):
+        changed = oligo_utils.apply_oligo_sequences(bulk, assignments)
+        for oligo, seq in assignments:
+            single.oligos()[oligo.id].applySequence(seq)
+        assert [oligo.sequence() for oligo in bulk.oligos()] == [oligo.sequence() for oligo in single.oligos()]
+    assert set(changed) == set(bulk.oligos())
+    # Compact oligos have no signals, so cached hybridization patterns for the changed oligos are invalidated:
+    hyb_index = cadnanoreader.get_hyb_pattern_index(bulk)
+    before = hyb_index.hyb_pattern(method="seq")
+    oligo_utils.apply_oligo_sequences(bulk, [(scaffold, scafseq[::-1])])
+    after = hyb_index.hyb_pattern(method="seq")
+    assert after != before and after == cadnanoreader.get_oligo_hyb_pattern(bulk, method="seq")
+
+
+def test_scaffold_rotation_loads_json_without_cadnano(tmp_path, monkeypatch):
+    import os
+    import sys
+    import json
+    from staplestatter import synthetic
+    from staplestatter.cadnanojson import load_cadnano_json
+    monkeypatch.setitem(sys.modules, "cadnano", None)   # cadnano cannot be imported.
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
+    import scaffold_rotation
+    cadnano_file = str(tmp_path / "design.json")
+    with open(cadnano_file, "w") as fp:
+        json.dump(synthetic.make_synthetic_design(n_helices=4, n_staples=20), fp)
+    part = load_cadnano_json(cadnano_file)
+    scafseq = synthetic.random_sequence(next(oligo for oligo in part.oligos() if not oligo.isStaple()).length())
+    args = {'verbose': 0, 'seqfile': "scaffold.txt", 'plot_filename': None, 'show_plot': False, 'overwrite': True,
+            'save_rotation_scores': str(tmp_path / "{design}.rotationscores.json"), 'offsetrange': (0, 10)}
+    summary = scaffold_rotation.process_cadnano_file(cadnano_file, args, scafseq)
+    expected = scaffold_rotation.get_offset_rotation_scores(part, scafseq, (0, 10))
+    assert summary['offsets'] == 10 and summary['first_offset_score'] == expected[0][1]
+    assert os.path.exists(str(tmp_path / "design.rotationscores.json"))
+    # The --jobs worker processes load the design the same way:
+    scaffold_rotation._init_rotation_worker(cadnano_file, scafseq, False, 0)
+    assert scaffold_rotation._rotation_worker_scores((0, 10)) == expected
+
+
+def test_load_sequence_files(tmp_path, monkeypatch):
+    from staplestatter import sequtils
+    (tmp_path / "scaf.txt").write_text(u"# M13 variant\nacgt acgu\n  TTGG 12\n")
+    (tmp_path / "big.txt").write_text(u"ACGT\n"*3000)
+    (tmp_path / "scafs.fasta").write_text(u">p8064 st_type=scaf offset=10\nACGTAC\nGGTT\n"
+                                          u">mini st_type=stap length=42\r\nttaa\r\n")
+    (tmp_path / "scaf.gb").write_text(u"LOCUS       pUC19  10 bp  DNA  circular\nFEATURES   source  1..10\n"
+                                      u"ORIGIN\n        1 gattc gacta\n//\n")
+    (tmp_path / "specs.yaml").write_text(u"- {record: mini, seqfile: scafs.fasta, criteria: {st_type: stap}}\n")
+    (tmp_path / "offset.fasta").write_text(u">p8064 offset=-3\nACGTAC\n")
+    for mmap_min_size in (1 << 20, 0):
+        monkeypatch.setattr(sequtils, "MMAP_MIN_SIZE", mmap_min_size)
+        monkeypatch.setattr(sequtils, "_sequence_libraries", {})
+        monkeypatch.setattr(sequtils, "_CLEAN_CHUNK_SIZE", 7)     # Memory mapped files are cleaned in chunks.
+        assert sequtils.read_sequence_records(str(tmp_path / "scaf.txt")) == [(None, "ACGTACGUTTGG")]
+        assert sequtils.read_sequence_records(str(tmp_path / "big.txt")) == [(None, "ACGT"*3000)]
+        assert sequtils.read_sequence_records(str(tmp_path / "scaf.gb")) == [("pUC19", "GATTCGACTA")]
+        seqspecs = sequtils.load_seq({"seqfile": str(tmp_path / "scafs.fasta"), "simple_seq": True})
+        assert seqspecs == [
+            {"name": "p8064", "seq": "ACGTACGGTT", "bp": 10, "offset": 10, "criteria": {"st_type": "scaf"}},
+            {"name": "mini", "seq": "TTAA", "bp": 4, "criteria": {"st_type": "stap", "length": 42}}]
+        assert sequtils.load_seq({"seqfile": str(tmp_path / "scaf.gb"), "simple_seq": True}) == "GATTCGACTA"
+        # Offset and criteria in the header of a single record are not dropped for simple sequences:
+        assert sequtils.load_seq({"seqfile": str(tmp_path / "offset.fasta"), "simple_seq": True}) == [
+            {"name": "p8064", "seq": "ACGTAC", "bp": 6, "offset": -3, "criteria": {"st_type": "scaf"}}]
+        assert sequtils.load_seq({"seqfile": str(tmp_path / "scaf.gb"), "simple_seq": False}) == [
+            {"name": "pUC19", "seq": "GATTCGACTA", "bp": 10, "criteria": {"st_type": "scaf"}}]
+        assert sequtils.load_seq({"seqfile": str(tmp_path / "specs.yaml")}) == [
+            {"record": "mini", "seqfile": "scafs.fasta", "criteria": {"st_type": "stap"},
+             "seq": "TTAA", "name": "mini"}]
+    # Letters that are not bases would shift the sequence, and headers must only have criteria as key=value words:
+    for name, content in (("iupac.fasta", u">p8064\nACGTNNACGT\n"), ("iupac.txt", u"ACGT-ACGT\n"),
+                          ("uniprot.fasta", u">sp|P69905 Hemoglobin OS=Homo sapiens OX=9606\nACGT\n")):
+        (tmp_path / name).write_text(content)
+        with pytest.raises(ValueError):
+            sequtils.load_seq({"seqfile": str(tmp_path / name), "simple_seq": False})